@@ -6,7 +6,7 @@ from raytracer.lights import DirectionalLight
 from raytracer.linalg import Vec3
 from raytracer.materials import Diffuse, ReflectRefract
 from raytracer.materials.reflect import Reflect
-from raytracer.objects import Sphere
+from raytracer.objects import Plane, Sphere
 from raytracer.options import Resolution, Settings
 from raytracer.visualize import save_png
 
@@ -20,7 +20,8 @@ settings = Settings(
     bias=1e-4,
 )
 
-objects = [Sphere(Vec3(0, -1000, 0), 1000, Diffuse(Vec3.from_rgb(123, 201, 255)))]
+floor = Plane(Vec3(0, 0, 0), Vec3(0, 1, 0), Diffuse(Vec3.from_rgb(123, 201, 255)))
+balls = []
 num_objects = 10
 for i in range(num_objects):
     radius = uniform(1, 5)
@@ -31,7 +32,7 @@ for i in range(num_objects):
     )
 
     # make sure new sphere is not inside any other ones
-    for prev in objects:
+    for prev in balls:
         distance = origin.distance(prev.origin)
         if distance < radius + prev.radius:
             break
@@ -42,7 +43,9 @@ for i in range(num_objects):
         else:
             material = ReflectRefract(1.52)
             # material = Reflect()
-        objects.append(Sphere(origin, radius, material))
+        balls.append(Sphere(origin, radius, material))
+
+objects = [floor, *balls]
 
 lights = [
     DirectionalLight(Vec3(0.5, -0.5, 0.5), Vec3.from_rgb(255, 255, 255), 1),
@@ -1,5 +1,20 @@
-from raytracer.render import render
+from raytracer.render import (
+    relight,
+    render,
+    render_iter,
+    render_scene,
+    render_scene_iter,
+)
+from raytracer.scene import CompiledScene, compile_scene
 
 __version__ = "0.1.0"
 
-__all__ = ["render"]
+__all__ = [
+    "render",
+    "render_scene",
+    "render_iter",
+    "render_scene_iter",
+    "relight",
+    "compile_scene",
+    "CompiledScene",
+]
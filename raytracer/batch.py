@@ -0,0 +1,20 @@
+from typing import Any, List
+
+# numpy is optional, everything in here has a scalar
+# fallback and is only used when HAS_NUMPY is True
+try:
+    import numpy
+
+    HAS_NUMPY = True
+except ImportError:
+    HAS_NUMPY = False
+
+
+def to_array(values: List[Any]) -> Any:
+    # returns a numpy array when possible so that the scalar
+    # fallbacks return the same types as the numpy kernels
+    if HAS_NUMPY:
+        import numpy as np
+
+        return np.asarray(values)
+    return values
@@ -0,0 +1,575 @@
+import argparse
+import importlib
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Dict, List, Optional, Sequence
+
+from raytracer.batch import HAS_NUMPY
+from raytracer.lights import DirectionalLight, Light, PointLight
+from raytracer.linalg import Vec3
+from raytracer.materials import Diffuse, Material, Reflect, ReflectRefract
+from raytracer.objects import Mesh, Object, Sphere, Triangle
+from raytracer.objects.objfile import parse_obj
+from raytracer.options import Resolution, Settings
+from raytracer.render import render
+from raytracer.stats import RenderStats
+from raytracer.visualize import save_png
+
+# usage: python -m raytracer.bench [scene ...] [--json out.json]
+# see --help for the options, scenes are the example scripts
+# at a lower resolution plus a few synthetic stress tests
+
+SCENES = [
+    "many-balls",
+    "rainbow",
+    "circle",
+    "color-lights",
+    "mesh",
+    "spheres",
+    "triangles",
+]
+
+# models/cube.obj without the texture coordinates and normals
+CUBE_OBJ = """\
+v 1.000000 -1.000000 -1.000000
+v 1.000000 -1.000000 1.000000
+v -1.000000 -1.000000 1.000000
+v -1.000000 -1.000000 -1.000000
+v 1.000000 1.000000 -0.999999
+v 0.999999 1.000000 1.000001
+v -1.000000 1.000000 1.000000
+v -1.000000 1.000000 -1.000000
+f 2 3 4
+f 8 7 6
+f 5 6 2
+f 6 7 3
+f 3 7 8
+f 1 4 8
+f 1 2 4
+f 5 8 6
+f 1 5 2
+f 2 6 3
+f 4 3 8
+f 5 1 8
+"""
+
+
+class BenchScene:
+    __slots__ = (
+        "name",
+        "look_from",
+        "look_at",
+        "objects",
+        "lights",
+        "settings",
+        "anti_aliasing",
+        "recursion_depth",
+    )
+
+    def __init__(
+        self,
+        name: str,
+        look_from: Vec3,
+        look_at: Vec3,
+        objects: List[Object],
+        lights: List[Light],
+        settings: Settings,
+        anti_aliasing: int = 2,
+        recursion_depth: int = 10,
+    ):
+        self.name = name
+        self.look_from = look_from
+        self.look_at = look_at
+        self.objects = objects
+        self.lights = lights
+        self.settings = settings
+        self.anti_aliasing = anti_aliasing
+        self.recursion_depth = recursion_depth
+
+    def primitive_count(self) -> int:
+        return sum(max(1, obj.primitive_count()) for obj in self.objects)
+
+
+def sphere_obj(segments: int) -> str:
+    # obj text of a uv sphere with radius 1, the caps are
+    # triangles and everything else quads (two triangles each)
+    rings = max(2, segments // 2)
+    lines = ["v 0 1 0"]
+    for r in range(1, rings):
+        theta = math.pi * r / rings
+        for s in range(segments):
+            phi = 2 * math.pi * s / segments
+            x = math.sin(theta) * math.cos(phi)
+            z = math.sin(theta) * math.sin(phi)
+            lines.append(f"v {x:.6f} {math.cos(theta):.6f} {z:.6f}")
+    lines.append("v 0 -1 0")
+
+    bottom = len(lines)
+    for s in range(segments):
+        t = (s + 1) % segments
+        lines.append(f"f 1 {t + 2} {s + 2}")
+        for r in range(rings - 2):
+            a = 2 + r * segments
+            b = a + segments
+            lines.append(f"f {a + s} {a + t} {b + t} {b + s}")
+        last = 2 + (rings - 2) * segments
+        lines.append(f"f {last + s} {last + t} {bottom}")
+    return "\n".join(lines) + "\n"
+
+
+def many_balls(res: Resolution) -> BenchScene:
+    rand = random.Random(123)
+    settings = Settings(Vec3.from_rgb(255, 252, 222), res, 1, 70, 1e-4)
+
+    spheres = [Sphere(Vec3(0, -1000, 0), 1000, Diffuse(Vec3.from_rgb(123, 201, 255)))]
+    for _ in range(10):
+        radius = rand.uniform(1, 5)
+        origin = Vec3(rand.uniform(-10, 10), radius, rand.uniform(-10, 10))
+        if any(origin.distance(s.origin) < radius + s.radius for s in spheres):
+            continue
+        if rand.uniform(0, 1) < 0.5:
+            color = Vec3.from_rgb(*[rand.uniform(0, 255) for _ in range(3)])
+            spheres.append(Sphere(origin, radius, Diffuse(color)))
+        else:
+            spheres.append(Sphere(origin, radius, ReflectRefract(1.52)))
+
+    lights: List[Light] = [
+        DirectionalLight(Vec3(0.5, -0.5, 0.5), Vec3.from_rgb(255, 255, 255), 1),
+        DirectionalLight(Vec3(-0.5, -0.5, -0.5), Vec3.from_rgb(255, 255, 255), 1),
+    ]
+    objects: List[Object] = list(spheres)
+    return BenchScene(
+        "many-balls", Vec3(20, 7, -5), Vec3(0, 1, 0), objects, lights, settings
+    )
+
+
+def rainbow(res: Resolution) -> BenchScene:
+    settings = Settings(Vec3.from_rgb(184, 255, 217), res, 1, 70, 0.01)
+    objects: List[Object] = [
+        Triangle(Vec3(-10, -2, -10), Vec3(10, -2, -10), Vec3(-10, -2, 10), Reflect()),
+        Triangle(Vec3(10, -2, -10), Vec3(-10, -2, 10), Vec3(10, -2, 10), Reflect()),
+        Sphere(Vec3(2, 0, -7.5), 1, Diffuse(Vec3.from_rgb(255, 0, 0))),
+        Sphere(Vec3(3, 0, -5), 1, Diffuse(Vec3.from_rgb(255, 127, 0))),
+        Sphere(Vec3(4, 0, -2.5), 1, Diffuse(Vec3.from_rgb(255, 255, 0))),
+        Sphere(Vec3(5, 0, 0), 1, Diffuse(Vec3.from_rgb(0, 255, 0))),
+        Sphere(Vec3(4, 0, 2.5), 1, Diffuse(Vec3.from_rgb(0, 0, 255))),
+        Sphere(Vec3(3, 0, 5), 1, Diffuse(Vec3.from_rgb(75, 0, 130))),
+        Sphere(Vec3(2, 0, 7.5), 1, Diffuse(Vec3.from_rgb(148, 0, 211))),
+        Sphere(Vec3(8, 4, 0), 2, Reflect()),
+    ]
+    lights: List[Light] = [
+        DirectionalLight(Vec3(-1, -1, -0.9), Vec3(1, 1, 1), 1),
+        DirectionalLight(Vec3(1, -0.3, 1), Vec3(1, 1, 1), 1),
+    ]
+    return BenchScene(
+        "rainbow", Vec3(-10, 0, 0), Vec3(-9, 0, 0), objects, lights, settings
+    )
+
+
+def circle(res: Resolution) -> BenchScene:
+    settings = Settings(Vec3.from_rgb(30, 198, 167), res, 1, 70, 1e-4)
+    white = Diffuse(Vec3.from_rgb(255, 255, 255))
+    h = 2.5 * math.sqrt(3)
+    vertices, indices = parse_obj(CUBE_OBJ, translate=Vec3(-2.5, 1, h))
+    objects: List[Object] = [
+        Sphere(Vec3(0, -10000, 0), 10000, Diffuse(Vec3.from_rgb(200, 200, 200))),
+        Sphere(Vec3(-5, 1, 0), 1, white),
+        Sphere(Vec3(5, 1, 0), 1, white),
+        Mesh(vertices, indices, white),
+        Sphere(Vec3(2.5, 1, -h), 1, white),
+        Sphere(Vec3(-2.5, 1, -h), 1, white),
+        Sphere(Vec3(2.5, 1, h), 1, white),
+    ]
+    lights: List[Light] = [PointLight(Vec3(0, 3, 0), Vec3.from_rgb(125, 80, 255), 1)]
+    return BenchScene(
+        "circle", Vec3(-12, 5, 3), Vec3(0, 1, 0), objects, lights, settings
+    )
+
+
+def color_lights(res: Resolution) -> BenchScene:
+    settings = Settings(Vec3.from_rgb(66, 66, 66), res, 1, 70, 0.01)
+    white = Diffuse(Vec3.from_rgb(255, 255, 255))
+    objects: List[Object] = [
+        Triangle(Vec3(-10, -2, -10), Vec3(10, -2, -10), Vec3(-10, -2, 10), white),
+        Triangle(Vec3(10, -2, -10), Vec3(10, -2, 10), Vec3(-10, -2, 10), white),
+        Sphere(Vec3(0, 0, 0), 2, white),
+    ]
+    lights: List[Light] = [
+        PointLight(Vec3(-5, 0, -5), Vec3.from_rgb(255, 0, 0), 1),
+        PointLight(Vec3(-5, 0, 3), Vec3.from_rgb(0, 255, 0), 1),
+        PointLight(Vec3(-4, 3, 0), Vec3.from_rgb(0, 0, 255), 0.5),
+    ]
+    return BenchScene(
+        "color-lights", Vec3(-10, 0, 0), Vec3(-9, 0, 0), objects, lights, settings
+    )
+
+
+def mesh(res: Resolution, count: int, obj_file: Optional[str] = None) -> BenchScene:
+    # obj_file, or a generated sphere with about count triangles,
+    # standing on a diffuse floor next to a mirror ball
+    settings = Settings(Vec3.from_rgb(200, 220, 255), res, 1, 60, 1e-4)
+    material = Diffuse(Vec3.from_rgb(230, 180, 120))
+    if obj_file is not None:
+        model = Mesh.from_obj(obj_file, material)
+    else:
+        segments = max(4, round(math.sqrt(count)))
+        vertices, indices = parse_obj(
+            sphere_obj(segments), scale=2, translate=Vec3(0, 2, 0)
+        )
+        model = Mesh(vertices, indices, material)
+
+    objects: List[Object] = [
+        Sphere(Vec3(0, -1000, 0), 1000, Diffuse(Vec3.from_rgb(180, 180, 180))),
+        model,
+        Sphere(Vec3(-3.5, 1.2, -1.5), 1.2, Reflect()),
+    ]
+    lights: List[Light] = [
+        DirectionalLight(Vec3(-0.5, -1, -0.3), Vec3(1, 1, 1), 1),
+        PointLight(Vec3(3, 6, 4), Vec3(1, 1, 1), 1),
+    ]
+    return BenchScene("mesh", Vec3(-6, 5, 8), Vec3(0, 2, 0), objects, lights, settings)
+
+
+def spheres(res: Resolution, count: int) -> BenchScene:
+    rand = random.Random(0)
+    settings = Settings(Vec3.from_rgb(255, 252, 222), res, 1, 70, 1e-4)
+    objects: List[Object] = [
+        Sphere(Vec3(0, -1000, 0), 1000, Diffuse(Vec3.from_rgb(123, 201, 255)))
+    ]
+    for _ in range(count):
+        origin = Vec3(rand.uniform(-20, 20), rand.uniform(0, 10), rand.uniform(-20, 20))
+        k = rand.uniform(0, 1)
+        if k < 0.8:
+            color = Vec3.from_rgb(*[rand.uniform(0, 255) for _ in range(3)])
+            material: Material = Diffuse(color)
+        elif k < 0.9:
+            material = Reflect()
+        else:
+            material = ReflectRefract(1.52)
+        objects.append(Sphere(origin, rand.uniform(0.1, 0.6), material))
+
+    lights: List[Light] = [DirectionalLight(Vec3(0.5, -1, 0.3), Vec3(1, 1, 1), 1)]
+    return BenchScene(
+        "spheres", Vec3(30, 15, -10), Vec3(0, 2, 0), objects, lights, settings
+    )
+
+
+def triangles(res: Resolution, count: int) -> BenchScene:
+    rand = random.Random(0)
+    settings = Settings(Vec3.from_rgb(255, 252, 222), res, 1, 70, 1e-4)
+    objects: List[Object] = [
+        Sphere(Vec3(0, -1000, 0), 1000, Diffuse(Vec3.from_rgb(123, 201, 255)))
+    ]
+    for _ in range(count):
+        a = Vec3(rand.uniform(-20, 20), rand.uniform(0, 10), rand.uniform(-20, 20))
+        b, c = [a + Vec3(*[rand.uniform(-1, 1) for _ in range(3)]) for _ in range(2)]
+        color = Vec3.from_rgb(*[rand.uniform(0, 255) for _ in range(3)])
+        objects.append(Triangle(a, b, c, Diffuse(color)))
+
+    lights: List[Light] = [DirectionalLight(Vec3(0.5, -1, 0.3), Vec3(1, 1, 1), 1)]
+    return BenchScene(
+        "triangles", Vec3(30, 15, -10), Vec3(0, 2, 0), objects, lights, settings
+    )
+
+
+def make_scene(
+    name: str,
+    width: int,
+    height: int,
+    count: int = 1000,
+    obj_file: Optional[str] = None,
+) -> BenchScene:
+    res = Resolution(width, height)
+    if name == "many-balls":
+        return many_balls(res)
+    if name == "rainbow":
+        return rainbow(res)
+    if name == "circle":
+        return circle(res)
+    if name == "color-lights":
+        return color_lights(res)
+    if name == "mesh":
+        return mesh(res, count, obj_file)
+    if name == "spheres":
+        return spheres(res, count)
+    if name == "triangles":
+        return triangles(res, count)
+    raise ValueError(f"unknown scene {name!r}, expected one of {SCENES}")
+
+
+def run_scene(
+    scene: BenchScene,
+    repeat: int = 3,
+    threads: int = 1,
+    vectorize: bool = False,
+    heatmap: Optional[str] = None,
+) -> Dict[str, Any]:
+    def run(stats: Optional[RenderStats], threads: int) -> float:
+        start = time.perf_counter()
+        render(
+            scene.look_from,
+            scene.look_at,
+            scene.objects,
+            scene.lights,
+            scene.settings,
+            anti_aliasing=scene.anti_aliasing,
+            recursion_depth=scene.recursion_depth,
+            threads=threads,
+            vectorize=vectorize,
+            stats=stats,
+        )
+        return time.perf_counter() - start
+
+    # ray counts and memory come from one untimed serial render,
+    # counting and tracemalloc would skew the timed ones
+    stats = RenderStats()
+    tracemalloc.start()
+    try:
+        run(stats, threads=1)
+        peak_memory = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    if heatmap is not None:
+        save_png(stats.heatmap(), heatmap)
+
+    times = [run(None, threads) for _ in range(repeat)]
+    best = min(times)
+    return {
+        "scene": scene.name,
+        "width": int(scene.settings.resolution.w),
+        "height": int(scene.settings.resolution.h),
+        "anti_aliasing": scene.anti_aliasing,
+        "recursion_depth": scene.recursion_depth,
+        "objects": len(scene.objects),
+        "primitives": scene.primitive_count(),
+        "time": best,
+        "times": times,
+        **stats.as_dict(),
+        "rays_per_second": stats.total_rays / best,
+        "primary_rays_per_second": stats.primary_rays / best,
+        "secondary_rays_per_second": stats.secondary_rays / best,
+        "shadow_rays_per_second": stats.shadow_rays / best,
+        "peak_memory": peak_memory,
+    }
+
+
+def is_compiled() -> bool:
+    # mypyc builds replace the .py modules with extension modules,
+    # (raytracer.render itself is shadowed by the render function)
+    module = importlib.import_module("raytracer.render")
+    return not (module.__file__ or "").endswith(".py")
+
+
+def run_benchmarks(
+    names: Sequence[str],
+    width: int,
+    height: int,
+    count: int = 1000,
+    obj_file: Optional[str] = None,
+    repeat: int = 3,
+    threads: int = 1,
+    vectorize: bool = False,
+    heatmap_dir: Optional[str] = None,
+    verbose: bool = True,
+) -> Dict[str, Any]:
+    results = []
+    for name in names:
+        scene = make_scene(name, width, height, count, obj_file)
+        heatmap = None
+        if heatmap_dir is not None:
+            heatmap = os.path.join(heatmap_dir, f"{name}.png")
+        result = run_scene(scene, repeat, threads, vectorize, heatmap)
+        if verbose:
+            print(format_result(result), flush=True)
+        results.append(result)
+
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "compiled": is_compiled(),
+        "numpy": HAS_NUMPY,
+        "threads": threads,
+        "vectorize": vectorize,
+        "repeat": repeat,
+        "results": results,
+    }
+
+
+def format_result(result: Dict[str, Any]) -> str:
+    return (
+        f"{result['scene']:<13} {result['time']:8.3f}s"
+        f" {result['rays_per_second'] / 1e3:9.1f}k rays/s"
+        f" (primary {result['primary_rays_per_second'] / 1e3:.1f}k,"
+        f" secondary {result['secondary_rays_per_second'] / 1e3:.1f}k,"
+        f" shadow {result['shadow_rays_per_second'] / 1e3:.1f}k)"
+        f" peak {result['peak_memory'] / 2**20:.1f} MiB"
+    )
+
+
+def compare(
+    base: Dict[str, Any], new: Dict[str, Any], tolerance: float = 0.1
+) -> List[str]:
+    # prints the speedup of new over base for every scene they share,
+    # returns the scenes that got slower by more than tolerance
+    base_times = {r["scene"]: r["time"] for r in base["results"]}
+    slower = []
+    for result in new["results"]:
+        name = result["scene"]
+        if name not in base_times:
+            continue
+        speedup = base_times[name] / result["time"]
+        flag = ""
+        if result["time"] > base_times[name] * (1 + tolerance):
+            slower.append(name)
+            flag = "  SLOWER"
+        print(
+            f"{name:<13} {base_times[name]:8.3f}s -> {result['time']:8.3f}s"
+            f"  {speedup:5.2f}x{flag}"
+        )
+    return slower
+
+
+def _child_args(args: argparse.Namespace) -> List[str]:
+    ret = list(args.scenes)
+    ret += ["--width", str(args.width), "--height", str(args.height)]
+    ret += ["--count", str(args.count), "--repeat", str(args.repeat)]
+    ret += ["--threads", str(args.threads)]
+    if args.obj is not None:
+        ret += ["--obj", os.path.abspath(args.obj)]
+    if args.vectorize:
+        ret.append("--vectorize")
+    if args.heatmaps is not None:
+        ret += ["--heatmaps", os.path.abspath(args.heatmaps)]
+    return ret
+
+
+def compare_mypyc(args: argparse.Namespace) -> Dict[str, Any]:
+    # runs the benchmark on a pure python copy and on a mypyc build
+    # (from setup.py) of this package, each in a process of its own
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    setup_py = os.path.join(os.path.dirname(package_dir), "setup.py")
+    if not os.path.exists(setup_py):
+        raise SystemExit(f"{setup_py} not found, --mypyc needs a source checkout")
+
+    # compiled modules can't be run with python -m
+    code = "import sys; from raytracer.bench import main; sys.exit(main(sys.argv[1:]))"
+    ignore = shutil.ignore_patterns("__pycache__", "*.so", "*.pyd", "*.c")
+    ret: Dict[str, Any] = {}
+    with tempfile.TemporaryDirectory(prefix="raytracer-bench-") as tmp:
+        for kind in ("python", "mypyc"):
+            root = os.path.join(tmp, kind)
+            shutil.copytree(package_dir, os.path.join(root, "raytracer"), ignore=ignore)
+            if kind == "mypyc":
+                print("building with mypyc...", flush=True)
+                shutil.copy(setup_py, root)
+                build = subprocess.run(
+                    [sys.executable, "setup.py", "build_ext", "--inplace"],
+                    cwd=root,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.STDOUT,
+                    text=True,
+                )
+                if build.returncode != 0:
+                    sys.stderr.write(build.stdout)
+                    raise SystemExit("mypyc build failed")
+
+            print(f"{kind}:", flush=True)
+            out = os.path.join(tmp, f"{kind}.json")
+            env = dict(os.environ, PYTHONPATH=root)
+            subprocess.run(
+                [sys.executable, "-c", code, *_child_args(args), "--json", out],
+                cwd=root,
+                env=env,
+                check=True,
+            )
+            with open(out) as f:
+                ret[kind] = json.load(f)
+
+    print("mypyc speedup:")
+    compare(ret["python"], ret["mypyc"], math.inf)
+    return ret
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m raytracer.bench", description="raytracer benchmarks"
+    )
+    parser.add_argument(
+        "scenes", nargs="*", default=SCENES, help=f"any of {', '.join(SCENES)}"
+    )
+    parser.add_argument("--width", type=int, default=160)
+    parser.add_argument("--height", type=int, default=90)
+    parser.add_argument(
+        "--count",
+        type=int,
+        default=1000,
+        help="primitives in the spheres, triangles and mesh scenes",
+    )
+    parser.add_argument("--obj", help="obj file for the mesh scene")
+    parser.add_argument("--repeat", type=int, default=3, help="best of N renders")
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument("--vectorize", action="store_true")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument(
+        "--heatmaps", help="save a per-pixel cost heatmap of every scene here"
+    )
+    parser.add_argument(
+        "--baseline", help="json file of an earlier run to compare against"
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.1,
+        help="fail if a scene is slower than the baseline by more than this",
+    )
+    parser.add_argument(
+        "--mypyc",
+        action="store_true",
+        help="compare pure python against a mypyc build from setup.py",
+    )
+    args = parser.parse_args(argv)
+
+    for name in args.scenes:
+        if name not in SCENES:
+            parser.error(f"unknown scene {name!r}, expected one of {SCENES}")
+
+    if args.mypyc:
+        data = compare_mypyc(args)
+    else:
+        data = run_benchmarks(
+            args.scenes,
+            args.width,
+            args.height,
+            args.count,
+            args.obj,
+            args.repeat,
+            args.threads,
+            args.vectorize,
+            args.heatmaps,
+        )
+
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump(data, f, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            base = json.load(f)
+        new = data["mypyc"] if args.mypyc else data
+        if compare(base, new, args.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,471 @@
+from __future__ import annotations
+
+from array import array
+from typing import List, Optional, Sequence, Tuple, cast
+
+from raytracer.linalg import Vec3
+from raytracer.objects import Instance, Object
+from raytracer.stats import RenderStats
+
+# binned surface area heuristic
+SAH_BINS = 12
+# cost of visiting a node relative to one primitive intersection
+TRAVERSAL_COST = 1.0
+MAX_LEAF_SIZE = 4
+
+# sub index of instances, which report the face they were hit on
+INSTANCE_SUB = -2
+
+# stand-in for 1 / 0 in the slab test, avoids 0 * inf = nan
+_INV_ZERO = 1e300
+
+
+def _inv(d: float) -> float:
+    if d == 0:
+        return _INV_ZERO
+    return 1 / d
+
+
+def _area(lo: List[float], hi: List[float]) -> float:
+    dx = hi[0] - lo[0]
+    dy = hi[1] - lo[1]
+    dz = hi[2] - lo[2]
+    if dx < 0 or dy < 0 or dz < 0:
+        return 0
+    return 2 * (dx * dy + dy * dz + dz * dx)
+
+
+def _min3(a: List[float], b: List[float]) -> List[float]:
+    return [min(a[0], b[0]), min(a[1], b[1]), min(a[2], b[2])]
+
+
+def _max3(a: List[float], b: List[float]) -> List[float]:
+    return [max(a[0], b[0]), max(a[1], b[1]), max(a[2], b[2])]
+
+
+def _find_split(
+    prims: List[int],
+    first: int,
+    count: int,
+    node_area: float,
+    lo: List["array[float]"],
+    hi: List["array[float]"],
+    centroid: List["array[float]"],
+) -> Optional[Tuple[int, int]]:
+    # returns (axis, number of primitives in the left child)
+    # after partitioning prims, or None if a leaf is cheaper
+    span = prims[first : first + count]
+    lo_x, lo_y, lo_z = lo
+    hi_x, hi_y, hi_z = hi
+
+    # small nodes don't need the full number of bins
+    bins = min(SAH_BINS, count)
+    inf = float("inf")
+
+    best_cost = float(count)
+    best_axis = -1
+    best_bin = -1
+    best_lo = 0.0
+    best_scale = 0.0
+    for axis in range(3):
+        cent = centroid[axis]
+        c_lo = min([cent[p] for p in span])
+        extent = max([cent[p] for p in span]) - c_lo
+        if extent <= 0:
+            continue
+        scale = bins / extent
+
+        bin_count = [0] * bins
+        bin_lo = [[inf, inf, inf] for _ in range(bins)]
+        bin_hi = [[-inf, -inf, -inf] for _ in range(bins)]
+        for p in span:
+            b = min(bins - 1, int((cent[p] - c_lo) * scale))
+            bin_count[b] += 1
+            b_lo = bin_lo[b]
+            b_hi = bin_hi[b]
+            v = lo_x[p]
+            if v < b_lo[0]:
+                b_lo[0] = v
+            v = lo_y[p]
+            if v < b_lo[1]:
+                b_lo[1] = v
+            v = lo_z[p]
+            if v < b_lo[2]:
+                b_lo[2] = v
+            v = hi_x[p]
+            if v > b_hi[0]:
+                b_hi[0] = v
+            v = hi_y[p]
+            if v > b_hi[1]:
+                b_hi[1] = v
+            v = hi_z[p]
+            if v > b_hi[2]:
+                b_hi[2] = v
+
+        # sweep from the right to get the area of every suffix
+        right_area = [0.0] * bins
+        right_count = [0] * bins
+        s_lo = [inf, inf, inf]
+        s_hi = [-inf, -inf, -inf]
+        n = 0
+        for b in range(bins - 1, 0, -1):
+            if bin_count[b]:
+                s_lo = _min3(s_lo, bin_lo[b])
+                s_hi = _max3(s_hi, bin_hi[b])
+                n += bin_count[b]
+            right_area[b] = _area(s_lo, s_hi)
+            right_count[b] = n
+
+        s_lo = [inf, inf, inf]
+        s_hi = [-inf, -inf, -inf]
+        n = 0
+        for b in range(bins - 1):
+            if bin_count[b]:
+                s_lo = _min3(s_lo, bin_lo[b])
+                s_hi = _max3(s_hi, bin_hi[b])
+                n += bin_count[b]
+            if n == 0 or right_count[b + 1] == 0:
+                continue
+            cost = TRAVERSAL_COST + (
+                _area(s_lo, s_hi) * n + right_area[b + 1] * right_count[b + 1]
+            ) / max(node_area, 1e-12)
+            if cost < best_cost:
+                best_cost = cost
+                best_axis = axis
+                best_bin = b
+                best_lo = c_lo
+                best_scale = scale
+
+    if best_axis == -1:
+        return None
+
+    # partition primitives around the chosen bin
+    cent = centroid[best_axis]
+    left = []
+    right = []
+    for p in span:
+        if min(bins - 1, int((cent[p] - best_lo) * best_scale)) <= best_bin:
+            left.append(p)
+        else:
+            right.append(p)
+    prims[first : first + count] = left + right
+    return best_axis, len(left)
+
+
+class BVH:
+    # bounding volume hierarchy over the primitives of a list of objects,
+    # plain objects are one primitive each while composite objects
+    # (meshes) contribute one primitive per face
+
+    # primitives are stored as (object index, sub index) pairs in
+    # ref_obj and ref_sub, the sub index is -1 for plain objects and
+    # INSTANCE_SUB for instances, hits on those return the mesh face.
+
+    # nodes are stored flat in depth first order so the left child
+    # of an interior node is always the next node, for interior nodes
+    # node_start is the index of the right child and node_count is 0,
+    # for leaves they are the range of primitive refs the leaf covers
+
+    __slots__ = (
+        "objects",
+        "ref_obj",
+        "ref_sub",
+        "node_bounds",
+        "node_start",
+        "node_count",
+        "node_axis",
+    )
+
+    def __init__(
+        self,
+        objects: Sequence[Object],
+        include: Optional[Sequence[bool]] = None,
+    ):
+        self.objects = list(objects)
+        assert include is None or len(include) == len(self.objects)
+
+        self.ref_obj = array("i")
+        self.ref_sub = array("i")
+        self.node_bounds = array("d")
+        self.node_start = array("i")
+        self.node_count = array("i")
+        self.node_axis = array("b")
+
+        self._build(include)
+
+    def __len__(self) -> int:
+        return len(self.objects)
+
+    def _build(self, include: Optional[Sequence[bool]]) -> None:
+        # objects that aren't included are left out of the tree, but keep
+        # their index so hits are reported with the same object indices
+        # per primitive bounds and centroids, one array per axis
+        lo = [array("d"), array("d"), array("d")]
+        hi = [array("d"), array("d"), array("d")]
+        centroid = [array("d"), array("d"), array("d")]
+        ref_obj = array("i")
+        ref_sub = array("i")
+        for i, obj in enumerate(self.objects):
+            if include is not None and not include[i]:
+                continue
+            count = obj.primitive_count()
+            boxes = (
+                [(INSTANCE_SUB if isinstance(obj, Instance) else -1, obj.bounds())]
+                if count == 0
+                else [(f, obj.primitive_bounds(f)) for f in range(count)]
+            )
+            for sub, box in boxes:
+                if box.lo.x > box.hi.x:
+                    # empty, e.g. an instance of a mesh without faces
+                    continue
+                ref_obj.append(i)
+                ref_sub.append(sub)
+                lo[0].append(box.lo.x)
+                lo[1].append(box.lo.y)
+                lo[2].append(box.lo.z)
+                hi[0].append(box.hi.x)
+                hi[1].append(box.hi.y)
+                hi[2].append(box.hi.z)
+                centroid[0].append((box.lo.x + box.hi.x) * 0.5)
+                centroid[1].append((box.lo.y + box.hi.y) * 0.5)
+                centroid[2].append((box.lo.z + box.hi.z) * 0.5)
+
+        prims = list(range(len(ref_obj)))
+        if not prims:
+            return
+
+        # (first, count, parent), parent is -1 for the root and left children
+        stack: List[Tuple[int, int, int]] = [(0, len(prims), -1)]
+        while stack:
+            first, count, parent = stack.pop()
+            node = len(self.node_count)
+            if parent != -1:
+                self.node_start[parent] = node
+
+            span = prims[first : first + count]
+            b_lo = [min([lo[a][p] for p in span]) for a in range(3)]
+            b_hi = [max([hi[a][p] for p in span]) for a in range(3)]
+            self.node_bounds.extend(b_lo)
+            self.node_bounds.extend(b_hi)
+            self.node_start.append(first)
+            self.node_count.append(count)
+            self.node_axis.append(0)
+
+            if count <= 2:
+                continue
+
+            split = _find_split(
+                prims, first, count, _area(b_lo, b_hi), lo, hi, centroid
+            )
+            if split is None:
+                if count <= MAX_LEAF_SIZE:
+                    continue
+                # no useful split found, fall back to a median split
+                # along the axis with the largest centroid extent
+                extent = [
+                    max([centroid[a][p] for p in span])
+                    - min([centroid[a][p] for p in span])
+                    for a in range(3)
+                ]
+                axis = extent.index(max(extent))
+                key = centroid[axis]
+                prims[first : first + count] = sorted(span, key=lambda p: key[p])
+                mid = count // 2
+            else:
+                axis, mid = split
+
+            self.node_count[node] = 0
+            self.node_axis[node] = axis
+            # left child is popped first so it is always node + 1
+            stack.append((first + mid, count - mid, node))
+            stack.append((first, mid, -1))
+
+        # store the refs in leaf order so leaves index them directly
+        self.ref_obj = array("i", [ref_obj[p] for p in prims])
+        self.ref_sub = array("i", [ref_sub[p] for p in prims])
+
+    def closest_hit(
+        self, ray_o: Vec3, ray_d: Vec3, stats: Optional[RenderStats] = None
+    ) -> Tuple[int, int, float]:
+        # returns (object index, sub index, t), object index is -1 on a miss
+        closest_t = float("inf")
+        obj_ind = -1
+        sub_ind = -1
+        if not self.node_count:
+            return obj_ind, sub_ind, closest_t
+
+        ox, oy, oz = ray_o.x, ray_o.y, ray_o.z
+        ix, iy, iz = _inv(ray_d.x), _inv(ray_d.y), _inv(ray_d.z)
+        neg = (ix < 0, iy < 0, iz < 0)
+
+        objects = self.objects
+        ref_obj = self.ref_obj
+        ref_sub = self.ref_sub
+        bounds = self.node_bounds
+        node_start = self.node_start
+        node_count = self.node_count
+        node_axis = self.node_axis
+
+        stack = [0]
+        while stack:
+            node = stack.pop()
+            b = node * 6
+
+            # slab test
+            t1 = (bounds[b] - ox) * ix
+            t2 = (bounds[b + 3] - ox) * ix
+            tmin = min(t1, t2)
+            tmax = max(t1, t2)
+            t1 = (bounds[b + 1] - oy) * iy
+            t2 = (bounds[b + 4] - oy) * iy
+            tmin = max(tmin, min(t1, t2))
+            tmax = min(tmax, max(t1, t2))
+            t1 = (bounds[b + 2] - oz) * iz
+            t2 = (bounds[b + 5] - oz) * iz
+            tmin = max(tmin, min(t1, t2))
+            tmax = min(tmax, max(t1, t2))
+            if tmax < tmin or tmax < 0 or tmin > closest_t:
+                continue
+
+            count = node_count[node]
+            if count:
+                start = node_start[node]
+                for k in range(start, start + count):
+                    i = ref_obj[k]
+                    sub = ref_sub[k]
+                    if sub == -1:
+                        intersect, t = objects[i].intersect(ray_o, ray_d)
+                    elif sub == INSTANCE_SUB:
+                        intersect, t, sub = cast(Instance, objects[i]).intersect_face(
+                            ray_o, ray_d
+                        )
+                    else:
+                        intersect, t = objects[i].intersect_primitive(sub, ray_o, ray_d)
+                    if stats is not None:
+                        stats.count_test(objects[i], intersect)
+                    # ties go to the lowest index to match a linear scan
+                    if intersect and (
+                        t < closest_t
+                        or (t == closest_t and (i, sub) < (obj_ind, sub_ind))
+                    ):
+                        closest_t = t
+                        obj_ind = i
+                        sub_ind = sub
+            elif neg[node_axis[node]]:
+                # visit the child nearest to the ray origin first
+                stack.append(node + 1)
+                stack.append(node_start[node])
+            else:
+                stack.append(node_start[node])
+                stack.append(node + 1)
+
+        return obj_ind, sub_ind, closest_t
+
+    def any_hit(
+        self,
+        ray_o: Vec3,
+        ray_d: Vec3,
+        skip_obj: int = -1,
+        skip_sub: int = -1,
+        stats: Optional[RenderStats] = None,
+    ) -> bool:
+        # returns True as soon as any primitive other than the
+        # primitive (skip_obj, skip_sub) intersects the ray
+        return self.occluder(ray_o, ray_d, skip_obj, skip_sub, stats) != -1
+
+    def occluder(
+        self,
+        ray_o: Vec3,
+        ray_d: Vec3,
+        skip_obj: int = -1,
+        skip_sub: int = -1,
+        stats: Optional[RenderStats] = None,
+    ) -> int:
+        # same as any_hit, but returns the index of the first primitive
+        # ref found to block the ray, or -1, for ref_occludes to retry
+        if not self.node_count:
+            return -1
+
+        ox, oy, oz = ray_o.x, ray_o.y, ray_o.z
+        ix, iy, iz = _inv(ray_d.x), _inv(ray_d.y), _inv(ray_d.z)
+
+        objects = self.objects
+        ref_obj = self.ref_obj
+        ref_sub = self.ref_sub
+        bounds = self.node_bounds
+        node_start = self.node_start
+        node_count = self.node_count
+
+        stack = [0]
+        while stack:
+            node = stack.pop()
+            b = node * 6
+
+            t1 = (bounds[b] - ox) * ix
+            t2 = (bounds[b + 3] - ox) * ix
+            tmin = min(t1, t2)
+            tmax = max(t1, t2)
+            t1 = (bounds[b + 1] - oy) * iy
+            t2 = (bounds[b + 4] - oy) * iy
+            tmin = max(tmin, min(t1, t2))
+            tmax = min(tmax, max(t1, t2))
+            t1 = (bounds[b + 2] - oz) * iz
+            t2 = (bounds[b + 5] - oz) * iz
+            tmin = max(tmin, min(t1, t2))
+            tmax = min(tmax, max(t1, t2))
+            if tmax < tmin or tmax < 0:
+                continue
+
+            count = node_count[node]
+            if count:
+                start = node_start[node]
+                for k in range(start, start + count):
+                    # same as ref_occludes, inlined
+                    i = ref_obj[k]
+                    sub = ref_sub[k]
+                    if i == skip_obj and sub == skip_sub:
+                        continue
+                    if sub == -1:
+                        intersect, _ = objects[i].intersect(ray_o, ray_d)
+                    elif sub == INSTANCE_SUB:
+                        intersect = cast(Instance, objects[i]).occluded(
+                            ray_o, ray_d, skip_sub if i == skip_obj else -1
+                        )
+                    else:
+                        intersect, _ = objects[i].intersect_primitive(sub, ray_o, ray_d)
+                    if stats is not None:
+                        stats.count_test(objects[i], intersect)
+                    if intersect:
+                        return k
+            else:
+                stack.append(node_start[node])
+                stack.append(node + 1)
+
+        return -1
+
+    def ref_occludes(
+        self,
+        k: int,
+        ray_o: Vec3,
+        ray_d: Vec3,
+        skip_obj: int = -1,
+        skip_sub: int = -1,
+        stats: Optional[RenderStats] = None,
+    ) -> bool:
+        # whether primitive ref k blocks the ray, see any_hit
+        i = self.ref_obj[k]
+        sub = self.ref_sub[k]
+        if i == skip_obj and sub == skip_sub:
+            return False
+        obj = self.objects[i]
+        if sub == -1:
+            intersect, _ = obj.intersect(ray_o, ray_d)
+        elif sub == INSTANCE_SUB:
+            intersect = cast(Instance, obj).occluded(
+                ray_o, ray_d, skip_sub if i == skip_obj else -1
+            )
+        else:
+            intersect, _ = obj.intersect_primitive(sub, ray_o, ray_d)
+        if stats is not None:
+            stats.count_test(obj, intersect)
+        return intersect
@@ -0,0 +1,207 @@
+import math
+from array import array
+from typing import Any, Dict, List, Tuple, Union
+
+from raytracer.framebuffer import Tile
+from raytracer.linalg import ROW_MAJOR, Mat44, Vec3
+
+# number of ray generators kept by ray_generator(), one is
+# needed per resolution, field of view and anti aliasing
+RAY_CACHE_SIZE = 8
+
+_ray_cache: Dict[Tuple[int, int, float, float, int], "RayGenerator"] = {}
+
+
+def sample_order(anti_aliasing: int) -> List[Tuple[int, int]]:
+    # the subpixels (a_i, a_j) of the anti aliasing grid in the order
+    # that progressive sampling traces them: the middle one first, then
+    # always the one farthest from all that came before, so that every
+    # prefix of the order covers the pixel about evenly
+    AA = anti_aliasing
+    cells = [(a_i, a_j) for a_i in range(AA) for a_j in range(AA)]
+    ret = [(AA // 2, AA // 2)]
+    # squared distance of every cell to the closest one in ret
+    dist = [(a_i - AA // 2) ** 2 + (a_j - AA // 2) ** 2 for a_i, a_j in cells]
+    while len(ret) < len(cells):
+        k = max(range(len(cells)), key=lambda n: dist[n])
+        a_i, a_j = cells[k]
+        ret.append((a_i, a_j))
+        for n, (b_i, b_j) in enumerate(cells):
+            dist[n] = min(dist[n], (a_i - b_i) ** 2 + (a_j - b_j) ** 2)
+    return ret
+
+
+class RayGenerator:
+    # camera space terms of the primary rays of an image, only
+    # depends on the resolution, fov and anti aliasing, so it can
+    # be shared by every render with those, whatever the camera.
+    # every direction is Vec3(x, y, -distance_to_image).normalize()
+    # in camera space, then Mat44.transform_dir
+
+    __slots__ = (
+        "width",
+        "height",
+        "anti_aliasing",
+        "z",
+        "z_sq",
+        "xs",
+        "xs_sq",
+        "ys",
+        "ys_sq",
+        "order",
+    )
+
+    def __init__(
+        self,
+        width: int,
+        height: int,
+        fov: float,
+        distance_to_image: float,
+        anti_aliasing: int,
+    ) -> None:
+        self.width = width
+        self.height = height
+        self.anti_aliasing = AA = anti_aliasing
+
+        world_w = 2 * distance_to_image * math.tan(math.radians(fov) / 2)
+        world_h = world_w * height / width
+        cell_size = world_w / width
+
+        self.z = -distance_to_image
+        self.z_sq = self.z**2
+        # x of subpixel column a_j of pixel column j is xs[j * AA + a_j],
+        # y of subpixel row a_i of pixel row i is ys[i * AA + a_i]
+        self.xs = array(
+            "d",
+            [
+                j * cell_size + (cell_size / AA) * (a_j + 0.5) - world_w / 2
+                for j in range(width)
+                for a_j in range(AA)
+            ],
+        )
+        self.ys = array(
+            "d",
+            [
+                (height - i) * cell_size + (cell_size / AA) * (a_i + 0.5) - world_h / 2
+                for i in range(height)
+                for a_i in range(AA)
+            ],
+        )
+        self.xs_sq = array("d", [x**2 for x in self.xs])
+        self.ys_sq = array("d", [y**2 for y in self.ys])
+        self.order = sample_order(AA)
+
+    def direction(self, camera: Mat44, i: int, j: int, a_i: int, a_j: int) -> Vec3:
+        # world space direction of the ray through subpixel (a_i, a_j) of pixel (i, j)
+        AA = self.anti_aliasing
+        col = j * AA + a_j
+        row = i * AA + a_i
+        n = math.sqrt(self.xs_sq[col] + self.ys_sq[row] + self.z_sq)
+        return camera.transform_dir(
+            Vec3(self.xs[col] / n, self.ys[row] / n, self.z / n)
+        )
+
+    def tile_directions(self, camera: Mat44, tile: Tile) -> List[Vec3]:
+        # directions of every ray in the pixel window,
+        # ordered by row, column, then subpixel sample
+        x0, y0, x1, y1 = tile
+        AA = self.anti_aliasing
+        xs, xs_sq, ys, ys_sq = self.xs, self.xs_sq, self.ys, self.ys_sq
+        z, z_sq = self.z, self.z_sq
+        m = camera.arr if ROW_MAJOR else camera.transpose().arr
+        m00, m01, m02 = m[0][0], m[0][1], m[0][2]
+        m10, m11, m12 = m[1][0], m[1][1], m[1][2]
+        m20, m21, m22 = m[2][0], m[2][1], m[2][2]
+
+        ret: List[Vec3] = []
+        for i in range(y0, y1):
+            for j in range(x0, x1):
+                for row in range(i * AA, (i + 1) * AA):
+                    for col in range(j * AA, (j + 1) * AA):
+                        n = math.sqrt(xs_sq[col] + ys_sq[row] + z_sq)
+                        x, y, zn = xs[col] / n, ys[row] / n, z / n
+                        ret.append(
+                            Vec3(
+                                x * m00 + y * m10 + zn * m20,
+                                x * m01 + y * m11 + zn * m21,
+                                x * m02 + y * m12 + zn * m22,
+                            )
+                        )
+        return ret
+
+    def tile_array(self, camera: Mat44, tile: Tile) -> "TileRays":
+        # same as tile_directions, computed with numpy as a (n, 3) array
+        import numpy as np
+
+        x0, y0, x1, y1 = tile
+        AA = self.anti_aliasing
+        cols = slice(x0 * AA, x1 * AA)
+        rows = slice(y0 * AA, y1 * AA)
+        # one element per subpixel of the tile, indexed by subpixel row
+        # and column, then reordered to row, column, subpixel row and
+        # subpixel column
+        grid_x, grid_y = np.meshgrid(
+            np.frombuffer(self.xs)[cols], np.frombuffer(self.ys)[rows]
+        )
+        grid_x_sq, grid_y_sq = np.meshgrid(
+            np.frombuffer(self.xs_sq)[cols], np.frombuffer(self.ys_sq)[rows]
+        )
+        shape = (y1 - y0, AA, x1 - x0, AA)
+        norm = np.sqrt(grid_x_sq + grid_y_sq + self.z_sq)
+        x = (grid_x / norm).reshape(shape).transpose(0, 2, 1, 3).ravel()
+        y = (grid_y / norm).reshape(shape).transpose(0, 2, 1, 3).ravel()
+        z = (self.z / norm).reshape(shape).transpose(0, 2, 1, 3).ravel()
+
+        # into world space with the camera's basis vectors (its rows)
+        m = camera.arr if ROW_MAJOR else camera.transpose().arr
+        return TileRays(
+            np.stack(
+                (
+                    x * m[0][0] + y * m[1][0] + z * m[2][0],
+                    x * m[0][1] + y * m[1][1] + z * m[2][1],
+                    x * m[0][2] + y * m[1][2] + z * m[2][2],
+                ),
+                axis=1,
+            )
+        )
+
+
+class TileRays:
+    # directions of camera rays as a (n, 3) numpy array, which the
+    # vectorized renderer traces as they are. indexing returns a Vec3,
+    # made on demand so that only the rays that are shaded need one
+
+    __slots__ = ("array",)
+
+    def __init__(self, array: Any) -> None:
+        self.array = array
+
+    def __len__(self) -> int:
+        return len(self.array)
+
+    def __getitem__(self, k: int) -> Vec3:
+        x, y, z = self.array[k].tolist()
+        return Vec3(x, y, z)
+
+    def vectors(self) -> List[Vec3]:
+        return [Vec3(x, y, z) for x, y, z in self.array.tolist()]
+
+
+# ray directions as Vec3s or as an array
+Directions = Union[List[Vec3], TileRays]
+
+
+def ray_generator(
+    width: int, height: int, fov: float, distance_to_image: float, anti_aliasing: int
+) -> RayGenerator:
+    # cached RayGenerator, renders at the same resolution, fov and
+    # anti aliasing (e.g. the frames of a turntable) share one
+    key = (width, height, fov, distance_to_image, anti_aliasing)
+    ret = _ray_cache.pop(key, None)
+    if ret is None:
+        ret = RayGenerator(width, height, fov, distance_to_image, anti_aliasing)
+        while len(_ray_cache) >= RAY_CACHE_SIZE:
+            del _ray_cache[next(iter(_ray_cache))]
+    # most recently used last
+    _ray_cache[key] = ret
+    return ret
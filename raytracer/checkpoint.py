@@ -0,0 +1,76 @@
+import hashlib
+import mmap
+import os
+import pickle
+from typing import Optional
+
+# bitmap file layout: MAGIC, the digest of the render, then one byte per
+# tile that is 1 once the tile's pixels are in the framebuffer file
+MAGIC = b"RTCK1\n"
+DIGEST_SIZE = 32
+
+
+def render_digest(*parts: object) -> bytes:
+    # sha256 of everything that determines the pixels of a render
+    return hashlib.sha256(pickle.dumps(parts, protocol=4)).digest()
+
+
+class Checkpoint:
+    # which tiles of a render are done, kept in a small memory mapped
+    # file next to the framebuffer file so that a render that stopped
+    # for whatever reason can be resumed, see render_scene_iter
+
+    __slots__ = ("path", "tile_count", "_mmap")
+
+    def __init__(self, path: str, digest: bytes, tile_count: int) -> None:
+        # opens the bitmap at path, or creates it if it doesn't exist,
+        # raises ValueError if it belongs to a different render
+        self.path = path
+        self.tile_count = tile_count
+        header = MAGIC + digest
+        size = len(header) + tile_count
+
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                found = f.read(len(header))
+            if found != header or os.path.getsize(path) != size:
+                raise ValueError(
+                    f"checkpoint {path!r} is of a different scene, camera or "
+                    "render settings, remove it to start over"
+                )
+        else:
+            # written to a temporary file first so that a crash never
+            # leaves a bitmap without a valid header behind
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(header + bytes(tile_count))
+            os.replace(tmp_path, path)
+
+        with open(path, "r+b") as f:
+            self._mmap: Optional[mmap.mmap] = mmap.mmap(f.fileno(), size)
+
+    def _bitmap(self) -> mmap.mmap:
+        if self._mmap is None:
+            raise ValueError("checkpoint is closed")
+        return self._mmap
+
+    def is_done(self, index: int) -> bool:
+        return self._bitmap()[len(MAGIC) + DIGEST_SIZE + index] == 1
+
+    def mark_done(self, index: int) -> None:
+        # call only once the tile's pixels were flushed to their file
+        bitmap = self._bitmap()
+        bitmap[len(MAGIC) + DIGEST_SIZE + index] = 1
+        bitmap.flush()
+
+    def done_count(self) -> int:
+        return self._bitmap()[len(MAGIC) + DIGEST_SIZE :].count(1)
+
+    def close(self) -> None:
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    def __repr__(self) -> str:
+        done = self.done_count() if self._mmap is not None else "?"
+        return f"Checkpoint(path={self.path!r}, done={done}/{self.tile_count})"
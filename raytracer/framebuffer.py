@@ -0,0 +1,194 @@
+from __future__ import annotations
+
+import mmap
+import os
+from array import array
+from typing import Any, Iterator, List, Optional, Sequence, Tuple, Union
+
+from raytracer.batch import HAS_NUMPY
+from raytracer.linalg import Vec3
+
+# (x0, y0, x1, y1) pixel window, x1 and y1 are exclusive
+Tile = Tuple[int, int, int, int]
+
+FloatBuffer = Union["array[float]", "memoryview[float]"]
+
+
+def make_tiles(
+    width: int, height: int, tile_size: int, region: Optional[Tile] = None
+) -> List[Tile]:
+    # with a region, the tiles of the whole image clipped to it
+    rx0, ry0, rx1, ry1 = (0, 0, width, height) if region is None else region
+    return [
+        (max(x0, rx0), max(y0, ry0), min(x0 + tile_size, rx1), min(y0 + tile_size, ry1))
+        for y0 in range(ry0 - ry0 % tile_size, ry1, tile_size)
+        for x0 in range(rx0 - rx0 % tile_size, rx1, tile_size)
+    ]
+
+
+class FramebufferRow:
+    # view of one row so that fb[i][j] works like the nested lists
+    # render() used to return, reading or writing a pixel goes
+    # straight to the framebuffer's array
+
+    __slots__ = ("fb", "i")
+
+    def __init__(self, fb: Framebuffer, i: int):
+        self.fb = fb
+        self.i = i
+
+    def __len__(self) -> int:
+        return self.fb.width
+
+    def __getitem__(self, j: int) -> Vec3:
+        if not 0 <= j < self.fb.width:
+            raise IndexError("framebuffer column out of range")
+        return self.fb.get(self.i, j)
+
+    def __setitem__(self, j: int, color: Vec3) -> None:
+        if not 0 <= j < self.fb.width:
+            raise IndexError("framebuffer column out of range")
+        self.fb.set(self.i, j, color)
+
+    def __iter__(self) -> Iterator[Vec3]:
+        for j in range(self.fb.width):
+            yield self.fb.get(self.i, j)
+
+
+class Framebuffer:
+    # rgb image stored as one flat, row-major buffer of doubles,
+    # row 0 is the top of the image. the buffer is either an
+    # array("d") or a memory mapped file (see Framebuffer.open)
+
+    __slots__ = ("width", "height", "data", "path", "_mmap")
+
+    def __init__(
+        self, width: int, height: int, data: Optional[FloatBuffer] = None
+    ) -> None:
+        self.width = width
+        self.height = height
+        if data is None:
+            data = array("d", bytes(8 * 3 * width * height))
+        assert len(data) == 3 * width * height, "buffer has the wrong size"
+        self.data: FloatBuffer = data
+        self.path: Optional[str] = None
+        self._mmap: Optional[mmap.mmap] = None
+
+    @classmethod
+    def open(cls, path: str, width: int, height: int) -> Framebuffer:
+        # framebuffer backed by a memory mapped file, the file is
+        # created (black) or grown if it is too small. other processes
+        # opening the same path share the pixels with this one
+        size = 8 * 3 * width * height
+        with open(path, "a+b") as f:
+            if os.path.getsize(path) < size:
+                f.truncate(size)
+            mm = mmap.mmap(f.fileno(), size)
+
+        ret = cls(width, height, memoryview(mm).cast("d"))
+        ret.path = path
+        ret._mmap = mm
+        return ret
+
+    @classmethod
+    def from_lists(cls, img: Sequence[Sequence[Vec3]]) -> Framebuffer:
+        ret = cls(len(img[0]), len(img))
+        for i, row in enumerate(img):
+            for j, color in enumerate(row):
+                ret.set(i, j, color)
+        return ret
+
+    def flush(self, tile: Optional[Tile] = None) -> None:
+        # writes a memory mapped framebuffer, or just the rows
+        # of the tile, back to its file
+        if self._mmap is None:
+            return
+        if tile is None:
+            self._mmap.flush()
+            return
+        start = 8 * 3 * tile[1] * self.width
+        end = 8 * 3 * tile[3] * self.width
+        # the offset has to be a multiple of the page size
+        start -= start % mmap.ALLOCATIONGRANULARITY
+        self._mmap.flush(start, end - start)
+
+    def close(self) -> None:
+        # releases the mapping of a memory mapped framebuffer
+        # after copying its pixels into memory
+        if self._mmap is not None:
+            data = array("d", self.data)
+            self.data = data
+            self._mmap.close()
+            self._mmap = None
+
+    def __reduce__(self) -> Tuple[Any, ...]:
+        # memory mapped buffers can't be pickled, send a copy instead
+        return (Framebuffer, (self.width, self.height, array("d", self.data)))
+
+    def __len__(self) -> int:
+        return self.height
+
+    def __getitem__(self, i: int) -> FramebufferRow:
+        if not 0 <= i < self.height:
+            raise IndexError("framebuffer row out of range")
+        return FramebufferRow(self, i)
+
+    def __iter__(self) -> Iterator[FramebufferRow]:
+        for i in range(self.height):
+            yield FramebufferRow(self, i)
+
+    def buffer(self) -> memoryview:
+        # zero copy view of the pixels, e.g. for numpy.frombuffer
+        return memoryview(self.data)
+
+    def get(self, i: int, j: int) -> Vec3:
+        k = 3 * (i * self.width + j)
+        data = self.data
+        return Vec3(data[k], data[k + 1], data[k + 2])
+
+    def set(self, i: int, j: int, color: Vec3) -> None:
+        k = 3 * (i * self.width + j)
+        data = self.data
+        data[k] = color.x
+        data[k + 1] = color.y
+        data[k + 2] = color.z
+
+    def write_tile(self, tile: Tile, colors: Sequence[float]) -> None:
+        # colors are the tile's pixels as flat row-major rgb floats
+        x0, y0, x1, y1 = tile
+        n = 3 * (x1 - x0)
+        data = self.data
+        for i in range(y0, y1):
+            k = 3 * (i * self.width + x0)
+            m = 3 * (i - y0) * (x1 - x0)
+            data[k : k + n] = array("d", colors[m : m + n])
+
+    def read_tile(self, tile: Tile) -> "array[float]":
+        x0, y0, x1, y1 = tile
+        ret = array("d")
+        for i in range(y0, y1):
+            k = 3 * (i * self.width + x0)
+            ret.extend(self.data[k : k + 3 * (x1 - x0)])
+        return ret
+
+    def row_bytes(self, i: int) -> bytes:
+        # 8 bit rgb, colors outside of [0, 1] are clamped
+        k = 3 * i * self.width
+        n = 3 * self.width
+        if HAS_NUMPY:
+            import numpy as np
+
+            values = np.frombuffer(self.buffer(), np.float64, n, 8 * k)
+            return bytes(np.rint(np.clip(values, 0, 1) * 255).astype(np.uint8))
+        return bytes(
+            [
+                255 if v >= 1 else 0 if v <= 0 else round(v * 255)
+                for v in self.data[k : k + n]
+            ]
+        )
+
+    def to_lists(self) -> List[List[Vec3]]:
+        return [[self.get(i, j) for j in range(self.width)] for i in range(self.height)]
+
+    def __repr__(self) -> str:
+        return f"Framebuffer(width={self.width}, height={self.height})"
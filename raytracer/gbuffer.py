@@ -0,0 +1,126 @@
+from array import array
+from typing import List, Optional, Tuple
+
+from raytracer.framebuffer import Tile
+from raytracer.linalg import Vec3
+from raytracer.scene import CompiledScene
+
+# what a light's shadows depend on, None for lights that are asked
+# for their direction_at() and so never match
+LightKey = Optional[Tuple[int, float, float, float]]
+
+
+def light_keys(scene: CompiledScene) -> List[LightKey]:
+    ret: List[LightKey] = []
+    for kind, vector in zip(scene.light_kinds, scene.light_vectors):
+        ret.append(None if vector is None else (kind, vector.x, vector.y, vector.z))
+    return ret
+
+
+class GBuffer:
+    # the first hits of the camera rays of a render, filled in by
+    # render(..., gbuffer=GBuffer()) so that relight() can shade them
+    # again with other lights, settings or materials without tracing
+    # them. sample a (in RayGenerator order) of pixel (i, j) is at
+    # index (i * width + j) * anti_aliasing**2 + a, points, normals and
+    # directions have three floats per sample. samples that missed have
+    # object -1 and sub index -1 for plain objects, see BVH.closest_hit
+
+    __slots__ = (
+        "scene",
+        "look_from",
+        "width",
+        "height",
+        "anti_aliasing",
+        "recursion_depth",
+        "tiles",
+        "objects",
+        "subs",
+        "depths",
+        "points",
+        "normals",
+        "directions",
+        "shadows",
+        "shadow_keys",
+        "shadow_settings",
+    )
+
+    def __init__(self, keep_shadows: bool = True) -> None:
+        # with keep_shadows, whether each diffuse camera hit sees each
+        # light is kept as well (one byte per sample and light), so that
+        # relighting only casts shadow rays for lights that moved
+        self.scene: Optional[CompiledScene] = None
+        self.look_from = Vec3(0, 0, 0)
+        self.width = self.height = 0
+        self.anti_aliasing = 1
+        self.recursion_depth = 0
+        self.tiles: List[Tile] = []
+        self.objects = array("i")
+        self.subs = array("i")
+        self.depths = array("d")
+        self.points = array("d")
+        self.normals = array("d")
+        self.directions = array("d")
+        # 1 blocked, 0 lit, -1 not known (not traced yet, or the light
+        # changed), len(scene.lights) entries per sample
+        self.shadows: Optional["array[int]"] = array("b") if keep_shadows else None
+        self.shadow_keys: List[LightKey] = []
+        self.shadow_settings: Tuple[Tuple[int, ...], float] = ((), 0)
+
+    def reset(
+        self,
+        scene: CompiledScene,
+        look_from: Vec3,
+        anti_aliasing: int,
+        recursion_depth: int,
+    ) -> None:
+        # empties the buffer for a render of scene from look_from
+        self.scene = scene
+        self.look_from = look_from
+        self.width = int(scene.settings.resolution.w)
+        self.height = int(scene.settings.resolution.h)
+        self.anti_aliasing = anti_aliasing
+        self.recursion_depth = recursion_depth
+        self.tiles = []
+
+        n = self.width * self.height * anti_aliasing**2
+        self.objects = array("i", [-1]) * n
+        self.subs = array("i", [-1]) * n
+        self.depths = array("d", bytes(8 * n))
+        self.points = array("d", bytes(24 * n))
+        self.normals = array("d", bytes(24 * n))
+        self.directions = array("d", bytes(24 * n))
+        if self.shadows is not None:
+            self.shadows = array("b", [-1]) * (n * len(scene.lights))
+        self.shadow_keys = light_keys(scene)
+        self.shadow_settings = (scene.casters, scene.settings.bias)
+
+    def sample_index(self, i: int, j: int) -> int:
+        # index of the first sample of pixel (i, j)
+        return (i * self.width + j) * self.anti_aliasing**2
+
+    def shadows_for(self, scene: CompiledScene) -> Optional["array[int]"]:
+        # the kept shadows, with the ones that may differ in scene
+        # forgotten: those of lights that moved or were replaced, or
+        # all of them if the shadow casters or the bias changed
+        shadows = self.shadows
+        if shadows is None:
+            return None
+        n = len(self.objects)
+        keys = light_keys(scene)
+        settings = (scene.casters, scene.settings.bias)
+        if len(keys) != len(self.shadow_keys) or settings != self.shadow_settings:
+            shadows = self.shadows = array("b", [-1]) * (n * len(keys))
+        else:
+            for k, key in enumerate(keys):
+                if key is None or key != self.shadow_keys[k]:
+                    shadows[k :: len(keys)] = array("b", [-1]) * n
+        self.shadow_keys = keys
+        self.shadow_settings = settings
+        return shadows
+
+    def __repr__(self) -> str:
+        return (
+            f"GBuffer({self.width}x{self.height}, "
+            f"anti_aliasing={self.anti_aliasing}, tiles={len(self.tiles)})"
+        )
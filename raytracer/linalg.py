@@ -11,6 +11,16 @@ def float_eq(a: float, b: float) -> bool:
     return abs(a - b) < EPSILON
 
 
+def dot3(ax: float, ay: float, az: float, bx: float, by: float, bz: float) -> float:
+    return ax * bx + ay * by + az * bz
+
+
+def normalized(x: float, y: float, z: float) -> Vec3:
+    # same as Vec3(x, y, z).normalize() without the temporary vector
+    n = math.sqrt(x**2 + y**2 + z**2)
+    return Vec3(x / n, y / n, z / n)
+
+
 class Vec3:
     __slots__ = ("x", "y", "z")
 
@@ -26,6 +36,44 @@ class Vec3:
     def normalize(self) -> Vec3:
         return self / self.norm()
 
+    # the methods below are faster versions of the operators for the hot
+    # paths: they skip the type checks and create at most one vector.
+    # the i* methods change the vector in place, only use them on
+    # vectors that nothing else holds a reference to
+
+    def scale(self, s: float) -> Vec3:
+        # self * s
+        return Vec3(self.x * s, self.y * s, self.z * s)
+
+    def add_scaled(self, other: Vec3, s: float) -> Vec3:
+        # self + other * s
+        return Vec3(self.x + other.x * s, self.y + other.y * s, self.z + other.z * s)
+
+    def direction_to(self, other: Vec3) -> Vec3:
+        # (other - self).normalize()
+        return normalized(other.x - self.x, other.y - self.y, other.z - self.z)
+
+    def iadd(self, other: Vec3) -> Vec3:
+        # self += other
+        self.x += other.x
+        self.y += other.y
+        self.z += other.z
+        return self
+
+    def iadd_scaled(self, other: Vec3, s: float) -> Vec3:
+        # self += other * s
+        self.x += other.x * s
+        self.y += other.y * s
+        self.z += other.z * s
+        return self
+
+    def imul(self, s: float) -> Vec3:
+        # self *= s
+        self.x *= s
+        self.y *= s
+        self.z *= s
+        return self
+
     def dot(self, other: Vec3) -> float:
         return self.x * other.x + self.y * other.y + self.z * other.z
 
@@ -128,6 +176,36 @@ class Vec3:
         return Vec3(abs(self.x), abs(self.y), abs(self.z))
 
 
+class AABB:
+    # axis-aligned bounding box
+    __slots__ = ("lo", "hi")
+
+    def __init__(self, lo: Vec3, hi: Vec3):
+        self.lo = lo
+        self.hi = hi
+
+    @classmethod
+    def empty(cls) -> AABB:
+        inf = float("inf")
+        return cls(Vec3(inf, inf, inf), Vec3(-inf, -inf, -inf))
+
+    @classmethod
+    def from_points(cls, *points: Vec3) -> AABB:
+        ret = cls.empty()
+        for p in points:
+            ret = ret.grow(p)
+        return ret
+
+    def grow(self, p: Vec3) -> AABB:
+        return AABB(
+            Vec3(min(self.lo.x, p.x), min(self.lo.y, p.y), min(self.lo.z, p.z)),
+            Vec3(max(self.hi.x, p.x), max(self.hi.y, p.y), max(self.hi.z, p.z)),
+        )
+
+    def __repr__(self) -> str:
+        return f"AABB(lo={self.lo}, hi={self.hi})"
+
+
 class Mat44:
     __slots__ = "arr"
 
@@ -178,6 +256,76 @@ class Mat44:
 
         return ret
 
+    @classmethod
+    def translation(cls, offset: Vec3) -> Mat44:
+        ret = cls()
+        ret[3][0] = offset.x
+        ret[3][1] = offset.y
+        ret[3][2] = offset.z
+        return ret if ROW_MAJOR else ret.transpose()
+
+    @classmethod
+    def scaling(cls, x: float, y: float, z: float) -> Mat44:
+        ret = cls()
+        ret[0][0] = x
+        ret[1][1] = y
+        ret[2][2] = z
+        return ret
+
+    @classmethod
+    def rotation(cls, axis: Vec3, degrees: float) -> Mat44:
+        # counterclockwise when looking down the axis towards the origin
+        a = axis.normalize()
+        s = math.sin(math.radians(degrees))
+        c = math.cos(math.radians(degrees))
+        t = 1 - c
+        ret = cls.from_list(
+            [
+                [
+                    t * a.x * a.x + c,
+                    t * a.x * a.y + s * a.z,
+                    t * a.x * a.z - s * a.y,
+                    0,
+                ],
+                [
+                    t * a.x * a.y - s * a.z,
+                    t * a.y * a.y + c,
+                    t * a.y * a.z + s * a.x,
+                    0,
+                ],
+                [
+                    t * a.x * a.z + s * a.y,
+                    t * a.y * a.z - s * a.x,
+                    t * a.z * a.z + c,
+                    0,
+                ],
+                [0, 0, 0, 1],
+            ]
+        )
+        return ret if ROW_MAJOR else ret.transpose()
+
+    def inverse(self) -> Mat44:
+        # gauss-jordan elimination with partial pivoting
+        m = [list(row) for row in self.arr]
+        ret = Mat44()
+        inv = ret.arr
+        for col in range(4):
+            pivot = max(range(col, 4), key=lambda r: abs(m[r][col]))
+            if m[pivot][col] == 0:
+                raise ValueError("matrix is not invertible")
+            m[col], m[pivot] = m[pivot], m[col]
+            inv[col], inv[pivot] = inv[pivot], inv[col]
+
+            p = m[col][col]
+            m[col] = [v / p for v in m[col]]
+            inv[col] = [v / p for v in inv[col]]
+            for r in range(4):
+                if r != col and m[r][col] != 0:
+                    f = m[r][col]
+                    m[r] = [a - f * b for a, b in zip(m[r], m[col])]
+                    inv[r] = [a - f * b for a, b in zip(inv[r], inv[col])]
+        return ret
+
     def transpose(self) -> Mat44:
         ret = Mat44()
         for i in range(4):
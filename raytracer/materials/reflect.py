@@ -1,4 +1,4 @@
-from raytracer.linalg import Vec3
+from raytracer.linalg import Vec3, normalized
 from raytracer.materials.material_t import Material
 
 
@@ -9,7 +9,10 @@ class Reflect(Material):
         pass
 
     def reflect(self, ray_d: Vec3, normal: Vec3) -> Vec3:
-        return (ray_d - normal * 2 * ray_d.dot(normal)).normalize()
+        k = 2 * ray_d.dot(normal)
+        return normalized(
+            ray_d.x - normal.x * k, ray_d.y - normal.y * k, ray_d.z - normal.z * k
+        )
 
     def __repr__(self) -> str:
         return "Reflect()"
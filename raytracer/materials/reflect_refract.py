@@ -1,6 +1,6 @@
 import math
 
-from raytracer.linalg import Vec3
+from raytracer.linalg import Vec3, normalized
 from raytracer.materials.reflect import Reflect
 
 
@@ -20,11 +20,12 @@ class ReflectRefract(Reflect):
         n_dot_i = normal.dot(ray_d)
         ior = self.ior
         air_ior = self.AIR_IOR
+        nx, ny, nz = normal.x, normal.y, normal.z
 
         if n_dot_i < 0:
             n_dot_i = -n_dot_i
         else:
-            normal = -normal
+            nx, ny, nz = -nx, -ny, -nz
             ior, air_ior = air_ior, ior
 
         ior_ratio = air_ior / ior
@@ -40,9 +41,12 @@ class ReflectRefract(Reflect):
             # this value is insignificant
             return Vec3(0, 0, 0)
 
-        return (
-            ior_ratio * ray_d + (ior_ratio * n_dot_i - math.sqrt(k)) * normal
-        ).normalize()
+        s = ior_ratio * n_dot_i - math.sqrt(k)
+        return normalized(
+            ior_ratio * ray_d.x + s * nx,
+            ior_ratio * ray_d.y + s * ny,
+            ior_ratio * ray_d.z + s * nz,
+        )
 
     def fresnel(self, ray_d: Vec3, normal: Vec3) -> float:
         # returns the amount of light refracted
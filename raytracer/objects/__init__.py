@@ -1,6 +1,9 @@
+from raytracer.objects.box import Box
+from raytracer.objects.instance import Instance
 from raytracer.objects.mesh import Mesh
 from raytracer.objects.object_t import Object
+from raytracer.objects.plane import Plane
 from raytracer.objects.sphere import Sphere
 from raytracer.objects.triangle import Triangle
 
-__all__ = ["Object", "Sphere", "Triangle", "Mesh"]
+__all__ = ["Object", "Sphere", "Triangle", "Mesh", "Instance", "Plane", "Box"]
@@ -0,0 +1,123 @@
+import math
+from typing import Any, Tuple
+
+from raytracer.batch import HAS_NUMPY
+from raytracer.linalg import AABB, Vec3
+from raytracer.materials import Material
+from raytracer.objects.object_t import Object
+
+# outward normals of the faces at lo.x, lo.y, lo.z, hi.x, hi.y, hi.z
+FACE_NORMALS = (
+    Vec3(-1, 0, 0),
+    Vec3(0, -1, 0),
+    Vec3(0, 0, -1),
+    Vec3(1, 0, 0),
+    Vec3(0, 1, 0),
+    Vec3(0, 0, 1),
+)
+
+
+class Box(Object):
+    # axis aligned box between the corners lo and hi, intersected with
+    # one slab test instead of as the 12 triangles of its faces
+
+    __slots__ = ("lo", "hi", "material")
+
+    def __init__(self, a: Vec3, b: Vec3, material: Material):
+        # any two opposite corners
+        self.lo = Vec3(min(a.x, b.x), min(a.y, b.y), min(a.z, b.z))
+        self.hi = Vec3(max(a.x, b.x), max(a.y, b.y), max(a.z, b.z))
+        self.material = material
+
+    def normal(self, ray_d: Vec3, intersect: Vec3) -> Vec3:
+        # outward normal of the face closest to the intersection
+        lo, hi = self.lo, self.hi
+        dists = (
+            abs(intersect.x - lo.x),
+            abs(intersect.y - lo.y),
+            abs(intersect.z - lo.z),
+            abs(intersect.x - hi.x),
+            abs(intersect.y - hi.y),
+            abs(intersect.z - hi.z),
+        )
+        return FACE_NORMALS[dists.index(min(dists))]
+
+    def intersect(self, ray_o: Vec3, ray_d: Vec3) -> Tuple[bool, float]:
+        # slab test, one axis at a time. rays parallel to an axis'
+        # slabs are either always or never between them
+        lo, hi = self.lo, self.hi
+        near = -math.inf
+        far = math.inf
+
+        o, d = ray_o.x, ray_d.x
+        if d != 0:
+            t1 = (lo.x - o) / d
+            t2 = (hi.x - o) / d
+            near, far = (t1, t2) if t1 < t2 else (t2, t1)
+        elif o < lo.x or o > hi.x:
+            return False, 0
+
+        o, d = ray_o.y, ray_d.y
+        if d != 0:
+            t1 = (lo.y - o) / d
+            t2 = (hi.y - o) / d
+            if t1 > t2:
+                t1, t2 = t2, t1
+            near = max(near, t1)
+            far = min(far, t2)
+        elif o < lo.y or o > hi.y:
+            return False, 0
+
+        o, d = ray_o.z, ray_d.z
+        if d != 0:
+            t1 = (lo.z - o) / d
+            t2 = (hi.z - o) / d
+            if t1 > t2:
+                t1, t2 = t2, t1
+            near = max(near, t1)
+            far = min(far, t2)
+        elif o < lo.z or o > hi.z:
+            return False, 0
+
+        if near > far or far < 0:
+            return False, 0
+        # rays from inside the box (refraction) leave it at far
+        return True, near if near >= 0 else far
+
+    def intersect_many(self, origins: Any, directions: Any) -> Tuple[Any, Any]:
+        if not HAS_NUMPY:
+            return super().intersect_many(origins, directions)
+        import numpy as np
+
+        o = np.asarray(origins, dtype=float)
+        d = np.asarray(directions, dtype=float)
+        lo = np.array([self.lo.x, self.lo.y, self.lo.z])
+        hi = np.array([self.hi.x, self.hi.y, self.hi.z])
+
+        # same as intersect() on all axes at once
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t1 = (lo - o) / d
+            t2 = (hi - o) / d
+        parallel = d == 0
+        outside = parallel & ((o < lo) | (o > hi))
+        t_lo = np.where(
+            parallel, np.where(outside, np.inf, -np.inf), np.minimum(t1, t2)
+        )
+        t_hi = np.where(
+            parallel, np.where(outside, -np.inf, np.inf), np.maximum(t1, t2)
+        )
+        near = t_lo.max(axis=1)
+        far = t_hi.min(axis=1)
+
+        mask = (near <= far) & (far >= 0)
+        t = np.where(near >= 0, near, far)
+        return mask, np.where(mask, t, 0.0)
+
+    def bounds(self) -> AABB:
+        return AABB(self.lo, self.hi)
+
+    def __repr__(self) -> str:
+        return f"Box(lo={self.lo}, hi={self.hi}, material={self.material})"
+
+    def __str__(self) -> str:
+        return f"Box(lo={self.lo}, hi={self.hi}, m={self.material})"
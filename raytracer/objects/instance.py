@@ -0,0 +1,112 @@
+from __future__ import annotations
+
+from typing import Optional, Tuple
+
+from raytracer.linalg import AABB, ROW_MAJOR, Mat44, Vec3, normalized
+from raytracer.materials.material_t import Material
+from raytracer.objects.mesh import Mesh
+from raytracer.objects.object_t import Object
+
+
+class Instance(Object):
+    # a mesh placed in the scene by a transform, with its own material
+    # or the mesh's. instances share the mesh's vertex buffers and its
+    # BVH (see Mesh.bvh), so any number of them cost one copy of the
+    # geometry. rays are moved into the mesh's space instead of the
+    # mesh into the scene, the renderer puts an instance in its BVH as
+    # one primitive and asks it which face was hit with intersect_face()
+
+    __slots__ = ("mesh", "transform", "material", "_inv", "_normal")
+
+    def __init__(
+        self, mesh: Mesh, transform: Mat44, material: Optional[Material] = None
+    ):
+        self.mesh = mesh
+        self.transform = transform
+        self.material = mesh.material if material is None else material
+
+        # transform_point ignores the translation, so points are moved
+        # with the rows of the (row major) matrices directly: the
+        # inverse for rays, and its inverse transpose for normals
+        m = transform if ROW_MAJOR else transform.transpose()
+        inv = m.inverse()
+        self._inv = tuple(inv[r][c] for r in range(4) for c in range(3))
+        self._normal = tuple(inv[c][r] for r in range(3) for c in range(3))
+
+    def to_local(self, ray_o: Vec3, ray_d: Vec3) -> Tuple[Vec3, Vec3]:
+        # the ray in the mesh's space, the direction isn't normalized
+        # so that distances along the ray are the same in both spaces
+        a, b, c, d, e, f, g, h, i, tx, ty, tz = self._inv
+        ox, oy, oz = ray_o.x, ray_o.y, ray_o.z
+        dx, dy, dz = ray_d.x, ray_d.y, ray_d.z
+        return (
+            Vec3(
+                ox * a + oy * d + oz * g + tx,
+                ox * b + oy * e + oz * h + ty,
+                ox * c + oy * f + oz * i + tz,
+            ),
+            Vec3(
+                dx * a + dy * d + dz * g,
+                dx * b + dy * e + dz * h,
+                dx * c + dy * f + dz * i,
+            ),
+        )
+
+    def intersect_face(self, ray_o: Vec3, ray_d: Vec3) -> Tuple[bool, float, int]:
+        # (hit, t, face), rays that miss the mesh's bounding box
+        # are rejected by the root node of its BVH
+        local_o, local_d = self.to_local(ray_o, ray_d)
+        ind, face, t = self.mesh.bvh().closest_hit(local_o, local_d)
+        if ind == -1:
+            return False, 0, -1
+        return True, t, face
+
+    def occluded(self, ray_o: Vec3, ray_d: Vec3, skip_face: int = -1) -> bool:
+        # whether any face other than skip_face intersects the ray
+        local_o, local_d = self.to_local(ray_o, ray_d)
+        return self.mesh.bvh().any_hit(local_o, local_d, 0, skip_face)
+
+    def intersect(self, ray_o: Vec3, ray_d: Vec3) -> Tuple[bool, float]:
+        intersect, t, _ = self.intersect_face(ray_o, ray_d)
+        return intersect, t
+
+    def primitive_normal(self, prim: int, ray_d: Vec3, intersect: Vec3) -> Vec3:
+        # normal of face prim, instances are a single primitive to the
+        # renderer but still report the face that was hit
+        n = self.mesh._normals
+        nx, ny, nz = n[3 * prim], n[3 * prim + 1], n[3 * prim + 2]
+        m = self._normal
+        N = normalized(
+            nx * m[0] + ny * m[3] + nz * m[6],
+            nx * m[1] + ny * m[4] + nz * m[7],
+            nx * m[2] + ny * m[5] + nz * m[8],
+        )
+        if ray_d.dot(N) < 0:
+            return N
+        return -N
+
+    def bounds(self) -> AABB:
+        # the transformed corners of the mesh's bounding box, which is
+        # the root node of its BVH, so forests don't rescan the vertices
+        if not self.mesh.primitive_count():
+            return AABB.empty()
+        box = self.mesh.bvh().node_bounds
+        m = self.transform if ROW_MAJOR else self.transform.transpose()
+        ret = AABB.empty()
+        for x in (box[0], box[3]):
+            for y in (box[1], box[4]):
+                for z in (box[2], box[5]):
+                    ret = ret.grow(
+                        Vec3(
+                            x * m[0][0] + y * m[1][0] + z * m[2][0] + m[3][0],
+                            x * m[0][1] + y * m[1][1] + z * m[2][1] + m[3][1],
+                            x * m[0][2] + y * m[1][2] + z * m[2][2] + m[3][2],
+                        )
+                    )
+        return ret
+
+    def __repr__(self) -> str:
+        return (
+            f"Instance(mesh={self.mesh}, transform={self.transform}, "
+            f"material={self.material})"
+        )
@@ -1,22 +1,93 @@
 from __future__ import annotations
 
-from typing import Sequence
+import math
+from array import array
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Sequence, Tuple
 
-from raytracer.linalg import Vec3
+from raytracer.linalg import AABB, EPSILON, Vec3
 from raytracer.materials.material_t import Material
 from raytracer.objects.object_t import Object
-from raytracer.objects.triangle import Triangle
+from raytracer.objects.objfile import cache_path, load_cache, parse_obj, write_cache
+from raytracer.objects.triangle import Triangle, moller_trumbore
+
+if TYPE_CHECKING:
+    from raytracer.bvh import BVH
+
+
+def face_data(
+    vertices: Sequence[float], indices: Sequence[int]
+) -> Tuple["array[float]", "array[float]"]:
+    # the unit normal (3 floats) and the moller-trumbore min_det of
+    # every face, see Triangle. zero area faces get min_det 0, which
+    # rejects every ray, and a zero normal. the edges aren't kept,
+    # intersect_primitive takes them from the shared vertices
+    normals = array("d")
+    min_dets = array("d")
+    v = vertices
+    for f in range(0, len(indices), 3):
+        a, b, c = 3 * indices[f], 3 * indices[f + 1], 3 * indices[f + 2]
+        ax, ay, az = v[a], v[a + 1], v[a + 2]
+        e1x, e1y, e1z = v[b] - ax, v[b + 1] - ay, v[b + 2] - az
+        e2x, e2y, e2z = v[c] - ax, v[c + 1] - ay, v[c + 2] - az
+        nx = e1y * e2z - e1z * e2y
+        ny = e1z * e2x - e1x * e2z
+        nz = e1x * e2y - e1y * e2x
+        n = math.sqrt(nx * nx + ny * ny + nz * nz)
+        min_dets.append(EPSILON * n)
+        if n:
+            normals.extend((nx / n, ny / n, nz / n))
+        else:
+            normals.extend((0.0, 0.0, 0.0))
+    return normals, min_dets
 
 
 class Mesh(Object):
-    # .normal() and .intersect() are not implemented
-    # because the Mesh class will be handled differently
-    # by the render function
+    # triangle mesh stored as a flat vertex buffer (x, y, z per vertex)
+    # and an index buffer (three vertex indices per face). the renderer
+    # intersects the faces straight from the buffers through the
+    # primitive methods, so no Triangle objects are created
 
-    __slots__ = ("objects",)
+    __slots__ = ("vertices", "indices", "material", "_bvh", "_normals", "_min_dets")
 
-    def __init__(self, objects: Sequence[Triangle]):
-        self.triangles = objects
+    def __init__(
+        self,
+        vertices: Sequence[float],
+        indices: Sequence[int],
+        material: Material,
+        faces: Optional[Tuple[Sequence[float], Sequence[float]]] = None,
+    ):
+        # faces is what face_data() returns for these buffers, when
+        # it is already known (e.g. memory mapped from an obj cache)
+        assert len(vertices) % 3 == 0, "vertex buffer must hold x, y, z triples"
+        assert len(indices) % 3 == 0, "index buffer must hold triangles"
+
+        self.vertices = vertices
+        self.indices = indices
+        self.material = material
+        self._bvh: Optional[BVH] = None
+        if faces is None:
+            faces = face_data(vertices, indices)
+        self._normals, self._min_dets = faces
+
+    @classmethod
+    def from_triangles(cls, triangles: Sequence[Triangle]) -> Mesh:
+        # vertices that are exactly equal are shared
+        assert triangles, "mesh must have at least one triangle"
+        material = triangles[0].material
+        if any(tri.material is not material for tri in triangles):
+            raise ValueError("all triangles of a mesh must share one material")
+
+        vertices = array("d")
+        indices = array("i")
+        seen: Dict[Tuple[float, float, float], int] = {}
+        for tri in triangles:
+            for v in (tri.a, tri.b, tri.c):
+                key = (v.x, v.y, v.z)
+                if key not in seen:
+                    seen[key] = len(seen)
+                    vertices.extend(key)
+                indices.append(seen[key])
+        return cls(vertices, indices, material)
 
     @classmethod
     def from_obj(
@@ -25,26 +96,128 @@ class Mesh(Object):
         material: Material,
         scale: float = 1.0,
         translate: Vec3 = Vec3(0, 0, 0),
+        cache: bool = False,
     ) -> Mesh:
         # ignores textures and materials for now
 
+        # with cache=True the parsed buffers are saved to a binary file
+        # next to obj_file, later loads with the same scale and translate
+        # memory map it instead of parsing, as long as obj_file is unchanged
+        path = cache_path(obj_file, scale, translate)
+        if cache:
+            cached = load_cache(path, obj_file)
+            if cached is not None:
+                vertices, indices, normals, min_dets = cached
+                return cls(vertices, indices, material, (normals, min_dets))
+
         with open(obj_file, "r") as f:
-            vertices = []
-            triangles = []
-            for line in f:
-                args = line.split()
-                if args[0] == "v":
-                    x, y, z = map(float, args[1:4])
-                    vertices.append(Vec3(x, y, z) * scale + translate)
-                elif args[0] == "f":
-                    a, b, c = map(lambda x: int(x.split("/")[0]), args[1:4])
-                    triangles.append(
-                        Triangle(
-                            vertices[a - 1],
-                            vertices[b - 1],
-                            vertices[c - 1],
-                            material,
-                        )
-                    )
-
-        return cls(triangles)
+            vertices, indices = parse_obj(f.read(), scale, translate)
+        if not indices:
+            raise ValueError(f"obj file {obj_file!r} has no faces")
+
+        faces = face_data(vertices, indices)
+        if cache:
+            write_cache(path, obj_file, vertices, indices, *faces)
+        return cls(vertices, indices, material, faces)
+
+    def __reduce__(self) -> Tuple[Any, ...]:
+        # memory mapped buffers can't be pickled, send copies instead
+        return (
+            Mesh,
+            (
+                array("d", self.vertices),
+                array("i", self.indices),
+                self.material,
+                (array("d", self._normals), array("d", self._min_dets)),
+            ),
+        )
+
+    def bvh(self) -> BVH:
+        # BVH of the faces alone, built on first use and shared by
+        # every Instance of the mesh
+        if self._bvh is None:
+            from raytracer.bvh import BVH
+
+            self._bvh = BVH([self])
+        return self._bvh
+
+    @property
+    def triangles(self) -> List[Triangle]:
+        # the faces as separate Triangle objects
+        return [
+            Triangle(*self.face_vertices(f), self.material)
+            for f in range(self.primitive_count())
+        ]
+
+    def face_vertices(self, face: int) -> Tuple[Vec3, Vec3, Vec3]:
+        v = self.vertices
+        a, b, c = self.indices[3 * face : 3 * face + 3]
+        return (
+            Vec3(v[3 * a], v[3 * a + 1], v[3 * a + 2]),
+            Vec3(v[3 * b], v[3 * b + 1], v[3 * b + 2]),
+            Vec3(v[3 * c], v[3 * c + 1], v[3 * c + 2]),
+        )
+
+    def primitive_count(self) -> int:
+        return len(self.indices) // 3
+
+    def primitive_bounds(self, prim: int) -> AABB:
+        return AABB.from_points(*self.face_vertices(prim))
+
+    def intersect_primitive(
+        self, prim: int, ray_o: Vec3, ray_d: Vec3
+    ) -> Tuple[bool, float]:
+        v = self.vertices
+        f = 3 * prim
+        a, b, c = 3 * self.indices[f], 3 * self.indices[f + 1], 3 * self.indices[f + 2]
+        ax, ay, az = v[a], v[a + 1], v[a + 2]
+        intersect, t, _, _ = moller_trumbore(
+            ax,
+            ay,
+            az,
+            v[b] - ax,
+            v[b + 1] - ay,
+            v[b + 2] - az,
+            v[c] - ax,
+            v[c + 1] - ay,
+            v[c + 2] - az,
+            self._min_dets[prim],
+            ray_o,
+            ray_d,
+        )
+        return intersect, t
+
+    def primitive_normal(self, prim: int, ray_d: Vec3, intersect: Vec3) -> Vec3:
+        n = self._normals
+        k = 3 * prim
+        nx, ny, nz = n[k], n[k + 1], n[k + 2]
+        if ray_d.x * nx + ray_d.y * ny + ray_d.z * nz < 0:
+            return Vec3(nx, ny, nz)
+        return Vec3(-nx, -ny, -nz)
+
+    def bounds(self) -> AABB:
+        v = self.vertices
+        if not v:
+            return AABB.empty()
+        return AABB(
+            Vec3(min(v[0::3]), min(v[1::3]), min(v[2::3])),
+            Vec3(max(v[0::3]), max(v[1::3]), max(v[2::3])),
+        )
+
+    def intersect(self, ray_o: Vec3, ray_d: Vec3) -> Tuple[bool, float]:
+        # closest face along the ray, the renderer doesn't use
+        # this as it puts the individual faces in its BVH
+        closest_t = float("inf")
+        for f in range(self.primitive_count()):
+            intersect, t = self.intersect_primitive(f, ray_o, ray_d)
+            if intersect and t < closest_t:
+                closest_t = t
+        if closest_t == float("inf"):
+            return False, 0
+        return True, closest_t
+
+    def __repr__(self) -> str:
+        return (
+            f"Mesh(vertices={len(self.vertices) // 3}, "
+            f"faces={self.primitive_count()}, material={self.material})"
+        )
@@ -1,10 +1,18 @@
-from typing import Tuple
+from typing import Any, List, Tuple
 
-from raytracer.linalg import Vec3
+from raytracer.batch import to_array
+from raytracer.linalg import AABB, Vec3
 from raytracer.materials import Material
 
 
 class Object:
+    # which rays see the object, e.g. helper geometry that only blocks
+    # light can be hidden from the camera and from reflections (and
+    # refractions). only objects with a Diffuse material cast shadows
+    casts_shadows: bool = True
+    visible_to_camera: bool = True
+    visible_in_reflections: bool = True
+
     def __init__(self, material: Material) -> None:
         self.material = material
         raise NotImplementedError()
@@ -14,3 +22,40 @@ class Object:
 
     def intersect(self, ray_o: Vec3, ray_d: Vec3) -> Tuple[bool, float]:
         raise NotImplementedError()
+
+    def intersect_many(self, origins: Any, directions: Any) -> Tuple[Any, Any]:
+        # batched intersect, takes (n, 3) arrays of ray origins and
+        # directions and returns a boolean hit mask and the t values.
+        # subclasses override this with numpy kernels, this is the
+        # scalar fallback used for everything else
+        mask: List[bool] = []
+        ts: List[float] = []
+        for o, d in zip(origins, directions):
+            intersect, t = self.intersect(
+                Vec3(float(o[0]), float(o[1]), float(o[2])),
+                Vec3(float(d[0]), float(d[1]), float(d[2])),
+            )
+            mask.append(intersect)
+            ts.append(t if intersect else 0.0)
+        return to_array(mask), to_array(ts)
+
+    def bounds(self) -> AABB:
+        raise NotImplementedError()
+
+    # composite objects (meshes) are made of several primitives that
+    # the renderer intersects one by one, plain objects return 0 from
+    # primitive_count() and are intersected as a whole
+
+    def primitive_count(self) -> int:
+        return 0
+
+    def primitive_bounds(self, prim: int) -> AABB:
+        raise NotImplementedError()
+
+    def intersect_primitive(
+        self, prim: int, ray_o: Vec3, ray_d: Vec3
+    ) -> Tuple[bool, float]:
+        raise NotImplementedError()
+
+    def primitive_normal(self, prim: int, ray_d: Vec3, intersect: Vec3) -> Vec3:
+        raise NotImplementedError()
@@ -0,0 +1,160 @@
+import hashlib
+import mmap
+import os
+import struct
+import sys
+from array import array
+from typing import List, Optional, Sequence, Tuple
+
+from raytracer.linalg import Vec3
+
+# binary cache files next to the obj file hold the parsed vertex and
+# index buffers and the per face data of Mesh (see mesh.face_data),
+# they are memory mapped when loaded so a cached mesh costs no
+# parsing, no copying and no per face setup
+
+CACHE_MAGIC = b"RTMESH02"
+# magic, byte order, source mtime (ns), source size, vertex floats, indices
+_HEADER = struct.Struct("=8s8sqqqq")
+# the buffers start on an 8 byte boundary after the header: vertices,
+# face normals and face min_dets (doubles), then the indices
+_DATA_OFFSET = (_HEADER.size + 7) // 8 * 8
+
+# vertices, indices, face normals and face min_dets
+MeshBuffers = Tuple[Sequence[float], Sequence[int], Sequence[float], Sequence[float]]
+
+
+def parse_obj(
+    text: str, scale: float = 1.0, translate: Vec3 = Vec3(0, 0, 0)
+) -> Tuple["array[float]", "array[int]"]:
+    # returns flat (x, y, z) vertices and three indices per face,
+    # polygons are split into triangle fans and textures, normals
+    # and everything else are ignored
+    # (keyword, rest of the line) of the v and f records, any
+    # whitespace separates the keyword, and lines may be indented
+    records: List[Tuple[str, str]] = []
+    for line in text.splitlines():
+        parts = line.split(None, 1)
+        if parts and (parts[0] == "v" or parts[0] == "f"):
+            records.append((parts[0], parts[1] if len(parts) == 2 else ""))
+    v_lines = [rest for key, rest in records if key == "v"]
+    f_lines = [rest for key, rest in records if key == "f"]
+
+    # fast path for the common case of exactly 3 coordinates per line
+    tokens = " ".join(v_lines).split()
+    if len(tokens) != 3 * len(v_lines):
+        tokens = [tok for line in v_lines for tok in line.split()[:3]]
+    vertices = array("d", map(float, tokens))
+
+    if scale != 1 or translate.x or translate.y or translate.z:
+        for a, offset in enumerate((translate.x, translate.y, translate.z)):
+            vertices[a::3] = array("d", [x * scale + offset for x in vertices[a::3]])
+
+    # every face line is checked, a quad and a line would add up
+    # to two triangles
+    if set(map(len, map(str.split, f_lines))) == {3}:
+        # all triangles, "v", "v/vt", "v//vn" and "v/vt/vn" are all fine
+        joined = " ".join(f_lines)
+        tokens = joined.split()
+        if "/" in joined:
+            tokens = [tok.partition("/")[0] for tok in tokens]
+        indices = array("i", map(int, tokens))
+        if indices and min(indices) > 0:
+            return vertices, array("i", [i - 1 for i in indices])
+
+    # polygons or negative (relative) indices, these need to know
+    # how many vertices were defined before each face
+    indices = array("i")
+    n_vertices = 0
+    for key, rest in records:
+        if key == "v":
+            n_vertices += 1
+        else:
+            refs: List[int] = []
+            for tok in rest.split():
+                ind = int(tok.partition("/")[0])
+                if ind == 0:
+                    raise ValueError(f"obj face {rest!r} has vertex index 0")
+                refs.append(ind - 1 if ind > 0 else n_vertices + ind)
+            for k in range(1, len(refs) - 1):
+                indices.extend((refs[0], refs[k], refs[k + 1]))
+    return vertices, indices
+
+
+def cache_path(obj_file: str, scale: float, translate: Vec3) -> str:
+    # one cache file per (obj file, scale, translate), the header
+    # records the mtime and size of the obj file it was built from
+    key = repr(
+        (os.path.abspath(obj_file), scale, translate.x, translate.y, translate.z)
+    )
+    digest = hashlib.sha1(key.encode()).hexdigest()[:16]
+    return f"{obj_file}.{digest}.cache"
+
+
+def load_cache(path: str, obj_file: str) -> Optional[MeshBuffers]:
+    # memory maps the cache, returns None if it is missing or stale
+    try:
+        stat = os.stat(obj_file)
+        with open(path, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+
+    if len(mm) < _DATA_OFFSET:
+        return None
+    magic, byteorder, mtime, size, n_floats, n_indices = _HEADER.unpack_from(mm)
+    n_faces = n_indices // 3
+    normals = _DATA_OFFSET + 8 * n_floats
+    min_dets = normals + 24 * n_faces
+    indices = min_dets + 8 * n_faces
+    if (
+        magic != CACHE_MAGIC
+        or byteorder.rstrip(b"\0") != sys.byteorder.encode()
+        or mtime != stat.st_mtime_ns
+        or size != stat.st_size
+        or n_indices % 3
+        or len(mm) != indices + 4 * n_indices
+    ):
+        return None
+
+    view = memoryview(mm)
+    return (
+        view[_DATA_OFFSET:normals].cast("d"),
+        view[indices : indices + 4 * n_indices].cast("i"),
+        view[normals:min_dets].cast("d"),
+        view[min_dets:indices].cast("d"),
+    )
+
+
+def write_cache(
+    path: str,
+    obj_file: str,
+    vertices: "array[float]",
+    indices: "array[int]",
+    normals: "array[float]",
+    min_dets: "array[float]",
+) -> None:
+    stat = os.stat(obj_file)
+    header = _HEADER.pack(
+        CACHE_MAGIC,
+        sys.byteorder.encode(),
+        stat.st_mtime_ns,
+        stat.st_size,
+        len(vertices),
+        len(indices),
+    )
+
+    # write to a temporary file first so that a
+    # half written cache is never picked up
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, "wb") as f:
+            f.write(header.ljust(_DATA_OFFSET, b"\0"))
+            for buffer in (vertices, normals, min_dets, indices):
+                buffer.tofile(f)
+        os.replace(tmp, path)
+    except OSError:
+        # caching is best effort, e.g. the model directory may be read only
+        sys.stderr.write(f"Could not write mesh cache {path}\n")
+        if os.path.exists(tmp):
+            os.remove(tmp)
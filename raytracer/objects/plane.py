@@ -0,0 +1,80 @@
+from typing import Any, Tuple
+
+from raytracer.batch import HAS_NUMPY
+from raytracer.linalg import AABB, EPSILON, Vec3
+from raytracer.materials import Material
+from raytracer.objects.object_t import Object
+
+# half the size of a plane's bounding box along the axes it extends in,
+# finite so that the BVH's slab tests and surface areas stay numbers
+PLANE_EXTENT = 1e30
+
+
+class Plane(Object):
+    # infinite plane through point, two sided like Triangle. a cheaper
+    # and more precise floor than a huge sphere or a pair of triangles
+
+    __slots__ = ("point", "N", "material", "back_N", "offset")
+
+    def __init__(self, point: Vec3, normal: Vec3, material: Material):
+        self.point = point
+        self.N = normal.normalize()
+        self.back_N = -self.N
+        self.material = material
+
+        # the plane is N . p == offset
+        self.offset = self.N.dot(point)
+
+    def normal(self, ray_d: Vec3, intersect: Vec3) -> Vec3:
+        # return self.N or -self.N, whichever faces the ray origin
+        if ray_d.dot(self.N) < 0:
+            return self.N
+        return self.back_N
+
+    def intersect(self, ray_o: Vec3, ray_d: Vec3) -> Tuple[bool, float]:
+        N = self.N
+        denom = N.x * ray_d.x + N.y * ray_d.y + N.z * ray_d.z
+        # same cutoff for (almost) parallel rays as Triangle.min_det
+        if abs(denom) < EPSILON:
+            return False, 0
+        t = (self.offset - (N.x * ray_o.x + N.y * ray_o.y + N.z * ray_o.z)) / denom
+        if t < 0:
+            return False, 0
+        return True, t
+
+    def intersect_many(self, origins: Any, directions: Any) -> Tuple[Any, Any]:
+        if not HAS_NUMPY:
+            return super().intersect_many(origins, directions)
+        import numpy as np
+
+        o = np.asarray(origins, dtype=float)
+        d = np.asarray(directions, dtype=float)
+        N = self.N
+
+        # same expressions as intersect()
+        denom = N.x * d[:, 0] + N.y * d[:, 1] + N.z * d[:, 2]
+        dist = self.offset - (N.x * o[:, 0] + N.y * o[:, 1] + N.z * o[:, 2])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t = dist / denom
+        mask = (np.abs(denom) >= EPSILON) & (t >= 0)
+        return mask, np.where(mask, t, 0.0)
+
+    def bounds(self) -> AABB:
+        # thin along the normal's axis for axis aligned planes
+        N, p = self.N, self.point
+        big = PLANE_EXTENT
+        lo = Vec3(-big, -big, -big)
+        hi = Vec3(big, big, big)
+        if N.y == 0 and N.z == 0:
+            lo.x = hi.x = p.x
+        elif N.x == 0 and N.z == 0:
+            lo.y = hi.y = p.y
+        elif N.x == 0 and N.y == 0:
+            lo.z = hi.z = p.z
+        return AABB(lo, hi)
+
+    def __repr__(self) -> str:
+        return f"Plane(point={self.point}, normal={self.N}, material={self.material})"
+
+    def __str__(self) -> str:
+        return f"Plane(p={self.point}, n={self.N}, m={self.material})"
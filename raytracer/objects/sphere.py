@@ -1,38 +1,41 @@
 import math
-from typing import Tuple
+from typing import Any, Tuple
 
-from raytracer.linalg import Vec3
+from raytracer.batch import HAS_NUMPY
+from raytracer.linalg import AABB, Vec3, dot3
 from raytracer.materials import Material
 from raytracer.objects.object_t import Object
 
 
 class Sphere(Object):
-    __slots__ = ("origin", "radius", "amterial")
+    __slots__ = ("origin", "radius", "material", "origin_sq", "radius_sq")
 
     def __init__(self, origin: Vec3, radius: float, material: Material):
         self.origin = origin
         self.radius = radius
         self.material = material
 
+        # constant terms of intersect()
+        self.origin_sq = origin.x**2 + origin.y**2 + origin.z**2
+        self.radius_sq = radius**2
+
     def normal(self, ray_d: Vec3, intersect: Vec3) -> Vec3:
-        return (intersect - self.origin).normalize()
+        return self.origin.direction_to(intersect)
 
     def intersect(self, ray_o: Vec3, ray_d: Vec3) -> Tuple[bool, float]:
-        a = ray_d.x**2 + ray_d.y**2 + ray_d.z**2
-        b = 2 * (
-            ray_d.x * (ray_o.x - self.origin.x)
-            + ray_d.y * (ray_o.y - self.origin.y)
-            + ray_d.z * (ray_o.z - self.origin.z)
-        )
+        ox, oy, oz = ray_o.x, ray_o.y, ray_o.z
+        dx, dy, dz = ray_d.x, ray_d.y, ray_d.z
+        origin = self.origin
+        cx, cy, cz = origin.x, origin.y, origin.z
+        a = dx**2 + dy**2 + dz**2
+        b = 2 * (dx * (ox - cx) + dy * (oy - cy) + dz * (oz - cz))
         c = (
-            self.origin.x**2
-            + self.origin.y**2
-            + self.origin.z**2
-            + ray_o.x**2
-            + ray_o.y**2
-            + ray_o.z**2
-            - 2 * (Vec3.dot(self.origin, ray_o))
-            - self.radius**2
+            self.origin_sq
+            + ox**2
+            + oy**2
+            + oz**2
+            - 2 * dot3(cx, cy, cz, ox, oy, oz)
+            - self.radius_sq
         )
 
         D = b**2 - 4 * a * c
@@ -44,6 +47,38 @@ class Sphere(Object):
             return False, 0
         return True, t
 
+    def intersect_many(self, origins: Any, directions: Any) -> Tuple[Any, Any]:
+        if not HAS_NUMPY:
+            return super().intersect_many(origins, directions)
+        import numpy as np
+
+        o = np.asarray(origins, dtype=float)
+        d = np.asarray(directions, dtype=float)
+        ox, oy, oz = o[:, 0], o[:, 1], o[:, 2]
+        dx, dy, dz = d[:, 0], d[:, 1], d[:, 2]
+        cx, cy, cz = self.origin.x, self.origin.y, self.origin.z
+
+        # same expressions as intersect()
+        a = dx**2 + dy**2 + dz**2
+        b = 2 * (dx * (ox - cx) + dy * (oy - cy) + dz * (oz - cz))
+        c = (
+            self.origin_sq
+            + ox**2
+            + oy**2
+            + oz**2
+            - 2 * (cx * ox + cy * oy + cz * oz)
+            - self.radius_sq
+        )
+
+        D = b**2 - 4 * a * c
+        with np.errstate(invalid="ignore"):
+            t = (-b - np.sqrt(D)) / (2 * a)
+        mask = (D >= 0) & (t >= 0)
+        return mask, np.where(mask, t, 0.0)
+
+    def bounds(self) -> AABB:
+        return AABB(self.origin - self.radius, self.origin + self.radius)
+
     def __repr__(self) -> str:
         return f"Sphere(origin={self.origin}, radius={self.radius}, material={self.material})"
 
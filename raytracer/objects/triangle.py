@@ -1,12 +1,64 @@
-from typing import Tuple
+from typing import Any, Tuple
 
-from raytracer.linalg import EPSILON, Vec3
+from raytracer.batch import HAS_NUMPY
+from raytracer.linalg import AABB, EPSILON, Vec3
 from raytracer.materials import Material
 from raytracer.objects.object_t import Object
 
 
+def moller_trumbore(
+    ax: float,
+    ay: float,
+    az: float,
+    e1x: float,
+    e1y: float,
+    e1z: float,
+    e2x: float,
+    e2y: float,
+    e2z: float,
+    min_det: float,
+    ray_o: Vec3,
+    ray_d: Vec3,
+) -> Tuple[bool, float, float, float]:
+    # ray-triangle intersection for the triangle (a, a + e1, a + e2),
+    # returns (intersect, t, u, v) with u and v the barycentric
+    # weights of the second and third vertex
+    dx, dy, dz = ray_d.x, ray_d.y, ray_d.z
+
+    # p = ray_d x e2
+    px = dy * e2z - dz * e2y
+    py = dz * e2x - dx * e2z
+    pz = dx * e2y - dy * e2x
+    det = e1x * px + e1y * py + e1z * pz
+    # <= so that zero area triangles (min_det == 0) never divide by 0
+    if abs(det) <= min_det:
+        return False, 0, 0, 0
+    inv_det = 1 / det
+
+    # s = ray_o - a
+    sx = ray_o.x - ax
+    sy = ray_o.y - ay
+    sz = ray_o.z - az
+    u = (sx * px + sy * py + sz * pz) * inv_det
+    if u < 0 or u > 1:
+        return False, 0, 0, 0
+
+    # q = s x e1
+    qx = sy * e1z - sz * e1y
+    qy = sz * e1x - sx * e1z
+    qz = sx * e1y - sy * e1x
+    v = (dx * qx + dy * qy + dz * qz) * inv_det
+    if v < 0 or u + v > 1:
+        return False, 0, 0, 0
+
+    t = (e2x * qx + e2y * qy + e2z * qz) * inv_det
+    if t < 0:
+        return False, 0, 0, 0
+    return True, t, u, v
+
+
 class Triangle(Object):
-    __slots__ = ("a", "b", "c", "material", "N")
+    __slots__ = ("a", "b", "c", "material", "N", "back_N", "e1", "e2", "min_det")
 
     def __init__(self, a: Vec3, b: Vec3, c: Vec3, material: Material):
         self.a = a
@@ -14,54 +66,99 @@ class Triangle(Object):
         self.c = c
         self.material = material
 
-        self.N = (b - a).cross(c - a).normalize()
+        # constants for moller-trumbore
+        self.e1 = b - a
+        self.e2 = c - a
+        cross = self.e1.cross(self.e2)
+        self.N = cross.normalize()
+        self.back_N = -self.N
 
-    def normal(self, ray_d: Vec3, intersect: Vec3) -> Vec3:
-        # return self.N or -self.N depending on which normal has a
-        # smaller theta angle with the ray origin
+        # the determinant is -|e1 x e2| * ray_d.dot(N), so this rejects
+        # rays that are (almost) parallel to the plane of the triangle
+        self.min_det = EPSILON * cross.norm()
 
-        # if (-ray_d).tt_angle(self.N) < (-ray_d).tt_angle(-self.N)
-        # simplifies to:
-        # if ray_d.tt_angle(self.N) > ray_d.tt_angle(-self.N)
-        if ray_d.tt_angle(self.N) > ray_d.tt_angle(-self.N):
+    def normal(self, ray_d: Vec3, intersect: Vec3) -> Vec3:
+        # return self.N or -self.N, whichever faces the ray origin
+        if ray_d.dot(self.N) < 0:
             return self.N
-        return -self.N
+        return self.back_N
 
     def intersect(self, ray_o: Vec3, ray_d: Vec3) -> Tuple[bool, float]:
-        # there exist faster triangle-ray intersection algorithms
-        # but this is good enough for now
-
-        N_ray_dir = ray_d.dot(self.N)
-        if abs(N_ray_dir) < EPSILON:
-            return False, 0
-
-        d = -self.N.dot(self.a)
-        t = -(self.N.dot(ray_o) + d) / N_ray_dir
-
-        if t < 0:
-            return False, 0
-
-        P = ray_o + ray_d * t
-
-        edge_ab = self.b - self.a
-        vpa = P - self.a
-        C = edge_ab.cross(vpa)
-        if self.N.dot(C) < 0:
-            return False, 0
-
-        edge_bc = self.c - self.b
-        vpb = P - self.b
-        C = edge_bc.cross(vpb)
-        if self.N.dot(C) < 0:
-            return False, 0
-
-        edge_ca = self.a - self.c
-        vpc = P - self.c
-        C = edge_ca.cross(vpc)
-        if self.N.dot(C) < 0:
-            return False, 0
-
-        return True, t
+        a, e1, e2 = self.a, self.e1, self.e2
+        intersect, t, u, v = moller_trumbore(
+            a.x,
+            a.y,
+            a.z,
+            e1.x,
+            e1.y,
+            e1.z,
+            e2.x,
+            e2.y,
+            e2.z,
+            self.min_det,
+            ray_o,
+            ray_d,
+        )
+        return intersect, t
+
+    def intersect_barycentric(
+        self, ray_o: Vec3, ray_d: Vec3
+    ) -> Tuple[bool, float, float, float]:
+        # returns (intersect, t, u, v) where u and v are the
+        # barycentric weights of b and c at the intersection point
+        a, e1, e2 = self.a, self.e1, self.e2
+        return moller_trumbore(
+            a.x,
+            a.y,
+            a.z,
+            e1.x,
+            e1.y,
+            e1.z,
+            e2.x,
+            e2.y,
+            e2.z,
+            self.min_det,
+            ray_o,
+            ray_d,
+        )
+
+    def intersect_many(self, origins: Any, directions: Any) -> Tuple[Any, Any]:
+        if not HAS_NUMPY:
+            return super().intersect_many(origins, directions)
+        import numpy as np
+
+        o = np.asarray(origins, dtype=float)
+        d = np.asarray(directions, dtype=float)
+        dx, dy, dz = d[:, 0], d[:, 1], d[:, 2]
+        e1 = self.e1
+        e2 = self.e2
+
+        # same steps as moller_trumbore()
+        px = dy * e2.z - dz * e2.y
+        py = dz * e2.x - dx * e2.z
+        pz = dx * e2.y - dy * e2.x
+        det = e1.x * px + e1.y * py + e1.z * pz
+        mask = np.abs(det) > self.min_det
+
+        sx = o[:, 0] - self.a.x
+        sy = o[:, 1] - self.a.y
+        sz = o[:, 2] - self.a.z
+        qx = sy * e1.z - sz * e1.y
+        qy = sz * e1.x - sx * e1.z
+        qz = sx * e1.y - sy * e1.x
+
+        # rays with det == 0 get inf or nan here, mask drops them
+        with np.errstate(divide="ignore", invalid="ignore"):
+            inv_det = 1 / det
+            u = (sx * px + sy * py + sz * pz) * inv_det
+            v = (dx * qx + dy * qy + dz * qz) * inv_det
+            t = (e2.x * qx + e2.y * qy + e2.z * qz) * inv_det
+
+        mask &= (u >= 0) & (u <= 1) & (v >= 0) & (u + v <= 1) & (t >= 0)
+        return mask, np.where(mask, t, 0.0)
+
+    def bounds(self) -> AABB:
+        return AABB.from_points(self.a, self.b, self.c)
 
     def __repr__(self) -> str:
         return f"Triangle(a={self.a}, b={self.b}, c={self.c}, material={self.material})"
@@ -17,3 +17,23 @@ class Settings:
     distance_to_image: float
     fov: float
     bias: float
+    # secondary rays carrying less than this share of a pixel's color
+    # are not traced, 0 traces everything up to the recursion depth
+    min_weight: float = 0
+    # trace rays below min_weight with probability weight / min_weight
+    # instead, this keeps the image unbiased at the cost of some noise
+    russian_roulette: bool = False
+    # with anti aliasing, start every pixel with two samples and only
+    # cast the rest where those differ by more than aa_threshold in any
+    # channel, or where the pixel and its neighbors hit different
+    # objects or differ by more than aa_threshold
+    adaptive_aa: bool = False
+    aa_threshold: float = 0.02
+    # diffuse hits skip the shadow ray to lights that would add at most
+    # this much to any channel even if unblocked, 0 only skips the
+    # lights behind the surface, which changes nothing in the image
+    light_threshold: float = 0
+    # with more lights than this, every diffuse hit casts shadow rays to
+    # only this many of them, picked at random in proportion to their
+    # power and weighted to match on average. 0 uses all the lights
+    light_samples: int = 0
@@ -1,112 +1,1190 @@
-import itertools
-import math
+import multiprocessing
+import os
+import random
 import sys
-from typing import List, Sequence
+import tempfile
+import time
+from array import array
+from itertools import groupby
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple, cast
 
+from raytracer.batch import HAS_NUMPY
+from raytracer.camera import Directions, RayGenerator, TileRays, ray_generator
+from raytracer.checkpoint import Checkpoint, render_digest
+from raytracer.framebuffer import Framebuffer, Tile, make_tiles
+from raytracer.gbuffer import GBuffer
 from raytracer.lights import Light
 from raytracer.linalg import Mat44, Vec3
-from raytracer.materials import Diffuse, Reflect, ReflectRefract
-from raytracer.objects import Mesh, Object
-from raytracer.options import Resolution, Settings
+from raytracer.materials import Reflect, ReflectRefract
+from raytracer.objects import Instance, Object
+from raytracer.options import Settings
+from raytracer.scene import (
+    DIFFUSE,
+    DIRECTIONAL_LIGHT,
+    POINT_LIGHT,
+    REFLECT,
+    REFLECT_REFRACT,
+    CompiledScene,
+    compile_scene,
+)
+from raytracer.stats import RenderStats
+
+# share of the light a Reflect material reflects,
+# a rough approximation of the fresnel effect
+MIRROR_REFLECTANCE = 0.8
+
+INTEGRATORS = ("recursive", "wavefront")
+
+# block size of the first pass of progressive renders
+PREVIEW_STEP = 8
 
 
 def check_interference(
-    ray_o: Vec3, ray_d: Vec3, objects: Sequence[Object], source_ind: int
+    ray_o: Vec3,
+    ray_d: Vec3,
+    scene: CompiledScene,
+    source_ind: int,
+    source_sub: int = -1,
+    stats: Optional[RenderStats] = None,
+    light: int = -1,
 ) -> bool:
-    # check if ray intersects with any object
-    # assuming that all objects are opaque
-    for i, obj in enumerate(objects):
-        if i == source_ind or not isinstance(obj.material, Diffuse):
-            continue
-        intersect, t = obj.intersect(ray_o, ray_d)
-        if intersect:
-            return True
-    return False
+    # check if ray intersects with any shadow caster other than
+    # primitive source_sub of object source_ind. with the index of
+    # the light the ray goes towards, the primitive that blocked the
+    # previous ray towards that light, if any, is tested before the BVH
+    bvh = scene.shadow_bvh
+    if stats is not None:
+        stats.shadow_rays += 1
+
+    cached = scene.shadow_cache[light] if light >= 0 else -1
+    if cached != -1 and bvh.ref_occludes(
+        cached, ray_o, ray_d, source_ind, source_sub, stats
+    ):
+        blocked = True
+    else:
+        occluder = bvh.occluder(ray_o, ray_d, source_ind, source_sub, stats)
+        blocked = occluder != -1
+        # unblocked rays clear the cache, so lit areas don't pay for it
+        if light >= 0:
+            scene.shadow_cache[light] = occluder
+
+    if blocked and stats is not None:
+        stats.shadow_hits += 1
+    return blocked
+
+
+def progressive_pixels(tile: Tile, step: int) -> List[Tuple[int, int]]:
+    # pixels (i, j) of the tile that a progressive render traces in the
+    # pass with blocks of step x step pixels: the ones on a grid with
+    # that spacing that weren't traced in an earlier, coarser pass
+    x0, y0, x1, y1 = tile
+    return [
+        (i, j)
+        for i in range(y0 + -y0 % step, y1, step)
+        for j in range(x0 + -x0 % step, x1, step)
+        if step == PREVIEW_STEP or i % (2 * step) or j % (2 * step)
+    ]
+
+
+def write_blocks(
+    fb: Framebuffer,
+    tile: Tile,
+    step: int,
+    pixels: Sequence[Tuple[int, int]],
+    colors: Sequence[Vec3],
+) -> None:
+    # fills the step x step block at every pixel, within the tile
+    x0, y0, x1, y1 = tile
+    for (i, j), color in zip(pixels, colors):
+        block = (j, i, min(j + step, x1), min(i + step, y1))
+        area = (block[2] - j) * (block[3] - i)
+        fb.write_tile(block, [color.x, color.y, color.z] * area)
+
+
+def path_scale(weight: float, settings: Settings) -> float:
+    # what to scale the color of a secondary ray with a throughput of
+    # weight by, 0 means that the ray is not worth tracing. paths below
+    # settings.min_weight are cut off, or with russian roulette survive
+    # with probability weight / min_weight and are scaled up to match
+    min_weight = settings.min_weight
+    if weight >= min_weight:
+        return 1
+    if settings.russian_roulette and weight > 0:
+        p = weight / min_weight
+        if random.random() < p:
+            return 1 / p
+    return 0
 
 
 def cast_ray(
     ray_o: Vec3,
     ray_d: Vec3,
-    objects: Sequence[Object],
-    lights: Sequence[Light],
-    settings: Settings,
+    scene: CompiledScene,
     max_depth: int,
+    stats: Optional[RenderStats] = None,
+    weight: float = 1,
+    camera: bool = False,
 ) -> Vec3:
+    # weight is the share of the ray's color that ends up in the
+    # pixel, the product of all reflectances along the path. camera
+    # rays and secondary rays see different objects, see Object
     if max_depth == 0:
-        return settings.background_color
-
-    closest_t = float("inf")
-    obj_ind = -1
-    for i, obj in enumerate(objects):
-        intersect, t = obj.intersect(ray_o, ray_d)
-        if intersect and t < closest_t:
-            closest_t = t
-            obj_ind = i
+        return scene.settings.background_color
 
+    bvh = scene.camera_bvh if camera else scene.secondary_bvh
+    obj_ind, sub_ind, closest_t = bvh.closest_hit(ray_o, ray_d, stats)
+    if stats is not None:
+        if obj_ind == -1:
+            stats.misses += 1
+        else:
+            stats.hits += 1
     if obj_ind == -1:
-        return settings.background_color
+        return scene.settings.background_color
 
-    obj = objects[obj_ind]
-    intersect_p: Vec3 = ray_o + ray_d * closest_t
-    normal = obj.normal(ray_d, intersect_p)
-    bias = normal * settings.bias
+    return shade_hit(
+        ray_o, ray_d, obj_ind, sub_ind, closest_t, scene, max_depth, stats, weight
+    )
 
-    hit_color = Vec3(0, 0, 0)
 
-    if isinstance(obj.material, Diffuse):
-        # diffuse lighting
-        for light in lights:
-            light_dir = light.direction_at(intersect_p)
+def light_direction(scene: CompiledScene, k: int, p: Vec3) -> Vec3:
+    # unit vector from p towards light k
+    kind = scene.light_kinds[k]
+    if kind == DIRECTIONAL_LIGHT:
+        return cast(Vec3, scene.light_vectors[k])
+    if kind == POINT_LIGHT:
+        return p.direction_to(cast(Vec3, scene.light_vectors[k]))
+    return scene.lights[k].direction_at(p)
 
-            # shadows
-            if check_interference(intersect_p + bias, light_dir, objects, obj_ind):
-                continue
 
-            # shading
-            hit_color += (
-                obj.material.albedo
-                / math.pi
-                * light.intensity
-                * light.color
-                * max(0, normal.dot(light_dir))
+def direct_light(
+    scene: CompiledScene,
+    obj_ind: int,
+    sub_ind: int,
+    intersect_p: Vec3,
+    normal: Vec3,
+    bias: Vec3,
+    stats: Optional[RenderStats] = None,
+    shadows: Optional["array[int]"] = None,
+    base: int = 0,
+) -> Vec3:
+    # diffuse lighting at a point of primitive sub_ind of object obj_ind,
+    # from all lights or a sample of them, see Settings.light_samples.
+    # whether light k is blocked is looked up in and saved to
+    # shadows[base + k] if given, see GBuffer
+    color = Vec3(0, 0, 0)
+    radiance = scene.radiance[obj_ind]
+    settings = scene.settings
+    picks: Sequence[Tuple[int, float]]
+    if 0 < settings.light_samples < len(scene.lights):
+        # lights behind the surface can't add anything, so only the
+        # ones in front of it are picked. a point light is in front
+        # if normal.dot(position - intersect_p) > 0
+        weights = array("d", scene.light_powers)
+        plane = normal.dot(intersect_p)
+        for k, kind in enumerate(scene.light_kinds):
+            vector = scene.light_vectors[k]
+            if kind == DIRECTIONAL_LIGHT:
+                front = normal.dot(cast(Vec3, vector)) > 0
+            elif kind == POINT_LIGHT:
+                front = normal.dot(cast(Vec3, vector)) > plane
+            else:
+                front = normal.dot(scene.lights[k].direction_at(intersect_p)) > 0
+            if not front:
+                weights[k] = 0
+        picks = scene.sample_lights(settings.light_samples, weights)
+        # culling sampled lights would make the estimate biased
+        threshold = 0.0
+    else:
+        picks = scene.every_light
+        threshold = settings.light_threshold
+    shadow_o = intersect_p + bias
+    for k, scale in picks:
+        light_dir = light_direction(scene, k, intersect_p)
+
+        # the most the light can add, no shadow ray if that's too little
+        cos = normal.dot(light_dir) * scale
+        r = radiance[k]
+        if cos <= 0 or cos * max(r.x, r.y, r.z) <= threshold:
+            continue
+
+        # shadows
+        if shadows is None:
+            blocked = check_interference(
+                shadow_o, light_dir, scene, obj_ind, sub_ind, stats, light=k
             )
+        elif shadows[base + k] == -1:
+            blocked = check_interference(
+                shadow_o, light_dir, scene, obj_ind, sub_ind, stats, light=k
+            )
+            shadows[base + k] = blocked
+        else:
+            blocked = shadows[base + k] == 1
+        if blocked:
+            continue
+
+        # shading
+        color.iadd_scaled(r, cos)
+    return color
+
+
+def hit_geometry(
+    scene: CompiledScene,
+    obj_ind: int,
+    sub_ind: int,
+    ray_o: Vec3,
+    ray_d: Vec3,
+    t: float,
+) -> Tuple[Vec3, Vec3]:
+    # the point where the ray hit primitive sub_ind of object obj_ind
+    # (-1 for plain objects) at t, and the normal there
+    obj = scene.objects[obj_ind]
+    intersect_p = ray_o.add_scaled(ray_d, t)
+    if sub_ind < 0:
+        return intersect_p, obj.normal(ray_d, intersect_p)
+    return intersect_p, obj.primitive_normal(sub_ind, ray_d, intersect_p)
+
+
+def shade_hit(
+    ray_o: Vec3,
+    ray_d: Vec3,
+    obj_ind: int,
+    sub_ind: int,
+    closest_t: float,
+    scene: CompiledScene,
+    max_depth: int,
+    stats: Optional[RenderStats] = None,
+    weight: float = 1,
+) -> Vec3:
+    # color of the ray after it hit primitive sub_ind
+    # of object obj_ind (-1 for plain objects) at closest_t
+    settings = scene.settings
+    intersect_p, normal = hit_geometry(scene, obj_ind, sub_ind, ray_o, ray_d, closest_t)
+    bias = normal.scale(settings.bias)
+
+    hit_color = Vec3(0, 0, 0)
+    kind = scene.kinds[obj_ind]
 
-    elif isinstance(obj.material, ReflectRefract):
-        refract_k = obj.material.fresnel(ray_d, normal)
+    if kind == DIFFUSE:
+        hit_color.iadd(
+            direct_light(scene, obj_ind, sub_ind, intersect_p, normal, bias, stats)
+        )
+
+    elif kind == REFLECT_REFRACT:
+        material = cast(ReflectRefract, scene.materials[obj_ind])
+        refract_k = material.fresnel(ray_d, normal)
 
         refract_color = Vec3(0, 0, 0)
-        if refract_k < 1:
+        refract_weight = weight * (1 - refract_k)
+        scale = path_scale(refract_weight, settings) if refract_k < 1 else 0
+        if scale:
             # refraction occurs
-            refract_d = obj.material.refract(ray_d, normal)
+            refract_d = material.refract(ray_d, normal)
+            if stats is not None:
+                stats.refraction_rays += 1
             refract_color = cast_ray(
-                intersect_p - bias, refract_d, objects, lights, settings, max_depth - 1
+                intersect_p - bias,
+                refract_d,
+                scene,
+                max_depth - 1,
+                stats,
+                refract_weight * scale,
             )
+            if scale != 1:
+                refract_color = refract_color.scale(scale)
+        elif refract_k < 1 and stats is not None:
+            stats.terminated_rays += 1
 
-        reflect_d = obj.material.reflect(ray_d, normal)
-        reflect_color = cast_ray(
-            intersect_p + bias, reflect_d, objects, lights, settings, max_depth - 1
-        )
+        reflect_color = Vec3(0, 0, 0)
+        reflect_weight = weight * refract_k
+        scale = path_scale(reflect_weight, settings)
+        if scale:
+            reflect_d = material.reflect(ray_d, normal)
+            if stats is not None:
+                stats.reflection_rays += 1
+            reflect_color = cast_ray(
+                intersect_p + bias,
+                reflect_d,
+                scene,
+                max_depth - 1,
+                stats,
+                reflect_weight * scale,
+            )
+            if scale != 1:
+                reflect_color = reflect_color.scale(scale)
+        elif stats is not None:
+            stats.terminated_rays += 1
 
-        hit_color += reflect_color * refract_k + refract_color * (1 - refract_k)
+        hit_color.iadd_scaled(reflect_color, refract_k)
+        hit_color.iadd_scaled(refract_color, 1 - refract_k)
 
-    elif isinstance(obj.material, Reflect):
+    elif kind == REFLECT:
         # perfect mirror reflection
-        reflect_d = obj.material.reflect(ray_d, normal)
-        hit_color += (
-            cast_ray(
+        reflect_weight = weight * MIRROR_REFLECTANCE
+        scale = path_scale(reflect_weight, settings)
+        if scale:
+            reflect_d = cast(Reflect, scene.materials[obj_ind]).reflect(ray_d, normal)
+            if stats is not None:
+                stats.reflection_rays += 1
+            reflect_color = cast_ray(
                 intersect_p + bias,
                 reflect_d,
-                objects,
-                lights,
-                settings,
+                scene,
                 max_depth - 1,
+                stats,
+                reflect_weight * scale,
             )
-            * 0.8  # rough fresnel effect approximation
-        )
+            if scale != 1:
+                reflect_color = reflect_color.scale(scale)
+            hit_color.iadd_scaled(reflect_color, MIRROR_REFLECTANCE)
+        elif stats is not None:
+            stats.terminated_rays += 1
 
     return hit_color
 
 
+def shade_gbuffer_tile(
+    scene: CompiledScene,
+    gbuffer: GBuffer,
+    tile: Tile,
+    stats: Optional[RenderStats] = None,
+    start: Optional[float] = None,
+) -> List[float]:
+    # the tile's colors as flat row-major rgb floats, shaded from the
+    # camera hits in gbuffer the same way as render_pixel. start is when
+    # tracing the tile's camera rays began (perf_counter), with stats
+    # that time is split evenly over the pixels
+    shade_start = time.perf_counter()
+    x0, y0, x1, y1 = tile
+    AA2 = gbuffer.anti_aliasing**2
+    depth = gbuffer.recursion_depth
+    look_from = gbuffer.look_from
+    background = scene.settings.background_color
+    bias = scene.settings.bias
+    kinds = scene.kinds
+    objects, subs, depths = gbuffer.objects, gbuffer.subs, gbuffer.depths
+    points, normals, directions = gbuffer.points, gbuffer.normals, gbuffer.directions
+    shadows = gbuffer.shadows
+    n_lights = len(scene.lights)
+
+    ret: List[float] = []
+    pixel_times = array("d")
+    batch_time = 0.0
+    if start is not None:
+        batch_time = (shade_start - start) / ((x1 - x0) * (y1 - y0))
+    for i in range(y0, y1):
+        for j in range(x0, x1):
+            pixel_start = time.perf_counter()
+            color = Vec3(0, 0, 0)
+            first = gbuffer.sample_index(i, j)
+            for s in range(first, first + AA2):
+                ind = objects[s]
+                if depth == 0 or ind == -1:
+                    color.iadd(background)
+                elif kinds[ind] == DIFFUSE:
+                    normal = Vec3(
+                        normals[3 * s], normals[3 * s + 1], normals[3 * s + 2]
+                    )
+                    color.iadd(
+                        direct_light(
+                            scene,
+                            ind,
+                            subs[s],
+                            Vec3(points[3 * s], points[3 * s + 1], points[3 * s + 2]),
+                            normal,
+                            normal.scale(bias),
+                            stats,
+                            shadows,
+                            s * n_lights,
+                        )
+                    )
+                else:
+                    ray_d = Vec3(
+                        directions[3 * s], directions[3 * s + 1], directions[3 * s + 2]
+                    )
+                    color.iadd(
+                        shade_hit(
+                            look_from,
+                            ray_d,
+                            ind,
+                            subs[s],
+                            depths[s],
+                            scene,
+                            depth,
+                            stats,
+                        )
+                    )
+            color = color / AA2
+            ret.extend((color.x, color.y, color.z))
+            if stats is not None:
+                pixel_times.append(time.perf_counter() - pixel_start + batch_time)
+
+    if stats is not None:
+        elapsed = time.perf_counter() - (shade_start if start is None else start)
+        stats.tiles.append((tile, elapsed, pixel_times))
+    return ret
+
+
+class Frame:
+    # everything needed to trace the pixels of one image,
+    # pickled once per worker process when rendering in parallel
+
+    __slots__ = (
+        "scene",
+        "settings",
+        "look_from",
+        "camera",
+        "rays",
+        "anti_aliasing",
+        "recursion_depth",
+        "vectorize",
+        "integrator",
+    )
+
+    def __init__(
+        self,
+        look_from: Vec3,
+        look_at: Vec3,
+        scene: CompiledScene,
+        anti_aliasing: int,
+        recursion_depth: int,
+        camera_up: Vec3,
+        vectorize: bool = False,
+        integrator: str = "recursive",
+    ):
+        if integrator not in INTEGRATORS:
+            raise ValueError(
+                f"unknown integrator {integrator!r}, expected one of {INTEGRATORS}"
+            )
+
+        settings = scene.settings
+        img_res = settings.resolution
+        if not (isinstance(img_res.w, int) and isinstance(img_res.h, int)):
+            sys.stderr.write("Image resolution must be integer, casting to int\n")
+            img_res.w, img_res.h = int(img_res.w), int(img_res.h)
+
+        self.rays: RayGenerator = ray_generator(
+            img_res.w,
+            img_res.h,
+            settings.fov,
+            settings.distance_to_image,
+            anti_aliasing,
+        )
+
+        self.scene = scene
+        self.settings = settings
+        self.look_from = look_from
+        self.camera = Mat44.camera(look_from, look_at, camera_up)
+        self.anti_aliasing = anti_aliasing
+        self.recursion_depth = recursion_depth
+
+        if vectorize and not HAS_NUMPY:
+            sys.stderr.write("numpy is not installed, using scalar primary rays\n")
+        self.vectorize = vectorize and HAS_NUMPY
+        self.integrator = integrator
+        if self.vectorize:
+            # build them before the frame is sent to any worker processes
+            scene.composite_bvh(True)
+            scene.composite_bvh(False)
+
+    def render_pixel(self, i: int, j: int, stats: Optional[RenderStats] = None) -> Vec3:
+        AA = self.anti_aliasing
+
+        color = Vec3(0, 0, 0)
+        for ray_d in self.rays.tile_directions(self.camera, (j, i, j + 1, i + 1)):
+            if stats is not None:
+                stats.primary_rays += 1
+            color.iadd(
+                cast_ray(
+                    self.look_from,
+                    ray_d,
+                    self.scene,
+                    self.recursion_depth,
+                    stats,
+                    camera=True,
+                )
+            )
+        return color / AA**2
+
+    def render_tile(
+        self, tile: Tile, stats: Optional[RenderStats] = None
+    ) -> List[float]:
+        # returns the tile's colors as flat row-major rgb floats
+        if self.settings.adaptive_aa and self.anti_aliasing > 1:
+            return self.render_tile_adaptive(tile, stats)
+        if self.integrator == "wavefront":
+            return self.render_tile_wavefront(tile, stats)
+        if self.vectorize:
+            return self.render_tile_vectorized(tile, stats)
+
+        x0, y0, x1, y1 = tile
+        ret: List[float] = []
+        if stats is None:
+            for i in range(y0, y1):
+                for j in range(x0, x1):
+                    color = self.render_pixel(i, j)
+                    ret.extend((color.x, color.y, color.z))
+            return ret
+
+        # same as above, but timing every pixel
+        start = time.perf_counter()
+        pixel_times = array("d")
+        for i in range(y0, y1):
+            for j in range(x0, x1):
+                pixel_start = time.perf_counter()
+                color = self.render_pixel(i, j, stats)
+                pixel_times.append(time.perf_counter() - pixel_start)
+                ret.extend((color.x, color.y, color.z))
+        stats.tiles.append((tile, time.perf_counter() - start, pixel_times))
+        return ret
+
+    def batch_closest_hit(
+        self,
+        origins: Any,
+        directions: Any,
+        stats: Optional[RenderStats] = None,
+        camera: bool = False,
+    ) -> Tuple[List[int], List[int], List[float]]:
+        # closest hits (object index, sub index, t) of a (n, 3) array of
+        # camera or secondary rays, plain objects are tested with
+        # Object.intersect_many
+        import numpy as np
+
+        n = len(directions)
+        closest_t = np.full(n, np.inf)
+        obj_ind = np.full(n, -1)
+        # ties go to the lowest index, like in BVH.closest_hit
+        scene = self.scene
+        for i, obj in enumerate(scene.objects):
+            if obj.primitive_count() or isinstance(obj, Instance):
+                continue
+            if not (obj.visible_to_camera if camera else obj.visible_in_reflections):
+                continue
+            mask, t = obj.intersect_many(origins, directions)
+            if stats is not None:
+                stats.count_tests(obj, n, int(mask.sum()))
+            closer = mask & (t < closest_t)
+            closest_t = np.where(closer, t, closest_t)
+            obj_ind = np.where(closer, i, obj_ind)
+
+        inds: List[int] = obj_ind.tolist()
+        subs = [-1] * n
+        ts: List[float] = closest_t.tolist()
+        composite_bvh = scene.composite_bvh(camera)
+        if composite_bvh is None:
+            return inds, subs, ts
+
+        o_list = np.asarray(origins).tolist()
+        d_list = np.asarray(directions).tolist()
+        for k in range(n):
+            (ox, oy, oz), (dx, dy, dz) = o_list[k], d_list[k]
+            c_ind, c_sub, c_t = composite_bvh.closest_hit(
+                Vec3(ox, oy, oz), Vec3(dx, dy, dz), stats
+            )
+            if c_ind == -1:
+                continue
+            ind, t = inds[k], ts[k]
+            if ind == -1 or c_t < t or (c_t == t and c_ind < ind):
+                inds[k], subs[k], ts[k] = c_ind, c_sub, c_t
+        return inds, subs, ts
+
+    def render_tile_vectorized(
+        self, tile: Tile, stats: Optional[RenderStats] = None
+    ) -> List[float]:
+        # traces every primary ray of the tile as one batch with
+        # Object.intersect_many, then shades the hits one by one
+        start = time.perf_counter()
+        AA2 = self.anti_aliasing**2
+        sample_times = None if stats is None else array("d")
+        samples, _ = self.trace_samples(
+            self.rays.tile_array(self.camera, tile), stats, sample_times
+        )
+
+        ret: List[float] = []
+        pixel_times = array("d")
+        for k in range(0, len(samples), AA2):
+            color = Vec3(0, 0, 0)
+            for sample in samples[k : k + AA2]:
+                color.iadd(sample)
+            color = color / AA2
+            ret.extend((color.x, color.y, color.z))
+            if sample_times is not None:
+                pixel_times.append(sum(sample_times[k : k + AA2]))
+
+        if stats is not None:
+            stats.tiles.append((tile, time.perf_counter() - start, pixel_times))
+        return ret
+
+    def closest_hits(
+        self,
+        directions: Directions,
+        stats: Optional[RenderStats] = None,
+        origins: Optional[List[Vec3]] = None,
+    ) -> Tuple[List[int], List[int], List[float]]:
+        # closest hits (object index, sub index, t) of secondary rays
+        # from origins, or of camera rays if there are no origins, with
+        # batch_closest_hit when vectorized. counts the hits and misses
+        if not len(directions):
+            return [], [], []
+        scene = self.scene
+        camera = origins is None
+        if self.vectorize:
+            import numpy as np
+
+            if origins is None:
+                o = np.array([self.look_from.x, self.look_from.y, self.look_from.z])
+                batch_o = np.broadcast_to(o, (len(directions), 3))
+            else:
+                batch_o = np.array([(p.x, p.y, p.z) for p in origins])
+            if isinstance(directions, TileRays):
+                batch_d = directions.array
+            else:
+                batch_d = np.array([(d.x, d.y, d.z) for d in directions])
+            inds, subs, ts = self.batch_closest_hit(batch_o, batch_d, stats, camera)
+        else:
+            bvh = scene.camera_bvh if camera else scene.secondary_bvh
+            if origins is None:
+                origins = [self.look_from] * len(directions)
+            inds, subs, ts = [], [], []
+            for k in range(len(directions)):
+                obj_ind, sub_ind, closest_t = bvh.closest_hit(
+                    origins[k], directions[k], stats
+                )
+                inds.append(obj_ind)
+                subs.append(sub_ind)
+                ts.append(closest_t)
+
+        if stats is not None:
+            misses = inds.count(-1)
+            stats.misses += misses
+            stats.hits += len(inds) - misses
+        return inds, subs, ts
+
+    def trace_samples(
+        self,
+        directions: Directions,
+        stats: Optional[RenderStats] = None,
+        sample_times: Optional["array[float]"] = None,
+    ) -> Tuple[List[Vec3], List[int]]:
+        # colors of the camera rays with the given directions and the
+        # objects they hit first (-1 for none), with whichever way of
+        # tracing this frame uses. with sample_times, the time spent on
+        # every ray is appended to it (not with the wavefront integrator)
+        n = len(directions)
+        if not n:
+            return [], []
+        if self.integrator == "wavefront":
+            if isinstance(directions, TileRays):
+                directions = directions.vectors()
+            sums, primary_inds, _ = self.trace_wavefront(
+                directions, list(range(n)), n, stats
+            )
+            return sums, primary_inds
+
+        scene = self.scene
+        background = self.settings.background_color
+        depth = self.recursion_depth
+        if stats is not None:
+            stats.primary_rays += n
+        if depth == 0:
+            return [background] * n, [-1] * n
+
+        start = time.perf_counter()
+        inds, subs, ts = self.closest_hits(directions, stats)
+        # the batch's time is split evenly over the rays
+        batch_time = (time.perf_counter() - start) / n
+
+        colors: List[Vec3] = []
+        for k in range(n):
+            sample_start = time.perf_counter()
+            if inds[k] == -1:
+                colors.append(background)
+            else:
+                colors.append(
+                    shade_hit(
+                        self.look_from,
+                        directions[k],
+                        inds[k],
+                        subs[k],
+                        ts[k],
+                        scene,
+                        depth,
+                        stats,
+                    )
+                )
+            if sample_times is not None:
+                sample_times.append(time.perf_counter() - sample_start + batch_time)
+        return colors, inds
+
+    def render_item(
+        self,
+        fb: Framebuffer,
+        tile: Tile,
+        step: int,
+        sample: int,
+        deadline: Optional[float],
+        stats: Optional[RenderStats] = None,
+        gbuffer: Optional[GBuffer] = None,
+    ) -> bool:
+        # renders one tile of a pass of render_scene_iter into fb,
+        # step 0 renders the whole tile at once (not progressive).
+        # the shadow occluder cache starts empty so that the work done
+        # for a tile doesn't depend on which process rendered it
+        self.scene.clear_shadow_cache()
+        if gbuffer is not None:
+            start = time.perf_counter()
+            self.capture_tile(tile, gbuffer, stats)
+            fb.write_tile(
+                tile, shade_gbuffer_tile(self.scene, gbuffer, tile, stats, start)
+            )
+            gbuffer.tiles.append(tile)
+            return True
+        if deadline is not None:
+            return self.render_budget_tile(fb, tile, step, sample, deadline, stats)
+        if step:
+            self.render_pass_tile(fb, tile, step, stats)
+        else:
+            fb.write_tile(tile, self.render_tile(tile, stats))
+        return True
+
+    def capture_tile(
+        self, tile: Tile, gbuffer: GBuffer, stats: Optional[RenderStats] = None
+    ) -> None:
+        # traces every camera ray of the tile into gbuffer
+        x0, y0, x1, y1 = tile
+        directions = self.rays.tile_directions(self.camera, tile)
+        n = len(directions)
+        if stats is not None:
+            stats.primary_rays += n
+        if self.recursion_depth == 0:
+            # like trace_samples, nothing is traced
+            inds, subs, ts = [-1] * n, [-1] * n, [0.0] * n
+        else:
+            inds, subs, ts = self.closest_hits(directions, stats)
+
+        # the tile's samples are in the same order as its rays
+        samples = [
+            s
+            for i in range(y0, y1)
+            for s in range(gbuffer.sample_index(i, x0), gbuffer.sample_index(i, x1))
+        ]
+        points, normals = gbuffer.points, gbuffer.normals
+        for s, ray_d, obj_ind, sub_ind, t in zip(samples, directions, inds, subs, ts):
+            gbuffer.objects[s] = obj_ind
+            gbuffer.subs[s] = sub_ind
+            gbuffer.directions[3 * s] = ray_d.x
+            gbuffer.directions[3 * s + 1] = ray_d.y
+            gbuffer.directions[3 * s + 2] = ray_d.z
+            if obj_ind == -1:
+                continue
+
+            intersect_p, normal = hit_geometry(
+                self.scene, obj_ind, sub_ind, self.look_from, ray_d, t
+            )
+            gbuffer.depths[s] = t
+            points[3 * s] = intersect_p.x
+            points[3 * s + 1] = intersect_p.y
+            points[3 * s + 2] = intersect_p.z
+            normals[3 * s] = normal.x
+            normals[3 * s + 1] = normal.y
+            normals[3 * s + 2] = normal.z
+
+    def render_pixels(
+        self, pixels: Sequence[Tuple[int, int]], stats: Optional[RenderStats] = None
+    ) -> List[Vec3]:
+        # colors of the pixels (i, j), always with every anti aliasing sample
+        AA = self.anti_aliasing
+        directions = [
+            self.rays.direction(self.camera, i, j, a_i, a_j)
+            for i, j in pixels
+            for a_i in range(AA)
+            for a_j in range(AA)
+        ]
+        samples, _ = self.trace_samples(directions, stats)
+
+        ret: List[Vec3] = []
+        for k in range(0, len(samples), AA**2):
+            color = Vec3(0, 0, 0)
+            for sample in samples[k : k + AA**2]:
+                color.iadd(sample)
+            ret.append(color / AA**2)
+        return ret
+
+    def render_pass_tile(
+        self,
+        fb: Framebuffer,
+        tile: Tile,
+        step: int,
+        stats: Optional[RenderStats] = None,
+    ) -> None:
+        # one tile of one pass of a progressive render, see render_iter
+        start = time.perf_counter()
+        pixels = progressive_pixels(tile, step)
+        write_blocks(fb, tile, step, pixels, self.render_pixels(pixels, stats))
+
+        if stats is not None and pixels:
+            # the time is split evenly over the traced pixels
+            x0, y0, x1, y1 = tile
+            elapsed = time.perf_counter() - start
+            pixel_times = array("d", bytes(8 * (x1 - x0) * (y1 - y0)))
+            for i, j in pixels:
+                pixel_times[(i - y0) * (x1 - x0) + j - x0] = elapsed / len(pixels)
+            stats.tiles.append((tile, elapsed, pixel_times))
+
+    def render_budget_tile(
+        self,
+        fb: Framebuffer,
+        tile: Tile,
+        step: int,
+        sample: int,
+        deadline: float,
+        stats: Optional[RenderStats] = None,
+    ) -> bool:
+        # one tile of one pass of a time budgeted render, see
+        # render_scene_iter. sample 0 is the progressive preview with
+        # blocks of step x step pixels, every later sample adds the
+        # subpixel rays.order[sample] to the running mean of every
+        # pixel. the deadline (a time.monotonic() time) is checked
+        # before every row of pixels, returns False if it had passed
+        # before anything was traced
+        start = time.perf_counter()
+        x0, y0, x1, y1 = tile
+        rays = self.rays
+        a_i, a_j = rays.order[sample]
+        if sample == 0:
+            pixels = progressive_pixels(tile, step)
+        else:
+            pixels = [(i, j) for i in range(y0, y1) for j in range(x0, x1)]
+
+        traced: List[Tuple[int, int]] = []
+        # pixels are ordered by row
+        for _, row in groupby(pixels, key=lambda pixel: pixel[0]):
+            row_pixels = list(row)
+            if time.monotonic() >= deadline:
+                break
+            directions = [
+                rays.direction(self.camera, i, j, a_i, a_j) for i, j in row_pixels
+            ]
+            colors, _ = self.trace_samples(directions, stats)
+            if sample == 0:
+                write_blocks(fb, tile, step, row_pixels, colors)
+            else:
+                for (i, j), color in zip(row_pixels, colors):
+                    mean = fb.get(i, j)
+                    fb.set(i, j, mean + (color - mean) / (sample + 1))
+            traced.extend(row_pixels)
+
+        if stats is not None and traced:
+            elapsed = time.perf_counter() - start
+            w = x1 - x0
+            pixel_times = array("d", bytes(8 * w * (y1 - y0)))
+            counts = array("i", bytes(4 * w * (y1 - y0)))
+            for i, j in traced:
+                pixel_times[(i - y0) * w + j - x0] = elapsed / len(traced)
+                counts[(i - y0) * w + j - x0] = 1
+            stats.tiles.append((tile, elapsed, pixel_times))
+            stats.samples.append((tile, counts))
+        return bool(traced)
+
+    def render_tile_adaptive(
+        self, tile: Tile, stats: Optional[RenderStats] = None
+    ) -> List[float]:
+        # adaptive anti aliasing, see Settings.adaptive_aa. the first two
+        # samples are the corners (0, 0) and (AA - 1, AA - 1) of the
+        # subpixel grid. they are traced for the tile and a one pixel
+        # border, so that edges along tile borders are found and the
+        # image does not depend on the tile size. pixels that get all
+        # samples sum them in the same order as full anti aliasing
+        start = time.perf_counter()
+        x0, y0, x1, y1 = tile
+        AA = self.anti_aliasing
+        rays = self.rays
+        camera = self.camera
+        threshold = self.settings.aa_threshold
+        first = ((0, 0), (AA - 1, AA - 1))
+
+        # first pass over the tile and its border
+        bx0, by0 = max(x0 - 1, 0), max(y0 - 1, 0)
+        bx1, by1 = min(x1 + 1, rays.width), min(y1 + 1, rays.height)
+        bw = bx1 - bx0
+        directions = [
+            rays.direction(camera, i, j, a_i, a_j)
+            for i in range(by0, by1)
+            for j in range(bx0, bx1)
+            for a_i, a_j in first
+        ]
+        colors, inds = self.trace_samples(directions, stats)
+
+        # mean color and first object of every pixel in the window
+        means: List[Vec3] = []
+        objects: List[int] = []
+        uniform: List[bool] = []
+        for k in range(0, len(colors), 2):
+            c0, c1 = colors[k], colors[k + 1]
+            means.append((c0 + c1) * 0.5)
+            objects.append(inds[k])
+            uniform.append(
+                inds[k] == inds[k + 1]
+                and abs(c0.x - c1.x) <= threshold
+                and abs(c0.y - c1.y) <= threshold
+                and abs(c0.z - c1.z) <= threshold
+            )
+
+        refine: List[Tuple[int, int]] = []
+        for i in range(y0, y1):
+            for j in range(x0, x1):
+                k = (i - by0) * bw + j - bx0
+                if not uniform[k]:
+                    refine.append((i, j))
+                    continue
+                neighbors = []
+                if i > by0:
+                    neighbors.append(k - bw)
+                if i + 1 < by1:
+                    neighbors.append(k + bw)
+                if j > bx0:
+                    neighbors.append(k - 1)
+                if j + 1 < bx1:
+                    neighbors.append(k + 1)
+                a = means[k]
+                for n in neighbors:
+                    b = means[n]
+                    if (
+                        objects[k] != objects[n]
+                        or abs(a.x - b.x) > threshold
+                        or abs(a.y - b.y) > threshold
+                        or abs(a.z - b.z) > threshold
+                    ):
+                        refine.append((i, j))
+                        break
+
+        # second pass, the remaining samples of the pixels to refine
+        rest = [
+            (a_i, a_j)
+            for a_i in range(AA)
+            for a_j in range(AA)
+            if (a_i, a_j) not in first
+        ]
+        directions = [
+            rays.direction(camera, i, j, a_i, a_j)
+            for i, j in refine
+            for a_i, a_j in rest
+        ]
+        rest_colors, _ = self.trace_samples(directions, stats)
+
+        pixels = [
+            means[(i - by0) * bw + j - bx0]
+            for i in range(y0, y1)
+            for j in range(x0, x1)
+        ]
+        samples = iter(rest_colors)
+        for i, j in refine:
+            k = (i - by0) * bw + j - bx0
+            color = Vec3(0, 0, 0)
+            for a_i in range(AA):
+                for a_j in range(AA):
+                    if (a_i, a_j) == first[0]:
+                        color.iadd(colors[2 * k])
+                    elif (a_i, a_j) == first[1]:
+                        color.iadd(colors[2 * k + 1])
+                    else:
+                        color.iadd(next(samples))
+            pixels[(i - y0) * (x1 - x0) + j - x0] = color / AA**2
+
+        ret: List[float] = []
+        for color in pixels:
+            ret.extend((color.x, color.y, color.z))
+
+        if stats is not None:
+            # split the tile's time by the number of samples of each pixel
+            elapsed = time.perf_counter() - start
+            pixel_rays = [2] * len(pixels)
+            for i, j in refine:
+                pixel_rays[(i - y0) * (x1 - x0) + j - x0] = AA**2
+            total_rays = sum(pixel_rays)
+            pixel_times = array("d", [elapsed * n / total_rays for n in pixel_rays])
+            stats.tiles.append((tile, elapsed, pixel_times))
+        return ret
+
+    def render_tile_wavefront(
+        self, tile: Tile, stats: Optional[RenderStats] = None
+    ) -> List[float]:
+        start = time.perf_counter()
+        x0, y0, x1, y1 = tile
+        AA = self.anti_aliasing
+
+        n_pixels = (x1 - x0) * (y1 - y0)
+        directions = self.rays.tile_directions(self.camera, tile)
+        pixels = [p for p in range(n_pixels) for _ in range(AA**2)]
+        colors, _, pixel_rays = self.trace_wavefront(
+            directions, pixels, n_pixels, stats
+        )
+
+        ret: List[float] = []
+        for color in colors:
+            color /= AA**2
+            ret.extend((color.x, color.y, color.z))
+
+        if stats is not None:
+            elapsed = time.perf_counter() - start
+            total_rays = sum(pixel_rays)
+            pixel_times = array("d", [elapsed * n / total_rays for n in pixel_rays])
+            stats.tiles.append((tile, elapsed, pixel_times))
+        return ret
+
+    def trace_wavefront(
+        self,
+        directions: List[Vec3],
+        pixels: List[int],
+        n_pixels: int,
+        stats: Optional[RenderStats] = None,
+    ) -> Tuple[List[Vec3], List[int], List[int]]:
+        # iterative integrator, instead of recursing for every bounce it
+        # keeps a queue of pending rays (origin, direction, weight, pixel)
+        # and traces each bounce of all camera rays as one batch. every
+        # path adds weight * (its local color) to its pixel, which sums
+        # to the same colors as the recursion in cast_ray.
+        # camera ray k adds to pixel pixels[k], returns the summed colors
+        # of the pixels, the object camera ray k hit (-1 for none) and
+        # the number of rays traced for each pixel
+        settings = self.settings
+        scene = self.scene
+        background = settings.background_color
+
+        colors = [Vec3(0, 0, 0) for _ in range(n_pixels)]
+        pixel_rays = [0] * n_pixels
+        primary_inds = [-1] * len(directions)
+
+        origins = [self.look_from] * len(directions)
+        weights = [1.0] * len(directions)
+        if stats is not None:
+            stats.primary_rays += len(directions)
+
+        depth = self.recursion_depth
+        while directions:
+            if depth == 0:
+                # out of bounces, like cast_ray with max_depth == 0
+                for weight, p in zip(weights, pixels):
+                    colors[p].iadd_scaled(background, weight)
+                break
+
+            for p in pixels:
+                pixel_rays[p] += 1
+
+            camera = depth == self.recursion_depth
+            inds, subs, ts = self.closest_hits(
+                directions, stats, None if camera else origins
+            )
+
+            if camera:
+                primary_inds = list(inds)
+
+            next_origins: List[Vec3] = []
+            next_directions: List[Vec3] = []
+            next_weights: List[float] = []
+            next_pixels: List[int] = []
+            for k in range(len(directions)):
+                ray_o, ray_d = origins[k], directions[k]
+                weight, p = weights[k], pixels[k]
+                obj_ind, sub_ind = inds[k], subs[k]
+                if obj_ind == -1:
+                    colors[p].iadd_scaled(background, weight)
+                    continue
+
+                # same as shade_hit, except that secondary rays are queued
+                intersect_p, normal = hit_geometry(
+                    scene, obj_ind, sub_ind, ray_o, ray_d, ts[k]
+                )
+                bias = normal.scale(settings.bias)
+                kind = scene.kinds[obj_ind]
+
+                if kind == DIFFUSE:
+                    colors[p].iadd_scaled(
+                        direct_light(
+                            scene, obj_ind, sub_ind, intersect_p, normal, bias, stats
+                        ),
+                        weight,
+                    )
+
+                elif kind == REFLECT_REFRACT:
+                    material = cast(ReflectRefract, scene.materials[obj_ind])
+                    refract_k = material.fresnel(ray_d, normal)
+
+                    refract_weight = weight * (1 - refract_k)
+                    scale = path_scale(refract_weight, settings) if refract_k < 1 else 0
+                    if scale:
+                        if stats is not None:
+                            stats.refraction_rays += 1
+                        next_origins.append(intersect_p - bias)
+                        next_directions.append(material.refract(ray_d, normal))
+                        next_weights.append(refract_weight * scale)
+                        next_pixels.append(p)
+                    elif refract_k < 1 and stats is not None:
+                        stats.terminated_rays += 1
+
+                    reflect_weight = weight * refract_k
+                    scale = path_scale(reflect_weight, settings)
+                    if scale:
+                        if stats is not None:
+                            stats.reflection_rays += 1
+                        next_origins.append(intersect_p + bias)
+                        next_directions.append(material.reflect(ray_d, normal))
+                        next_weights.append(reflect_weight * scale)
+                        next_pixels.append(p)
+                    elif stats is not None:
+                        stats.terminated_rays += 1
+
+                elif kind == REFLECT:
+                    reflect_weight = weight * MIRROR_REFLECTANCE
+                    scale = path_scale(reflect_weight, settings)
+                    if scale:
+                        if stats is not None:
+                            stats.reflection_rays += 1
+                        mirror = cast(Reflect, scene.materials[obj_ind])
+                        next_origins.append(intersect_p + bias)
+                        next_directions.append(mirror.reflect(ray_d, normal))
+                        next_weights.append(reflect_weight * scale)
+                        next_pixels.append(p)
+                    elif stats is not None:
+                        stats.terminated_rays += 1
+
+            origins, directions = next_origins, next_directions
+            weights, pixels = next_weights, next_pixels
+            depth -= 1
+
+        return colors, primary_inds, pixel_rays
+
+
+# per process state for parallel rendering
+_worker_frame: Optional[Frame] = None
+_worker_fb: Optional[Framebuffer] = None
+_worker_stats = False
+
+
+def _init_worker(
+    frame: Frame, fb_path: str, width: int, height: int, collect_stats: bool
+) -> None:
+    global _worker_frame, _worker_fb, _worker_stats
+    _worker_frame = frame
+    _worker_fb = Framebuffer.open(fb_path, width, height)
+    _worker_stats = collect_stats
+    # forked workers would otherwise share one russian roulette sequence
+    random.seed()
+
+
+def _render_tile_worker(
+    item: Tuple[Tile, int, int, Optional[float]],
+) -> Tuple[Tile, Optional[RenderStats], bool]:
+    # renders (tile, step, sample, deadline) like the serial loop in
+    # render_scene_iter. workers write straight into the shared
+    # framebuffer file, only the tile's stats (if any) go back to the
+    # parent, along with whether anything was traced before the deadline
+    assert _worker_frame is not None and _worker_fb is not None
+    tile, step, sample, deadline = item
+    stats = RenderStats() if _worker_stats else None
+    traced = _worker_frame.render_item(_worker_fb, tile, step, sample, deadline, stats)
+    return tile, stats, traced
+
+
 def render(
     look_from: Vec3,
     look_at: Vec3,
@@ -118,53 +1196,415 @@ def render(
     recursion_depth: int = 5,
     camera_up: Vec3 = Vec3(0, 1, 0),
     threads: int = 1,
-) -> List[List[Vec3]]:
-    # todo: add asserts
-
-    fov = math.radians(settings.fov)
-    img_res = settings.resolution
-    world_res_w = 2 * settings.distance_to_image * math.tan(fov / 2)
-    world_res = Resolution(world_res_w, world_res_w * img_res.h / img_res.w)
-    cell_size = world_res.w / img_res.w
-
-    if not (isinstance(img_res.w, int) and isinstance(img_res.h, int)):
-        sys.stderr.write("Image resolution must be integer, casting to int\n")
-        img_res.w, img_res.h = int(img_res.w), int(img_res.h)
-    image = [[Vec3(0, 0, 0) for _ in range(img_res.w)] for _ in range(img_res.h)]
-
-    AA = anti_aliasing
-
-    new_objects: List[Object] = []
-    for obj in objects:
-        if isinstance(obj, Mesh):
-            new_objects.extend(obj.triangles)
-        else:
-            new_objects.append(obj)
-    objects = new_objects
-
-    camera = Mat44.camera(look_from, look_at, camera_up)
-    for i, j in itertools.product(range(img_res.h), range(img_res.w)):
-        for a_i, a_j in itertools.product(range(AA), range(AA)):
-            # first cast ray from (0, 0, 0) into -z direction to
-            # the image plane, then translate using the camera matrix
-
-            ray_d = Vec3(
-                j * cell_size + (cell_size / AA) * (a_j + 0.5) - world_res.w / 2,
-                (img_res.h - i) * cell_size
-                + (cell_size / AA) * (a_i + 0.5)
-                - world_res.h / 2,
-                -settings.distance_to_image,
-            ).normalize()
-            ray_d = camera.transform_dir(ray_d)
-
-            image[i][j] += cast_ray(
-                look_from,
-                ray_d,
-                objects,
-                lights,
-                settings,
-                recursion_depth,
+    tile_size: int = 16,
+    vectorize: bool = False,
+    integrator: str = "recursive",
+    stats: Optional[RenderStats] = None,
+    time_budget: Optional[float] = None,
+    checkpoint: Optional[str] = None,
+    region: Optional[Tile] = None,
+    into: Optional[Framebuffer] = None,
+    gbuffer: Optional[GBuffer] = None,
+) -> Framebuffer:
+    # compiles the scene and renders it once, use compile_scene and
+    # render_scene to render the same scene more than once
+    start = time.monotonic()
+    scene = compile_scene(objects, lights, settings)
+    return render_scene(
+        scene,
+        look_from,
+        look_at,
+        anti_aliasing=anti_aliasing,
+        recursion_depth=recursion_depth,
+        camera_up=camera_up,
+        threads=threads,
+        tile_size=tile_size,
+        vectorize=vectorize,
+        integrator=integrator,
+        stats=stats,
+        time_budget=remaining_budget(time_budget, start),
+        checkpoint=checkpoint,
+        region=region,
+        into=into,
+        gbuffer=gbuffer,
+    )
+
+
+def render_scene(
+    scene: CompiledScene,
+    look_from: Vec3,
+    look_at: Vec3,
+    *,
+    anti_aliasing: int = 1,
+    recursion_depth: int = 5,
+    camera_up: Vec3 = Vec3(0, 1, 0),
+    threads: int = 1,
+    tile_size: int = 16,
+    vectorize: bool = False,
+    integrator: str = "recursive",
+    stats: Optional[RenderStats] = None,
+    time_budget: Optional[float] = None,
+    checkpoint: Optional[str] = None,
+    region: Optional[Tile] = None,
+    into: Optional[Framebuffer] = None,
+    gbuffer: Optional[GBuffer] = None,
+) -> Framebuffer:
+    # threads is the number of worker processes,
+    # 0 or less uses every available core
+
+    # vectorize traces primary rays a tile at a time with numpy,
+    # it tests every ray against every object so it pays off for
+    # scenes with few objects, big meshes are faster without it
+
+    # integrator="wavefront" traces the image one bounce at a time
+    # instead of recursing, the images are the same up to rounding
+    # and recursion_depth is not limited by python's recursion limit
+
+    # pass a RenderStats to have it count rays and intersection tests
+    # and time every tile and pixel, see RenderStats.summary / heatmap
+
+    # with time_budget, the render stops after that many seconds, see
+    # render_scene_iter. stats.sample_counts() tells how many samples
+    # every pixel got
+
+    # with checkpoint (a file path), the image is rendered into that
+    # file and can be resumed after a crash, see render_scene_iter
+
+    # region=(x0, y0, x1, y1) only renders that window of pixels (x1 and
+    # y1 exclusive), they come out exactly as in a render of the whole
+    # image. the rest of the image is black, or left as it is in into:
+    # an existing framebuffer of the same size to render into
+
+    # with gbuffer (an empty GBuffer() or one from an earlier render),
+    # the camera rays' hits are kept in it so that relight() can shade
+    # them again with other lights or materials. every pixel gets every
+    # anti aliasing sample, even with Settings.adaptive_aa, and is shaded
+    # by the recursive integrator
+    updates = render_scene_iter(
+        scene,
+        look_from,
+        look_at,
+        anti_aliasing=anti_aliasing,
+        recursion_depth=recursion_depth,
+        camera_up=camera_up,
+        threads=threads,
+        tile_size=tile_size,
+        vectorize=vectorize,
+        integrator=integrator,
+        stats=stats,
+        time_budget=time_budget,
+        checkpoint=checkpoint,
+        region=region,
+        into=into,
+        gbuffer=gbuffer,
+    )
+    fb = next(updates)[2]
+    for _ in updates:
+        pass
+    return fb
+
+
+def relight(
+    gbuffer: GBuffer,
+    lights: Sequence[Light],
+    settings: Settings,
+    *,
+    stats: Optional[RenderStats] = None,
+) -> Framebuffer:
+    # the image of the render that filled gbuffer, with other lights
+    # and settings (of the same resolution) and with the materials the
+    # objects have now, shaded from the kept camera hits instead of
+    # tracing the camera rays again. the scene's BVHs are reused, and
+    # shadow rays are only cast to lights that moved since the gbuffer
+    # was last shaded (see GBuffer.shadows_for), so changing colors,
+    # intensities or albedos only traces reflections and refractions.
+    # pixels outside the tiles of the render (see region) are black
+    if gbuffer.scene is None:
+        raise ValueError("the gbuffer is empty, render() into it first")
+    width, height = int(settings.resolution.w), int(settings.resolution.h)
+    if (width, height) != (gbuffer.width, gbuffer.height):
+        raise ValueError(
+            f"can't relight a {gbuffer.width}x{gbuffer.height} gbuffer "
+            f"at {width}x{height}"
+        )
+
+    scene = CompiledScene(
+        gbuffer.scene.objects, lights, settings, geometry=gbuffer.scene
+    )
+    gbuffer.shadows_for(scene)
+    fb = Framebuffer(width, height)
+    for tile in gbuffer.tiles:
+        scene.clear_shadow_cache()
+        fb.write_tile(tile, shade_gbuffer_tile(scene, gbuffer, tile, stats))
+    return fb
+
+
+def render_iter(
+    look_from: Vec3,
+    look_at: Vec3,
+    objects: Sequence[Object],
+    lights: Sequence[Light],
+    settings: Settings,
+    *,
+    anti_aliasing: int = 1,
+    recursion_depth: int = 5,
+    camera_up: Vec3 = Vec3(0, 1, 0),
+    threads: int = 1,
+    tile_size: int = 16,
+    vectorize: bool = False,
+    integrator: str = "recursive",
+    stats: Optional[RenderStats] = None,
+    progressive: bool = False,
+    time_budget: Optional[float] = None,
+    checkpoint: Optional[str] = None,
+    region: Optional[Tile] = None,
+    into: Optional[Framebuffer] = None,
+    gbuffer: Optional[GBuffer] = None,
+) -> Iterator[Tuple[Optional[Tile], int, Framebuffer]]:
+    # same as render, but yields while rendering, see render_scene_iter
+    start = time.monotonic()
+    scene = compile_scene(objects, lights, settings)
+    return render_scene_iter(
+        scene,
+        look_from,
+        look_at,
+        anti_aliasing=anti_aliasing,
+        recursion_depth=recursion_depth,
+        camera_up=camera_up,
+        threads=threads,
+        tile_size=tile_size,
+        vectorize=vectorize,
+        integrator=integrator,
+        stats=stats,
+        progressive=progressive,
+        time_budget=remaining_budget(time_budget, start),
+        checkpoint=checkpoint,
+        region=region,
+        into=into,
+        gbuffer=gbuffer,
+    )
+
+
+def remaining_budget(time_budget: Optional[float], start: float) -> Optional[float]:
+    # what is left of a time budget after the setup that began at start
+    if time_budget is None:
+        return None
+    return time_budget - (time.monotonic() - start)
+
+
+def render_scene_iter(
+    scene: CompiledScene,
+    look_from: Vec3,
+    look_at: Vec3,
+    *,
+    anti_aliasing: int = 1,
+    recursion_depth: int = 5,
+    camera_up: Vec3 = Vec3(0, 1, 0),
+    threads: int = 1,
+    tile_size: int = 16,
+    vectorize: bool = False,
+    integrator: str = "recursive",
+    stats: Optional[RenderStats] = None,
+    progressive: bool = False,
+    time_budget: Optional[float] = None,
+    checkpoint: Optional[str] = None,
+    region: Optional[Tile] = None,
+    into: Optional[Framebuffer] = None,
+    gbuffer: Optional[GBuffer] = None,
+) -> Iterator[Tuple[Optional[Tile], int, Framebuffer]]:
+    # renders like render_scene, yielding (tile, step, framebuffer)
+    # every time a tile is done. the first update has no tile and
+    # hands out the framebuffer before anything is rendered, the
+    # same framebuffer is filled in and yielded every time after.
+    # with threads, tiles are yielded in the order they finish
+
+    # the tile's pixels are final when step is 1. with progressive,
+    # the image is rendered in passes: the first one traces every
+    # PREVIEW_STEP-th pixel of every PREVIEW_STEP-th row and fills
+    # the block of pixels below and to the right of it with its
+    # color, every later pass halves the step and traces the pixels
+    # in between. every pixel is still traced exactly once, so a
+    # complete low resolution preview costs 1 / PREVIEW_STEP**2 of
+    # the render. pixels of progressive renders always get every
+    # anti aliasing sample, even with Settings.adaptive_aa
+
+    # time_budget (seconds) renders progressively with one sample per
+    # pixel, then adds one more sample to every pixel per pass, up to
+    # anti_aliasing**2 samples in the order of RayGenerator.order. it
+    # stops when the time is up and leaves the mean of the samples so
+    # far in every pixel. the clock is checked before every row of a
+    # tile, so one row of samples is the most a render can overrun by,
+    # however expensive the scene is. every update after the preview
+    # passes (step 1) adds a sample to the tile's pixels
+
+    # checkpoint is the path of a file that the pixels are memory
+    # mapped from, next to "<checkpoint>.tiles" which records what
+    # tiles are done. running the same render with the same checkpoint
+    # again only renders the tiles that are missing, e.g. after a crash.
+    # a checkpoint of a different scene, camera or render settings is
+    # a ValueError. the returned framebuffer stays mapped to the file
+
+    # with region and into, only the pixels in the region are traced
+    # and written to into, which is then the framebuffer that is yielded
+
+    # gbuffer is emptied and filled with the hits of the render, which
+    # then can't be progressive, time budgeted, resumed or in parallel
+    # building the frame (and its BVHs) counts towards the time budget
+    deadline = None if time_budget is None else time.monotonic() + time_budget
+    frame = Frame(
+        look_from,
+        look_at,
+        scene,
+        anti_aliasing,
+        recursion_depth,
+        camera_up,
+        vectorize,
+        integrator,
+    )
+    settings = scene.settings
+    width, height = int(settings.resolution.w), int(settings.resolution.h)
+    if checkpoint is not None and (progressive or deadline is not None):
+        raise ValueError("progressive and time budgeted renders can't be resumed")
+    if checkpoint is not None and into is not None:
+        raise ValueError("checkpoints are rendered into their own file, not into")
+    if region is not None:
+        x0, y0, x1, y1 = region
+        if not (0 <= x0 < x1 <= width and 0 <= y0 < y1 <= height):
+            raise ValueError(
+                f"region {region} is not inside the {width}x{height} image"
             )
-        image[i][j] /= AA**2
+    if gbuffer is not None and (
+        progressive or deadline is not None or checkpoint is not None
+    ):
+        raise ValueError(
+            "progressive, time budgeted and resumed renders can't fill a gbuffer"
+        )
+    if gbuffer is not None and threads != 1:
+        raise ValueError("gbuffers are filled by a single process, use threads=1")
+    if into is not None and (into.width, into.height) != (width, height):
+        raise ValueError(
+            f"can't render a {width}x{height} image into a "
+            f"{into.width}x{into.height} framebuffer"
+        )
+
+    # (tiles, step, sample) of every pass, see Frame.render_item. the
+    # tiles of coarse passes are bigger so that every tile has about as
+    # many pixels to trace
+    passes: List[Tuple[List[Tile], int, int]] = []
+    if progressive or deadline is not None:
+        step = PREVIEW_STEP
+        while step >= 1:
+            tiles = make_tiles(width, height, tile_size * step, region)
+            passes.append((tiles, step, 0))
+            step //= 2
+    else:
+        passes.append((make_tiles(width, height, tile_size, region), 0, 0))
+    if deadline is not None:
+        for sample in range(1, anti_aliasing**2):
+            passes.append((make_tiles(width, height, tile_size, region), 1, sample))
+
+    done: Optional[Checkpoint] = None
+    tile_index: Dict[Tile, int] = {}
+    if checkpoint is not None:
+        # every pixel of a resumed render has to come out the same
+        digest = render_digest(
+            scene.objects,
+            scene.lights,
+            settings,
+            frame.camera.arr,
+            anti_aliasing,
+            recursion_depth,
+            integrator,
+            frame.vectorize,
+            tile_size,
+            region,
+        )
+        tiles = passes[0][0]
+        done = Checkpoint(checkpoint + ".tiles", digest, len(tiles))
+        tile_index = {tile: k for k, tile in enumerate(tiles)}
+        passes = [
+            ([tile for tile in tiles if not done.is_done(tile_index[tile])], 0, 0)
+        ]
+
+    if threads <= 0:
+        threads = os.cpu_count() or 1
+    threads = min(threads, max(len(tiles) for tiles, _, _ in passes))
+
+    if threads <= 1:
+        try:
+            if checkpoint is not None:
+                fb = Framebuffer.open(checkpoint, width, height)
+            elif into is not None:
+                fb = into
+            else:
+                fb = Framebuffer(width, height)
+            if gbuffer is not None:
+                gbuffer.reset(scene, look_from, anti_aliasing, recursion_depth)
+            yield None, 1, fb
+            for tiles, step, sample in passes:
+                for tile in tiles:
+                    if not frame.render_item(
+                        fb, tile, step, sample, deadline, stats, gbuffer
+                    ):
+                        return
+                    if done is not None:
+                        fb.flush(tile)
+                        done.mark_done(tile_index[tile])
+                    yield tile, max(step, 1), fb
+        finally:
+            if done is not None:
+                done.close()
+        return
 
-    return image
+    if checkpoint is not None:
+        fb_path = checkpoint
+    else:
+        fd, fb_path = tempfile.mkstemp(prefix="raytracer-", suffix=".fb")
+        os.close(fd)
+    try:
+        fb = Framebuffer.open(fb_path, width, height)
+        out = fb
+        if into is not None:
+            # workers start from the pixels of into, and every finished
+            # tile is copied back to it
+            out = into
+            for tile in passes[-1][0]:
+                fb.write_tile(tile, into.read_tile(tile))
+        yield None, 1, out
+        # tiles are handed out one at a time so that workers which finish
+        # cheap tiles early pick up the remaining expensive ones
+        with multiprocessing.Pool(
+            threads,
+            initializer=_init_worker,
+            initargs=(frame, fb_path, width, height, stats is not None),
+        ) as pool:
+            for tiles, step, sample in passes:
+                # every pass finishes before the next one starts, later
+                # passes build on the pixels of earlier ones
+                items = [(tile, step, sample, deadline) for tile in tiles]
+                for tile, tile_stats, traced in pool.imap_unordered(
+                    _render_tile_worker, items
+                ):
+                    if stats is not None and tile_stats is not None:
+                        stats.merge(tile_stats)
+                    if done is not None:
+                        # the worker's pixels are in the shared mapping
+                        fb.flush(tile)
+                        done.mark_done(tile_index[tile])
+                    if into is not None:
+                        into.write_tile(tile, fb.read_tile(tile))
+                    if traced:
+                        yield tile, max(step, 1), out
+                if deadline is not None and time.monotonic() >= deadline:
+                    break
+        if checkpoint is None:
+            # the pixels were written through the shared file mapping,
+            # the parent's mapping stays valid once the file is removed
+            fb.path = None
+            if sys.platform == "win32":
+                fb.close()
+    finally:
+        if done is not None:
+            done.close()
+        if checkpoint is None:
+            os.remove(fb_path)
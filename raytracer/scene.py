@@ -0,0 +1,272 @@
+import math
+import random
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from raytracer.bvh import BVH
+from raytracer.lights import DirectionalLight, Light, PointLight
+from raytracer.linalg import Vec3
+from raytracer.materials import Diffuse, Material, Reflect, ReflectRefract
+from raytracer.objects import Instance, Object
+from raytracer.options import Settings
+
+# material kinds, anything else is rendered black
+OTHER_MATERIAL = 0
+DIFFUSE = 1
+REFLECT = 2
+REFLECT_REFRACT = 3
+
+# light kinds, other lights are asked for their direction_at()
+OTHER_LIGHT = 0
+DIRECTIONAL_LIGHT = 1
+POINT_LIGHT = 2
+
+
+def material_kind(material: Material) -> int:
+    # ReflectRefract is a subclass of Reflect, so it goes first
+    if isinstance(material, Diffuse):
+        return DIFFUSE
+    if isinstance(material, ReflectRefract):
+        return REFLECT_REFRACT
+    if isinstance(material, Reflect):
+        return REFLECT
+    return OTHER_MATERIAL
+
+
+def light_kind(light: Light) -> int:
+    if isinstance(light, DirectionalLight):
+        return DIRECTIONAL_LIGHT
+    if isinstance(light, PointLight):
+        return POINT_LIGHT
+    return OTHER_LIGHT
+
+
+class CompiledScene:
+    # everything render() needs to know about the objects and lights,
+    # flattened once so that tracing does no type checks or repeated
+    # setup. it can be rendered any number of times, e.g. from
+    # different cameras, and only two caches change after compiling:
+    # shadow_cache, a per process hint that each tile starts over,
+    # and the composite BVHs, built on first use and shared with every
+    # scene compiled with this one as its geometry (which has its own
+    # shadow_cache). the objects and lights themselves must not be
+    # changed after compiling
+
+    __slots__ = (
+        "objects",
+        "lights",
+        "settings",
+        "bvh",
+        "kinds",
+        "materials",
+        "camera_bvh",
+        "secondary_bvh",
+        "casters",
+        "shadow_bvh",
+        "shadow_cache",
+        "radiance",
+        "light_kinds",
+        "light_vectors",
+        "every_light",
+        "light_powers",
+        "composite_ind",
+        "_composite_bvhs",
+    )
+
+    def __init__(
+        self,
+        objects: Sequence[Object],
+        lights: Sequence[Light],
+        settings: Settings,
+        geometry: Optional["CompiledScene"] = None,
+    ) -> None:
+        # geometry is a scene compiled earlier from the same objects,
+        # whose shapes and visibility flags haven't changed since. its
+        # BVHs are reused, so only the lights and materials (which may
+        # have changed) are compiled again, see relight()
+        self.objects = tuple(objects)
+        self.lights = tuple(lights)
+        self.settings = settings
+        # the BVHs of instanced meshes, once per mesh
+        for obj in self.objects:
+            if isinstance(obj, Instance):
+                obj.mesh.bvh()
+
+        # one tag per object instead of isinstance chains while shading
+        self.materials: Tuple[Material, ...] = tuple(
+            obj.material for obj in self.objects
+        )
+        self.kinds = array("b", [material_kind(m) for m in self.materials])
+
+        # objects that are hidden from a kind of ray (see Object) are
+        # left out of the BVH that traces those rays
+        if geometry is None:
+            self.bvh = BVH(self.objects)
+            self.camera_bvh = self.subset_bvh(
+                [obj.visible_to_camera for obj in self.objects]
+            )
+            self.secondary_bvh = self.subset_bvh(
+                [obj.visible_in_reflections for obj in self.objects]
+            )
+        else:
+            self.bvh = geometry.bvh
+            self.camera_bvh = geometry.camera_bvh
+            self.secondary_bvh = geometry.secondary_bvh
+
+        # only diffuse objects block shadow rays, assuming that all of them
+        # are opaque. shadow rays are traced through a BVH of just those
+        is_caster = [
+            kind == DIFFUSE and obj.casts_shadows
+            for kind, obj in zip(self.kinds, self.objects)
+        ]
+        self.casters = tuple(i for i, caster in enumerate(is_caster) if caster)
+        if geometry is None or geometry.casters != self.casters:
+            self.shadow_bvh = self.subset_bvh(is_caster)
+        else:
+            self.shadow_bvh = geometry.shadow_bvh
+        # the shadow_bvh ref that blocked the last shadow ray towards each
+        # light (-1 if it wasn't blocked), the next one tests it first as
+        # nearby points are mostly shadowed by the same primitive. only
+        # a hint, so it doesn't matter that it changes while rendering
+        # or that every worker process has its own
+        self.shadow_cache = array("i", [-1] * len(self.lights))
+
+        # albedo / pi * intensity * color of every diffuse material and
+        # light, objects that share a material share its tuple
+        self.light_kinds = array("b", [light_kind(light) for light in self.lights])
+        light_vectors: List[Optional[Vec3]] = []
+        for light in self.lights:
+            if isinstance(light, DirectionalLight):
+                light_vectors.append(light.direction)
+            elif isinstance(light, PointLight):
+                light_vectors.append(light.position)
+            else:
+                light_vectors.append(None)
+        self.light_vectors = tuple(light_vectors)
+        by_material: Dict[int, Tuple[Vec3, ...]] = {}
+        radiance: List[Tuple[Vec3, ...]] = []
+        for material in self.materials:
+            key = id(material)
+            if key not in by_material:
+                if isinstance(material, Diffuse):
+                    by_material[key] = tuple(
+                        material.albedo / math.pi * light.intensity * light.color
+                        for light in self.lights
+                    )
+                else:
+                    by_material[key] = ()
+            radiance.append(by_material[key])
+        self.radiance = tuple(radiance)
+
+        # lights are sampled in proportion to their power (intensity
+        # times the sum of the color's channels) among the ones in front
+        # of the hit, see Settings.light_samples and direct_light()
+        self.every_light = tuple((k, 1.0) for k in range(len(self.lights)))
+        self.light_powers = array(
+            "d",
+            [
+                light.intensity * (light.color.x + light.color.y + light.color.z)
+                for light in self.lights
+            ],
+        )
+
+        self.composite_ind = tuple(
+            i
+            for i, obj in enumerate(self.objects)
+            if obj.primitive_count() or isinstance(obj, Instance)
+        )
+        self._composite_bvhs: List[Optional[BVH]] = (
+            [None, None] if geometry is None else geometry._composite_bvhs
+        )
+
+    def sample_lights(
+        self, count: int, weights: Sequence[float]
+    ) -> List[Tuple[int, float]]:
+        # count lights picked at random (with replacement) in proportion
+        # to weights (one per light), each with the weight
+        # 1 / (count * probability) that keeps their sum unbiased.
+        # lights with weight 0 are never picked
+        cdf = list(accumulate(weights))
+        if not cdf or cdf[-1] <= 0:
+            return []
+        total = cdf[-1]
+        ret: List[Tuple[int, float]] = []
+        for _ in range(count):
+            k = bisect_right(cdf, random.random() * total)
+            if k == len(cdf):
+                # random() * total rounded up to total
+                k = bisect_left(cdf, total)
+            ret.append((k, total / (count * weights[k])))
+        return ret
+
+    def clear_shadow_cache(self) -> None:
+        cache = self.shadow_cache
+        for k in range(len(cache)):
+            cache[k] = -1
+
+    def subset_bvh(self, include: List[bool]) -> BVH:
+        if all(include):
+            return self.bvh
+        return BVH(self.objects, include=include)
+
+    def composite_bvh(self, camera: bool) -> Optional[BVH]:
+        # meshes and instances can't be batch tested (their hits need
+        # a face index), the vectorized paths trace camera or secondary
+        # rays against them through a BVH of their own, built on first use
+        if not self.composite_ind:
+            return None
+        k = 1 if camera else 0
+        ret = self._composite_bvhs[k]
+        if ret is None:
+            composite = set(self.composite_ind)
+            ret = self._composite_bvhs[k] = BVH(
+                self.objects,
+                include=[
+                    i in composite
+                    and (
+                        obj.visible_to_camera if camera else obj.visible_in_reflections
+                    )
+                    for i, obj in enumerate(self.objects)
+                ],
+            )
+        return ret
+
+    def __repr__(self) -> str:
+        return (
+            f"CompiledScene(objects={len(self.objects)}, lights={len(self.lights)}, "
+            f"casters={len(self.casters)})"
+        )
+
+
+# identity and visibility flags of every object of a scene
+GeometryKey = Tuple[Tuple[int, bool, bool], ...]
+
+# the key and the scene that compile_scene compiled last
+_last_geometry: List[Tuple[GeometryKey, CompiledScene]] = []
+
+
+def geometry_key(objects: Sequence[Object]) -> GeometryKey:
+    # objects can't be changed after compiling (they precompute their
+    # intersection constants), but their flags can. the last scene
+    # keeps its objects alive, so their ids can't be reused
+    return tuple(
+        (id(obj), obj.visible_to_camera, obj.visible_in_reflections) for obj in objects
+    )
+
+
+def compile_scene(
+    objects: Sequence[Object], lights: Sequence[Light], settings: Settings
+) -> CompiledScene:
+    # render() and render_iter() compile the scene on every call, so
+    # the BVHs of the last scene are reused if it had the same objects
+    # (see geometry_key), e.g. when only the camera, lights or materials
+    # changed. objects that moved must be replaced
+    key = geometry_key(objects)
+    geometry = None
+    if _last_geometry and _last_geometry[0][0] == key:
+        geometry = _last_geometry[0][1]
+    scene = CompiledScene(objects, lights, settings, geometry=geometry)
+    _last_geometry[:] = [(key, scene)]
+    return scene
@@ -0,0 +1,196 @@
+from array import array
+from typing import Any, Dict, List, Tuple
+
+from raytracer.framebuffer import Framebuffer, Tile
+from raytracer.linalg import Vec3
+
+# colors of the cost heatmap, from cheapest to most expensive
+HEATMAP_COLORS = [
+    Vec3(0, 0, 0),
+    Vec3(0.5, 0, 0.6),
+    Vec3(0.9, 0.2, 0.2),
+    Vec3(1, 0.7, 0),
+    Vec3(1, 1, 1),
+]
+
+
+class RenderStats:
+    # counters and timings collected by render(..., stats=RenderStats()),
+    # rendering without a stats object skips all of the bookkeeping
+
+    __slots__ = (
+        "primary_rays",
+        "reflection_rays",
+        "refraction_rays",
+        "shadow_rays",
+        "terminated_rays",
+        "hits",
+        "misses",
+        "shadow_hits",
+        "intersection_tests",
+        "intersection_hits",
+        "tiles",
+        "samples",
+    )
+
+    def __init__(self) -> None:
+        self.primary_rays = 0
+        self.reflection_rays = 0
+        self.refraction_rays = 0
+        self.shadow_rays = 0
+        # secondary rays not traced because of Settings.min_weight
+        self.terminated_rays = 0
+        # primary and secondary rays that hit / missed everything
+        self.hits = 0
+        self.misses = 0
+        # shadow rays that were blocked
+        self.shadow_hits = 0
+        # ray-primitive tests and positive tests by primitive type,
+        # primitives of meshes are counted under the mesh's type
+        self.intersection_tests: Dict[str, int] = {}
+        self.intersection_hits: Dict[str, int] = {}
+        # (tile, seconds, seconds per pixel in row-major order)
+        self.tiles: List[Tuple[Tile, float, "array[float]"]] = []
+        # (tile, camera rays added to each pixel in row-major order)
+        # of time budgeted renders, see sample_counts
+        self.samples: List[Tuple[Tile, "array[int]"]] = []
+
+    @property
+    def secondary_rays(self) -> int:
+        return self.reflection_rays + self.refraction_rays
+
+    @property
+    def total_rays(self) -> int:
+        return self.primary_rays + self.secondary_rays + self.shadow_rays
+
+    def count_test(self, obj: object, hit: bool) -> None:
+        name = type(obj).__name__
+        tests = self.intersection_tests
+        tests[name] = tests.get(name, 0) + 1
+        if hit:
+            hits = self.intersection_hits
+            hits[name] = hits.get(name, 0) + 1
+
+    def count_tests(self, obj: object, n: int, hits: int) -> None:
+        # n tests at once, e.g. from Object.intersect_many
+        name = type(obj).__name__
+        self.intersection_tests[name] = self.intersection_tests.get(name, 0) + n
+        self.intersection_hits[name] = self.intersection_hits.get(name, 0) + hits
+
+    def merge(self, other: "RenderStats") -> None:
+        # adds the counts of other, e.g. of a tile rendered by a worker
+        self.primary_rays += other.primary_rays
+        self.reflection_rays += other.reflection_rays
+        self.refraction_rays += other.refraction_rays
+        self.shadow_rays += other.shadow_rays
+        self.terminated_rays += other.terminated_rays
+        self.hits += other.hits
+        self.misses += other.misses
+        self.shadow_hits += other.shadow_hits
+        for name, n in other.intersection_tests.items():
+            self.intersection_tests[name] = self.intersection_tests.get(name, 0) + n
+        for name, n in other.intersection_hits.items():
+            self.intersection_hits[name] = self.intersection_hits.get(name, 0) + n
+        self.tiles.extend(other.tiles)
+        self.samples.extend(other.samples)
+
+    def render_time(self) -> float:
+        # summed over tiles, so this is cpu time when rendering in parallel
+        return sum(seconds for _, seconds, _ in self.tiles)
+
+    def row_times(self) -> List[float]:
+        # seconds spent on each image row
+        height = max((tile[3] for tile, _, _ in self.tiles), default=0)
+        ret = [0.0] * height
+        for (x0, y0, x1, y1), _, pixels in self.tiles:
+            w = x1 - x0
+            for i in range(y0, y1):
+                ret[i] += sum(pixels[(i - y0) * w : (i - y0 + 1) * w])
+        return ret
+
+    def pixel_times(self) -> Framebuffer:
+        # seconds per pixel in every channel, summed over all tiles
+        # that cover it (the passes of a progressive render overlap)
+        width = max((tile[2] for tile, _, _ in self.tiles), default=0)
+        height = max((tile[3] for tile, _, _ in self.tiles), default=0)
+        fb = Framebuffer(width, height)
+        for tile, _, pixels in self.tiles:
+            times = fb.read_tile(tile)
+            for k, t in enumerate(pixels):
+                for c in range(3 * k, 3 * k + 3):
+                    times[c] += t
+            fb.write_tile(tile, times)
+        return fb
+
+    def sample_counts(self) -> Framebuffer:
+        # camera rays traced for each pixel of a time budgeted render
+        # in every channel, 0 for the pixels of preview blocks that
+        # were never traced themselves
+        width = max((tile[2] for tile, _ in self.samples), default=0)
+        height = max((tile[3] for tile, _ in self.samples), default=0)
+        fb = Framebuffer(width, height)
+        for tile, counts in self.samples:
+            values = fb.read_tile(tile)
+            for k, n in enumerate(counts):
+                for c in range(3 * k, 3 * k + 3):
+                    values[c] += n
+            fb.write_tile(tile, values)
+        return fb
+
+    def heatmap(self) -> Framebuffer:
+        # pixels colored by how long they took to render relative to
+        # the slowest one, can be saved with visualize.save_png
+        fb = self.pixel_times()
+        data = fb.data
+        peak = max(data, default=0) or 1
+        steps = len(HEATMAP_COLORS) - 1
+        for k in range(0, len(data), 3):
+            x = data[k] / peak * steps
+            n = min(int(x), steps - 1)
+            color = HEATMAP_COLORS[n] * (1 - (x - n)) + HEATMAP_COLORS[n + 1] * (x - n)
+            data[k] = color.x
+            data[k + 1] = color.y
+            data[k + 2] = color.z
+        return fb
+
+    def as_dict(self) -> Dict[str, Any]:
+        # the counters, without the timings
+        return {
+            "primary_rays": self.primary_rays,
+            "secondary_rays": self.secondary_rays,
+            "reflection_rays": self.reflection_rays,
+            "refraction_rays": self.refraction_rays,
+            "shadow_rays": self.shadow_rays,
+            "terminated_rays": self.terminated_rays,
+            "hits": self.hits,
+            "misses": self.misses,
+            "shadow_hits": self.shadow_hits,
+            "intersection_tests": dict(self.intersection_tests),
+            "intersection_hits": dict(self.intersection_hits),
+        }
+
+    def summary(self) -> str:
+        lines = [
+            f"rays: {self.total_rays} ({self.primary_rays} primary, "
+            f"{self.reflection_rays} reflection, {self.refraction_rays} refraction, "
+            f"{self.shadow_rays} shadow, {self.terminated_rays} terminated)",
+            f"hits: {self.hits}, misses: {self.misses}, "
+            f"blocked shadow rays: {self.shadow_hits}",
+        ]
+        for name, n in sorted(self.intersection_tests.items()):
+            hits = self.intersection_hits.get(name, 0)
+            lines.append(f"{name} intersection tests: {n} ({hits} hits)")
+        if self.tiles:
+            slowest = max(self.tiles, key=lambda tile: tile[1])
+            lines.append(
+                f"render time: {self.render_time():.3f}s over {len(self.tiles)} "
+                f"tiles, slowest {slowest[0]} {slowest[1]:.3f}s"
+            )
+        return "\n".join(lines)
+
+    def __repr__(self) -> str:
+        return (
+            f"RenderStats(primary_rays={self.primary_rays}, "
+            f"secondary_rays={self.secondary_rays}, "
+            f"shadow_rays={self.shadow_rays})"
+        )
@@ -1,20 +1,53 @@
 import struct
 import zlib
-from typing import List
+from typing import BinaryIO, Iterator, List, Sequence, Tuple, Union
 
+from raytracer.framebuffer import Framebuffer
 from raytracer.linalg import Vec3
 
+Image = Union[Framebuffer, List[List[Vec3]]]
 
-def save_ppm(img: List[List[Vec3]], filename: str) -> None:
-    f = open(filename, "w")
-    f.write(f"P3 {len(img[0])} {len(img)} 255\n")
-    # f.write("# Generated by raytracer\n")
-    for i in range(len(img)):
-        for j in range(len(img[0])):
-            f.write(
-                f"{int(img[i][j].x * 255)} {int(img[i][j].y * 255)} {int(img[i][j].z * 255)}\n"
-            )
-    f.close()
+# compressed png data is written out in IDAT chunks of about this size
+IDAT_CHUNK_SIZE = 1 << 16
+
+_BYTE_STR = [str(i) for i in range(256)]
+
+
+def row_to_bytes(row: Sequence[Vec3]) -> bytes:
+    # 8 bit rgb, colors outside of [0, 1] are clamped
+    return bytes(
+        [
+            255 if v >= 1 else 0 if v <= 0 else round(v * 255)
+            for c in row
+            for v in (c.x, c.y, c.z)
+        ]
+    )
+
+
+def image_rows(img: Image) -> Tuple[int, int, Iterator[bytes]]:
+    # (width, height, 8 bit rgb rows from top to bottom)
+    if isinstance(img, Framebuffer):
+        fb = img
+        return fb.width, fb.height, (fb.row_bytes(i) for i in range(fb.height))
+    return len(img[0]), len(img), (row_to_bytes(row) for row in img)
+
+
+def save_ppm(img: Image, filename: str, binary: bool = False) -> None:
+    # binary=True writes a P6 file, which is much smaller
+    # and faster to write than the plain text P3 format
+    width, height, rows = image_rows(img)
+    with open(filename, "wb") as f:
+        if binary:
+            f.write(f"P6 {width} {height} 255\n".encode())
+            for row in rows:
+                f.write(row)
+        else:
+            f.write(f"P3 {width} {height} 255\n".encode())
+            # f.write("# Generated by raytracer\n")
+            for row in rows:
+                values = iter([_BYTE_STR[b] for b in row])
+                lines = map(" ".join, zip(values, values, values))
+                f.write(("\n".join(lines) + "\n").encode())
 
 
 def png_pack(png_tag: bytes, data: bytes) -> bytes:
@@ -26,31 +59,35 @@ def png_pack(png_tag: bytes, data: bytes) -> bytes:
     )
 
 
-def write_png(buf: bytes, width: int, height: int) -> bytes:
-    # https://stackoverflow.com/a/19174800/14277568
-
-    width_byte_4 = width * 4
-    raw_data = b"".join(
-        b"\x00" + buf[span : span + width_byte_4]
-        for span in range((height - 1) * width_byte_4, -1, -width_byte_4)
-    )
+def write_png(f: BinaryIO, img: Image, compression: int = 9) -> None:
+    # streams the image one row at a time through zlib, so only
+    # one row and one IDAT chunk are held in memory at a time
+    width, height, rows = image_rows(img)
+    f.write(b"\x89PNG\r\n\x1a\n")
+    # 8 bit depth, color type 2 (rgb)
+    f.write(png_pack(b"IHDR", struct.pack("!2I5B", width, height, 8, 2, 0, 0, 0)))
 
-    return b"".join(
-        [
-            b"\x89PNG\r\n\x1a\n",
-            png_pack(b"IHDR", struct.pack("!2I5B", width, height, 8, 6, 0, 0, 0)),
-            png_pack(b"IDAT", zlib.compress(raw_data, 9)),
-            png_pack(b"IEND", b""),
-        ]
-    )
+    compressor = zlib.compressobj(compression)
+    pending: List[bytes] = []
+    pending_size = 0
+    for row in rows:
+        # every row starts with its filter type, 0 is none
+        data = compressor.compress(b"\x00" + row)
+        if data:
+            pending.append(data)
+            pending_size += len(data)
+        if pending_size >= IDAT_CHUNK_SIZE:
+            f.write(png_pack(b"IDAT", b"".join(pending)))
+            pending = []
+            pending_size = 0
 
+    pending.append(compressor.flush())
+    f.write(png_pack(b"IDAT", b"".join(pending)))
+    f.write(png_pack(b"IEND", b""))
 
-def save_png(img: List[List[Vec3]], filename: str) -> None:
-    flat = []
-    for row in reversed(img):
-        flat.extend([c.to_abgr() for c in row])
 
-    buf = b"".join([struct.pack("<I", i32) for i32 in flat])
-    data = write_png(buf, len(img[0]), len(img))
+def save_png(img: Image, filename: str, compression: int = 9) -> None:
+    # compression is the zlib level, 0 (none) to 9 (smallest file),
+    # lower levels are a lot faster for big images
     with open(filename, "wb") as f:
-        f.write(data)
+        write_png(f, img, compression)
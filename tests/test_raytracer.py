@@ -5,3 +5,848 @@ from raytracer import __version__
 
 def test_version():
     assert __version__ == "0.1.0"
+
+
+def test_fused_vec3_ops_match_operators():
+    from raytracer.linalg import Vec3, normalized
+
+    a, b = Vec3(0.1, -2.5, 3.3), Vec3(1.7, 0.2, -0.9)
+    assert a.scale(0.3) == a * 0.3
+    assert a.add_scaled(b, 0.7) == a + b * 0.7
+    assert a.direction_to(b) == (b - a).normalize()
+    assert normalized(a.x, a.y, a.z) == a.normalize()
+
+    c = Vec3(a.x, a.y, a.z)
+    assert c.iadd_scaled(b, 2).iadd(a).imul(0.5) is c
+    assert c == (a + b * 2 + a) * 0.5
+    assert a == Vec3(0.1, -2.5, 3.3)
+
+
+def test_moller_trumbore_matches_plane_test():
+    import random
+
+    from raytracer.linalg import Vec3
+    from raytracer.materials import Diffuse
+    from raytracer.objects import Triangle
+
+    def plane_test(tri: Triangle, ray_o: Vec3, ray_d: Vec3):
+        # the intersection Triangle used before moller-trumbore
+        N = (tri.b - tri.a).cross(tri.c - tri.a).normalize()
+        N_ray_dir = ray_d.dot(N)
+        if abs(N_ray_dir) < 1e-6:
+            return False, 0
+        t = -(N.dot(ray_o) - N.dot(tri.a)) / N_ray_dir
+        if t < 0:
+            return False, 0
+        P = ray_o + ray_d * t
+        for v0, v1 in ((tri.a, tri.b), (tri.b, tri.c), (tri.c, tri.a)):
+            if N.dot((v1 - v0).cross(P - v0)) < 0:
+                return False, 0
+        return True, t
+
+    random.seed(1)
+    a, b, c = Vec3(-1, -1, -3), Vec3(1, -1, -3), Vec3(0, 1, -2)
+    tri = Triangle(a, b, c, Diffuse(Vec3(1, 1, 1)))
+    hits = 0
+    for _ in range(300):
+        ray_o = Vec3(*(random.uniform(-2, 2) for _ in range(3)))
+        target = Vec3(*(random.uniform(-1.5, 1.5) for _ in range(2)), -2.5)
+        ray_d = (target - ray_o).normalize()
+        expected = plane_test(tri, ray_o, ray_d)
+        intersect, t = tri.intersect(ray_o, ray_d)
+        assert intersect == expected[0]
+        if not intersect:
+            continue
+        hits += 1
+        assert abs(t - expected[1]) < 1e-9
+
+        # u and v weigh b and c, so they give back the hit point
+        _, t_b, u, v = tri.intersect_barycentric(ray_o, ray_d)
+        assert t_b == t and u >= 0 and v >= 0 and u + v <= 1
+        p = a * (1 - u - v) + b * u + c * v
+        assert (p - (ray_o + ray_d * t)).norm() < 1e-9
+
+        # the normal faces the ray, whichever side it hits
+        assert tri.normal(ray_d, p).dot(ray_d) < 0
+        assert tri.normal(-ray_d, p) == -tri.normal(ray_d, p)
+    assert 50 < hits < 250
+
+    # parallel to the triangle, and pointing away from it
+    assert not tri.intersect(Vec3(0, 0, 0), Vec3(1, 0, 0))[0]
+    assert not tri.intersect(Vec3(0, -0.5, 0), Vec3(0, 0, 1))[0]
+    assert tri.intersect(Vec3(0, -0.5, 0), Vec3(0, 0, -1)) == (True, 2.75)
+
+
+def test_bvh_matches_linear_scan():
+    import random
+
+    from raytracer.bvh import BVH
+    from raytracer.linalg import Vec3
+    from raytracer.materials import Diffuse
+    from raytracer.objects import Mesh, Sphere, Triangle
+
+    random.seed(0)
+    material = Diffuse(Vec3(1, 1, 1))
+
+    def rand_vec(r: float) -> Vec3:
+        return Vec3(*(random.uniform(-r, r) for _ in range(3)))
+
+    objects = []
+    for _ in range(200):
+        p = rand_vec(10)
+        objects.append(Triangle(p, p + rand_vec(1), p + rand_vec(1), material))
+        objects.append(Sphere(rand_vec(10), random.uniform(0.1, 1), material))
+    mesh_faces = []
+    for _ in range(100):
+        p = rand_vec(10)
+        mesh_faces.append(Triangle(p, p + rand_vec(1), p + rand_vec(1), material))
+    objects.append(Mesh.from_triangles(mesh_faces))
+    bvh = BVH(objects)
+
+    for _ in range(500):
+        ray_o = rand_vec(15)
+        ray_d = rand_vec(1).normalize()
+
+        expected = -1
+        closest_t = float("inf")
+        for i, obj in enumerate(objects):
+            intersect, t = obj.intersect(ray_o, ray_d)
+            if intersect and t < closest_t:
+                expected, closest_t = i, t
+
+        assert bvh.closest_hit(ray_o, ray_d)[0] == expected
+        assert bvh.any_hit(ray_o, ray_d) == (expected != -1)
+
+
+def _small_scene():
+    from raytracer.lights import DirectionalLight, PointLight
+    from raytracer.linalg import Vec3
+    from raytracer.materials import Diffuse, Reflect, ReflectRefract
+    from raytracer.objects import Sphere, Triangle
+    from raytracer.options import Resolution, Settings
+
+    settings = Settings(Vec3(0.2, 0.3, 0.4), Resolution(w=24, h=16), 1, 70, 1e-4)
+    objects = [
+        Sphere(Vec3(0, -1000, 0), 1000, Diffuse(Vec3(0.8, 0.8, 0.8))),
+        Sphere(Vec3(-2, 1, 0), 1, ReflectRefract(1.5)),
+        Sphere(Vec3(2, 1, 0), 1, Reflect()),
+        Triangle(
+            Vec3(-3, 0, -3), Vec3(3, 0, -3), Vec3(0, 3, -3), Diffuse(Vec3(1, 0, 0))
+        ),
+    ]
+    lights = [
+        DirectionalLight(Vec3(0.5, -1, 0.5), Vec3(1, 1, 1), 1),
+        PointLight(Vec3(0, 4, 2), Vec3(0, 0, 1), 0.5),
+    ]
+    return Vec3(0, 2, 8), Vec3(0, 1, 0), objects, lights, settings
+
+
+def test_parallel_render_matches_serial():
+    from raytracer import render
+
+    serial = render(*_small_scene(), anti_aliasing=2, recursion_depth=4)
+    parallel = render(*_small_scene(), anti_aliasing=2, recursion_depth=4, threads=2)
+    assert all(
+        a == b for row_a, row_b in zip(serial, parallel) for a, b in zip(row_a, row_b)
+    )
+
+
+def test_progressive_render_iter_matches_render():
+    from raytracer import render, render_iter
+
+    look_from, look_at, objects, lights, settings = _small_scene()
+    expected = render(look_from, look_at, objects, lights, settings, anti_aliasing=2)
+    updates = list(
+        render_iter(
+            look_from,
+            look_at,
+            objects,
+            lights,
+            settings,
+            anti_aliasing=2,
+            tile_size=4,
+            progressive=True,
+        )
+    )
+    assert updates[0][0] is None
+    steps = [step for _, step, _ in updates[1:]]
+    assert steps == sorted(steps, reverse=True)
+    assert steps[0] == 8 and steps[-1] == 1
+    fb = updates[-1][2]
+    assert fb.data == expected.data
+
+
+def test_time_budget():
+    import time
+
+    from raytracer import render
+    from raytracer.stats import RenderStats
+
+    look_from, look_at, objects, lights, settings = _small_scene()
+    expected = render(look_from, look_at, objects, lights, settings, anti_aliasing=2)
+
+    # enough time for every sample
+    stats = RenderStats()
+    fb = render(
+        look_from,
+        look_at,
+        objects,
+        lights,
+        settings,
+        anti_aliasing=2,
+        time_budget=60,
+        stats=stats,
+    )
+    assert max(abs(a - b) for a, b in zip(fb.data, expected.data)) < 1e-12
+    assert set(stats.sample_counts().data) == {4}
+
+    start = time.monotonic()
+    stats = RenderStats()
+    render(
+        look_from,
+        look_at,
+        objects,
+        lights,
+        settings,
+        anti_aliasing=2,
+        time_budget=0,
+        stats=stats,
+    )
+    assert time.monotonic() - start < 1
+    assert stats.primary_rays == 0
+
+
+def test_checkpoint_resumes_missing_tiles(tmp_path):
+    import pytest
+
+    from raytracer import render, render_iter
+    from raytracer.stats import RenderStats
+
+    look_from, look_at, objects, lights, settings = _small_scene()
+    expected = render(look_from, look_at, objects, lights, settings, tile_size=8)
+    path = str(tmp_path / "image.fb")
+
+    # stop after the first 2 of 6 tiles, as if the render crashed
+    updates = render_iter(
+        look_from, look_at, objects, lights, settings, tile_size=8, checkpoint=path
+    )
+    for _ in range(3):
+        next(updates)
+    updates.close()
+
+    stats = RenderStats()
+    fb = render(
+        look_from,
+        look_at,
+        objects,
+        lights,
+        settings,
+        tile_size=8,
+        checkpoint=path,
+        stats=stats,
+    )
+    assert stats.primary_rays == 4 * 8 * 8
+    assert fb.data == expected.data
+    fb.close()
+
+    with pytest.raises(ValueError):
+        render(look_from, look_at, objects, lights, settings, checkpoint=path)
+
+
+def test_region_matches_full_render():
+    from raytracer import render
+    from raytracer.framebuffer import Framebuffer
+    from raytracer.linalg import Vec3
+    from raytracer.stats import RenderStats
+
+    look_from, look_at, objects, lights, settings = _small_scene()
+    full = render(look_from, look_at, objects, lights, settings, anti_aliasing=2)
+
+    into = Framebuffer(24, 16)
+    into.set(0, 0, Vec3(1, 2, 3))
+    stats = RenderStats()
+    region = (5, 3, 19, 10)
+    fb = render(
+        look_from,
+        look_at,
+        objects,
+        lights,
+        settings,
+        anti_aliasing=2,
+        tile_size=8,
+        region=region,
+        into=into,
+        stats=stats,
+    )
+    assert fb is into
+    assert stats.primary_rays == 14 * 7 * 4
+    assert fb.read_tile(region) == full.read_tile(region)
+    assert fb.get(0, 0) == Vec3(1, 2, 3)
+
+
+def test_render_stats():
+    from raytracer import render
+    from raytracer.stats import RenderStats
+
+    serial, parallel = RenderStats(), RenderStats()
+    render(*_small_scene(), anti_aliasing=2, recursion_depth=4, stats=serial)
+    render(
+        *_small_scene(), anti_aliasing=2, threads=2, recursion_depth=4, stats=parallel
+    )
+    assert serial.primary_rays == 24 * 16 * 4
+    assert serial.reflection_rays > serial.refraction_rays > 0
+    assert serial.shadow_rays > serial.shadow_hits > 0
+    assert serial.hits + serial.misses == serial.primary_rays + serial.secondary_rays
+    assert set(serial.intersection_tests) == {"Sphere", "Triangle"}
+    assert serial.as_dict() == parallel.as_dict()
+
+    heatmap = serial.heatmap()
+    assert (heatmap.width, heatmap.height) == (24, 16)
+    assert len(serial.row_times()) == 16
+
+
+def test_bench_smoke(tmp_path, capsys):
+    import json
+
+    from raytracer.bench import main
+
+    report = str(tmp_path / "bench.json")
+    args = ["spheres", "--count", "20", "--width", "16", "--height", "9"]
+    assert main(args + ["--repeat", "1", "--json", report]) == 0
+    assert "k rays/s" in capsys.readouterr().out
+
+    with open(report) as f:
+        data = json.load(f)
+    assert data["repeat"] == 1
+    (result,) = data["results"]
+    assert result["scene"] == "spheres"
+    assert (result["width"], result["height"], result["objects"]) == (16, 9, 21)
+    assert len(result["times"]) == 1 and result["time"] > 0
+    assert result["primary_rays"] == 16 * 9 * result["anti_aliasing"] ** 2
+    assert result["rays_per_second"] > 0 and result["peak_memory"] > 0
+    assert (
+        main(args + ["--repeat", "1", "--baseline", report, "--tolerance", "1e9"]) == 0
+    )
+
+
+def test_compiled_scene_renders_like_render():
+    from raytracer import compile_scene, render, render_scene
+    from raytracer.linalg import Vec3
+    from raytracer.objects import Sphere
+
+    look_from, look_at, objects, lights, settings = _small_scene()
+    scene = compile_scene(objects, lights, settings)
+    assert scene.casters == (0, 3)
+    for eye in (look_from, Vec3(3, 4, 6)):
+        expected = render(eye, look_at, objects, lights, settings)
+        assert render_scene(scene, eye, look_at).data == expected.data
+
+    # the BVHs are reused until an object is replaced or hidden
+    assert compile_scene(objects, lights[:1], settings).bvh is scene.bvh
+    objects[1] = Sphere(Vec3(-2, 2, 0), 1, objects[1].material)
+    moved = compile_scene(objects, lights, settings)
+    assert moved.bvh is not scene.bvh
+    objects[2].visible_to_camera = False
+    assert compile_scene(objects, lights, settings).camera_bvh is not moved.camera_bvh
+
+
+def test_min_weight_terminates_paths():
+    from raytracer import render
+    from raytracer.stats import RenderStats
+
+    full, cut = RenderStats(), RenderStats()
+    look_from, look_at, objects, lights, settings = _small_scene()
+    reference = render(*_small_scene(), recursion_depth=8, stats=full)
+    settings.min_weight = 0.1
+    image = render(
+        look_from, look_at, objects, lights, settings, recursion_depth=8, stats=cut
+    )
+    assert full.terminated_rays == 0 and cut.terminated_rays > 0
+    assert cut.secondary_rays < full.secondary_rays
+    assert max(abs(a - b) for a, b in zip(reference.data, image.data)) < 0.1
+
+    settings.russian_roulette = True
+    render(look_from, look_at, objects, lights, settings, recursion_depth=8)
+
+
+def test_adaptive_aa_matches_full_aa():
+    from raytracer import render
+    from raytracer.stats import RenderStats
+
+    look_from, look_at, objects, lights, settings = _small_scene()
+    full_stats, adaptive_stats = RenderStats(), RenderStats()
+    full = render(
+        look_from, look_at, objects, lights, settings, anti_aliasing=3, stats=full_stats
+    )
+    settings.adaptive_aa = True
+    adaptive = render(
+        look_from,
+        look_at,
+        objects,
+        lights,
+        settings,
+        anti_aliasing=3,
+        stats=adaptive_stats,
+    )
+    assert adaptive_stats.primary_rays < full_stats.primary_rays
+    assert max(abs(a - b) for a, b in zip(full.data, adaptive.data)) < 0.01
+
+    # the image does not depend on how it is split into tiles
+    tiled = render(
+        look_from, look_at, objects, lights, settings, anti_aliasing=3, tile_size=5
+    )
+    assert tiled.data == adaptive.data
+
+
+def test_wavefront_matches_recursive():
+    from raytracer import render
+    from raytracer.stats import RenderStats
+
+    for vectorize in (False, True):
+        recursive, wavefront = RenderStats(), RenderStats()
+        expected = render(
+            *_small_scene(),
+            anti_aliasing=2,
+            recursion_depth=6,
+            vectorize=vectorize,
+            stats=recursive,
+        )
+        image = render(
+            *_small_scene(),
+            anti_aliasing=2,
+            recursion_depth=6,
+            vectorize=vectorize,
+            integrator="wavefront",
+            stats=wavefront,
+        )
+        assert max(abs(a - b) for a, b in zip(expected.data, image.data)) < 1e-12
+        assert recursive.total_rays == wavefront.total_rays
+        assert recursive.hits == wavefront.hits
+
+
+def test_ray_generator_is_cached_and_matches_numpy():
+    import pytest
+
+    from raytracer.camera import ray_generator
+    from raytracer.linalg import Mat44, Vec3
+
+    rays = ray_generator(24, 16, 70, 1, 2)
+    assert ray_generator(24, 16, 70, 1, 2) is rays
+    assert ray_generator(24, 16, 60, 1, 2) is not rays
+
+    camera = Mat44.camera(Vec3(1, 2, 8), Vec3(0, 1, 0))
+    tile = (3, 2, 11, 7)
+    directions = rays.tile_directions(camera, tile)
+    assert len(directions) == 8 * 5 * 4
+    assert directions[-1] == rays.direction(camera, 6, 10, 1, 1)
+
+    pytest.importorskip("numpy")
+    batch = rays.tile_array(camera, tile)
+    expected = [
+        rays.direction(camera, i, j, a_i, a_j)
+        for i in range(2, 7)
+        for j in range(3, 11)
+        for a_i in range(2)
+        for a_j in range(2)
+    ]
+    assert batch.array.shape == (8 * 5 * 4, 3)
+    assert [batch[k] for k in range(len(batch))] == expected == directions
+
+
+def test_intersect_many_matches_intersect():
+    import random
+
+    from raytracer.linalg import Vec3
+    from raytracer.materials import Diffuse
+    from raytracer.objects import Box, Plane, Sphere, Triangle
+
+    random.seed(1)
+    material = Diffuse(Vec3(1, 1, 1))
+    origins = [[random.uniform(-3, 3) for _ in range(3)] for _ in range(300)]
+    directions = [
+        Vec3(*(random.uniform(-1, 1) for _ in range(3))).normalize() for _ in range(300)
+    ]
+    objects = [
+        Sphere(Vec3(0.5, 0, -1), 1.5, material),
+        Triangle(Vec3(-2, -2, 0), Vec3(2, -2, 0), Vec3(0, 2, 1), material),
+        Plane(Vec3(0, -1, 0), Vec3(0.2, 1, 0.1), material),
+        Box(Vec3(-1, -1, -1), Vec3(1.5, 0.5, 2), material),
+        Box(Vec3(-4, -1, -1), Vec3(-3.5, 0.5, 2), material),
+    ]
+    # axis aligned rays, parallel to some of the box's faces
+    origins.append([0, 0, 0])
+    directions.append(Vec3(1, 0, 0))
+    origins.append([0, 4, 0])
+    directions.append(Vec3(0, -1, 0))
+    for obj in objects:
+        mask, ts = obj.intersect_many(origins, [(d.x, d.y, d.z) for d in directions])
+        for o, d, hit, t in zip(origins, directions, mask, ts):
+            expected_hit, expected_t = obj.intersect(Vec3(*o), d)
+            assert hit == expected_hit
+            if hit:
+                assert abs(t - expected_t) < 1e-9
+
+
+def test_plane_and_box_render_like_triangles():
+    from raytracer import render
+    from raytracer.linalg import Vec3
+    from raytracer.materials import Diffuse
+    from raytracer.objects import Box, Mesh, Plane, Triangle
+
+    look_from, look_at, objects, lights, settings = _small_scene()
+    floor, material = objects[0].material, Diffuse(Vec3(0.2, 0.8, 0.4))
+    lo, hi = Vec3(-0.5, 0, 1), Vec3(0.5, 1.5, 2)
+    corners = [
+        Vec3(x, y, z) for x in (lo.x, hi.x) for y in (lo.y, hi.y) for z in (lo.z, hi.z)
+    ]
+    faces = []
+    for axis in range(3):
+        for side in (0, 1):
+            quad = [c for k, c in enumerate(corners) if (k >> (2 - axis)) & 1 == side]
+            faces.append(Triangle(quad[0], quad[1], quad[3], material))
+            faces.append(Triangle(quad[0], quad[3], quad[2], material))
+    big = 1000
+    triangles = [
+        Triangle(Vec3(-big, 0, -big), Vec3(big, 0, -big), Vec3(-big, 0, big), floor),
+        Triangle(Vec3(big, 0, -big), Vec3(big, 0, big), Vec3(-big, 0, big), floor),
+        Mesh.from_triangles(faces),
+    ]
+    analytic = [Plane(Vec3(0, 0, 0), Vec3(0, 1, 0), floor), Box(hi, lo, material)]
+
+    for kwargs in ({}, {"vectorize": True}):
+        a = render(
+            look_from, look_at, objects[1:] + analytic, lights, settings, **kwargs
+        )
+        b = render(
+            look_from, look_at, objects[1:] + triangles, lights, settings, **kwargs
+        )
+        assert max(abs(x - y) for x, y in zip(a.data, b.data)) < 1e-9
+
+
+def test_obj_cache_round_trip(tmp_path, monkeypatch):
+    from raytracer.linalg import Vec3
+    from raytracer.materials import Diffuse
+    from raytracer.objects import Mesh, mesh
+
+    obj_file = tmp_path / "quad.obj"
+    obj_file.write_text(
+        "# quad\n\nv 0 0 0\nv 1 0 0\nv 1 1 0\nv 0 1 0\n\nvn 0 0 1\nf 1//1 2//1 3//1 4//1\n"
+    )
+    material = Diffuse(Vec3(1, 1, 1))
+
+    parsed = Mesh.from_obj(str(obj_file), material, 2, Vec3(1, 0, 0), cache=True)
+    # the per face data is memory mapped from the cache as well
+    monkeypatch.setattr(mesh, "face_data", None)
+    cached = Mesh.from_obj(str(obj_file), material, 2, Vec3(1, 0, 0), cache=True)
+
+    assert isinstance(cached.vertices, memoryview)
+    assert isinstance(cached._normals, memoryview)
+    assert list(cached._normals) == list(parsed._normals) == [0, 0, 1] * 2
+    assert list(cached._min_dets) == list(parsed._min_dets)
+    assert list(cached.vertices) == list(parsed.vertices)
+    assert list(cached.indices) == list(parsed.indices) == [0, 1, 2, 0, 2, 3]
+    assert cached.face_vertices(1)[1] == Vec3(3, 2, 0)
+
+
+def test_parse_obj_whitespace(tmp_path):
+    import pytest
+
+    from raytracer.linalg import Vec3
+    from raytracer.materials import Diffuse
+    from raytracer.objects import Mesh
+    from raytracer.objects.objfile import parse_obj
+
+    spaced = "v 0 0 0\nv 1 0 0\nv 1 1 0\nv 0 1 0\nf 1 2 3 4\n"
+    tabbed = "v\t0 0 0\n  v 1\t0 0\n\tv 1 1 0\nv  0 1 0\n  f\t1 2 3\t4\n"
+    assert parse_obj(tabbed) == parse_obj(spaced)
+    assert list(parse_obj(tabbed)[1]) == [0, 1, 2, 0, 2, 3]
+    # six indices in two faces, but not two triangles
+    assert list(parse_obj(spaced + "f 1 2\n")[1]) == [0, 1, 2, 0, 2, 3]
+    with pytest.raises(ValueError, match="index 0"):
+        parse_obj(spaced + "f 0 1 2\n")
+
+    obj_file = tmp_path / "points.obj"
+    obj_file.write_text("vn 0 0 1\nv 0 0 0\n")
+    with pytest.raises(ValueError, match="no faces"):
+        Mesh.from_obj(str(obj_file), Diffuse(Vec3(1, 1, 1)))
+
+
+def test_zero_area_faces_are_never_hit():
+    from raytracer import render
+    from raytracer.bvh import BVH
+    from raytracer.linalg import Vec3
+    from raytracer.materials import Diffuse
+    from raytracer.objects import Mesh
+
+    # the second face repeats a vertex, the third one is a line
+    mesh = Mesh(
+        [-1, 0, -1, 1, 0, -1, 0, 0, 1, 0, 0, 0],
+        [0, 1, 2, 0, 0, 1, 0, 1, 3],
+        Diffuse(Vec3(1, 1, 1)),
+    )
+    ray_o, ray_d = Vec3(0, 1, 0), Vec3(0, -1, 0)
+    assert not mesh.intersect_primitive(1, ray_o, ray_d)[0]
+    assert not mesh.intersect_primitive(2, ray_o, Vec3(0, 0, -1))[0]
+    assert BVH([mesh]).closest_hit(ray_o, ray_d)[:2] == (0, 0)
+
+    look_from, look_at, objects, lights, settings = _small_scene()
+    render(look_from, look_at, objects + [mesh], lights, settings)
+
+
+def test_instance_renders_like_transformed_mesh():
+    import os
+    from array import array
+
+    from raytracer import render
+    from raytracer.linalg import Mat44, Vec3
+    from raytracer.materials import Diffuse
+    from raytracer.objects import Instance, Mesh
+
+    camera, look_at, objects, lights, settings = _small_scene()
+    obj_file = os.path.join(os.path.dirname(__file__), "..", "models", "cube.obj")
+    cube = Mesh.from_obj(obj_file, Diffuse(Vec3(0.9, 0.6, 0.3)))
+    red = Diffuse(Vec3(1, 0, 0))
+    transforms = [
+        Mat44.scaling(0.5, 1, 0.5)
+        * Mat44.rotation(Vec3(0.3, 1, 0.1), 40 * k)
+        * Mat44.translation(Vec3(2 * k - 1, 1, 1))
+        for k in range(2)
+    ]
+
+    def transformed(m: Mat44, material: Diffuse) -> Mesh:
+        v = cube.vertices
+        vertices = array("d")
+        for k in range(0, len(v), 3):
+            x, y, z = v[k], v[k + 1], v[k + 2]
+            vertices.extend(
+                x * m[0][c] + y * m[1][c] + z * m[2][c] + m[3][c] for c in range(3)
+            )
+        return Mesh(vertices, cube.indices, material)
+
+    instances = [Instance(cube, transforms[0]), Instance(cube, transforms[1], red)]
+    meshes = [
+        transformed(transforms[0], cube.material),
+        transformed(transforms[1], red),
+    ]
+    assert all(inst.mesh is cube for inst in instances)
+
+    a = render(
+        camera, look_at, objects + instances, lights, settings, recursion_depth=3
+    )
+    b = render(camera, look_at, objects + meshes, lights, settings, recursion_depth=3)
+    assert (
+        max(
+            abs(x - y)
+            for row_a, row_b in zip(a, b)
+            for p, q in zip(row_a, row_b)
+            for x, y in ((p.x, q.x), (p.y, q.y), (p.z, q.z))
+        )
+        < 1e-9
+    )
+
+    # an instance of a mesh without faces is left out of the BVH
+    empty = Instance(Mesh(array("d"), array("i"), red), transforms[0])
+    assert empty.bounds().lo.x == float("inf")
+    c = render(
+        camera,
+        look_at,
+        objects + instances + [empty],
+        lights,
+        settings,
+        recursion_depth=3,
+    )
+    assert c.to_lists() == a.to_lists()
+
+
+def test_visibility_flags():
+    from raytracer import render
+    from raytracer.linalg import Vec3
+    from raytracer.materials import Diffuse
+    from raytracer.objects import Sphere
+
+    look_from, look_at, objects, lights, settings = _small_scene()
+    expected = render(look_from, look_at, objects, lights, settings)
+
+    blocker = Sphere(Vec3(0, 2, 1), 0.8, Diffuse(Vec3(0, 1, 0)))
+    blocker.visible_to_camera = False
+    blocker.visible_in_reflections = False
+    for kwargs in ({}, {"integrator": "wavefront"}, {"vectorize": True}):
+        scene = objects + [blocker]
+        blocker.casts_shadows = False
+        fb = render(look_from, look_at, scene, lights, settings, **kwargs)
+        assert fb.data == expected.data
+
+        # only its shadow shows
+        blocker.casts_shadows = True
+        fb = render(look_from, look_at, scene, lights, settings, **kwargs)
+        assert all(a <= b for a, b in zip(fb.data, expected.data))
+        assert fb.data != expected.data
+
+
+def test_light_culling_and_sampling():
+    import random
+
+    from raytracer import render
+    from raytracer.lights import PointLight
+    from raytracer.linalg import Vec3
+    from raytracer.stats import RenderStats
+
+    look_from, look_at, objects, _, settings = _small_scene()
+    random.seed(2)
+    lights = [
+        PointLight(
+            Vec3(random.uniform(-6, 6), random.uniform(0.5, 5), random.uniform(-6, 6)),
+            Vec3(random.random(), random.random(), random.random()),
+            random.uniform(0, 0.02),
+        )
+        for _ in range(100)
+    ]
+    full, culled, sampled = RenderStats(), RenderStats(), RenderStats()
+    expected = render(look_from, look_at, objects, lights, settings, stats=full)
+
+    # every culled light adds at most light_threshold to a channel
+    settings.light_threshold = 1e-3
+    fb = render(look_from, look_at, objects, lights, settings, stats=culled)
+    assert culled.shadow_rays < full.shadow_rays
+    assert max(abs(a - b) for a, b in zip(fb.data, expected.data)) <= 0.1
+
+    # noisy, but right on average
+    settings.light_threshold = 0
+    settings.light_samples = 4
+    fb = render(look_from, look_at, objects, lights, settings, stats=sampled)
+    assert sampled.shadow_rays <= 4 * (sampled.primary_rays + sampled.secondary_rays)
+    assert abs(sum(fb.data) / sum(expected.data) - 1) < 0.05
+
+    # a bright light below the floor is never picked for floor hits
+    from raytracer.render import direct_light
+    from raytracer.scene import compile_scene
+
+    floor = PointLight(Vec3(0, 3, 0), Vec3(1, 1, 1), 0.01)
+    below = PointLight(Vec3(0, -3, 0), Vec3(1, 1, 1), 1)
+    settings.light_samples = 1
+    scene = compile_scene(objects, [floor, below], settings)
+    p, up, bias = Vec3(0, 0, 0), Vec3(0, 1, 0), Vec3(0, 1e-4, 0)
+    lit = direct_light(scene, 0, -1, p, up, bias)
+    assert lit.x > 0
+    assert all(direct_light(scene, 0, -1, p, up, bias) == lit for _ in range(50))
+
+
+def test_relight_matches_render():
+    import pytest
+
+    from raytracer import relight, render
+    from raytracer.gbuffer import GBuffer
+    from raytracer.lights import DirectionalLight, PointLight
+    from raytracer.linalg import Vec3
+    from raytracer.stats import RenderStats
+
+    look_from, look_at, objects, lights, settings = _small_scene()
+    with pytest.raises(ValueError):
+        relight(GBuffer(), lights, settings)
+
+    for kwargs in ({}, {"vectorize": True}):
+        objects[0].material.albedo = Vec3(0.8, 0.8, 0.8)
+        full, captured = RenderStats(), RenderStats()
+        expected = render(
+            look_from, look_at, objects, lights, settings, stats=full, **kwargs
+        )
+        gbuffer = GBuffer()
+        fb = render(
+            look_from,
+            look_at,
+            objects,
+            lights,
+            settings,
+            stats=captured,
+            gbuffer=gbuffer,
+            **kwargs,
+        )
+        assert fb.data == expected.data
+        assert captured.as_dict() == full.as_dict()
+
+        # new colors and albedo, one light moved
+        objects[0].material.albedo = Vec3(0.3, 0.9, 0.2)
+        new_lights = [
+            DirectionalLight(Vec3(0.5, -1, 0.5), Vec3(1, 0.5, 0.2), 0.7),
+            PointLight(Vec3(1, 4, 2), Vec3(0, 1, 1), 0.9),
+        ]
+        expected = render(look_from, look_at, objects, new_lights, settings, **kwargs)
+        relit = RenderStats()
+        fb = relight(gbuffer, new_lights, settings, stats=relit)
+        assert fb.data == expected.data
+        assert relit.primary_rays == 0
+        assert 0 < relit.shadow_rays < full.shadow_rays
+
+        # the shadows of both lights are known now
+        again = RenderStats()
+        assert relight(gbuffer, new_lights, settings, stats=again).data == fb.data
+        assert again.shadow_rays < relit.shadow_rays
+
+
+def test_framebuffer_matches_lists(tmp_path):
+    from raytracer.framebuffer import Framebuffer
+    from raytracer.linalg import Vec3
+    from raytracer.visualize import row_to_bytes
+
+    img = [[Vec3(i / 3, j / 4, 1.5 - i) for j in range(5)] for i in range(3)]
+    fb = Framebuffer.from_lists(img)
+    assert fb.to_lists() == img
+    assert fb[2][4] == img[2][4]
+    assert [fb.row_bytes(i) for i in range(3)] == [row_to_bytes(r) for r in img]
+
+    shared = Framebuffer.open(str(tmp_path / "fb"), 5, 3)
+    shared.write_tile((1, 1, 4, 3), fb.read_tile((1, 1, 4, 3)))
+    assert Framebuffer.open(str(tmp_path / "fb"), 5, 3)[2][3] == img[2][3]
+    shared.close()
+    assert shared[1][0] == Vec3(0, 0, 0)
+
+
+def test_png_and_ppm_encoders(tmp_path):
+    import struct
+    import zlib
+
+    from raytracer import visualize
+    from raytracer.framebuffer import Framebuffer
+    from raytracer.linalg import Vec3
+
+    # values outside of [0, 1] are clamped
+    img = [[Vec3(i / 7 - 0.5, j / 9, 2.5 - i) for j in range(9)] for i in range(7)]
+    fb = Framebuffer.from_lists(img)
+    rows = [fb.row_bytes(i) for i in range(fb.height)]
+    assert rows[0][:3] == bytes([0, 0, 255])
+
+    for image in (fb, img):
+        visualize.save_png(image, str(tmp_path / "image.png"), compression=0)
+        data = (tmp_path / "image.png").read_bytes()
+        assert data[:8] == b"\x89PNG\r\n\x1a\n"
+        chunks = []
+        k = 8
+        while k < len(data):
+            (n,) = struct.unpack("!I", data[k : k + 4])
+            tag, body = data[k + 4 : k + 8], data[k + 8 : k + 8 + n]
+            (crc,) = struct.unpack("!I", data[k + 8 + n : k + 12 + n])
+            assert crc == zlib.crc32(tag + body)
+            chunks.append((tag, body))
+            k += 12 + n
+        tags = [tag for tag, _ in chunks]
+        assert tags[0] == b"IHDR" and tags[-1] == b"IEND"
+        # 8 bit rgb
+        assert struct.unpack("!2I5B", chunks[0][1]) == (9, 7, 8, 2, 0, 0, 0)
+        pixels = zlib.decompress(b"".join(b for tag, b in chunks if tag == b"IDAT"))
+        stride = 1 + 3 * 9
+        assert len(pixels) == 7 * stride
+        for i in range(7):
+            row = pixels[i * stride : (i + 1) * stride]
+            assert row[0] == 0
+            assert row[1:] == rows[i]
+
+        visualize.save_ppm(image, str(tmp_path / "image.ppm"), binary=True)
+        data = (tmp_path / "image.ppm").read_bytes()
+        header, pixels = data.split(b"\n", 1)
+        assert header.split() == [b"P6", b"9", b"7", b"255"]
+        assert pixels == b"".join(rows)
+
+        visualize.save_ppm(image, str(tmp_path / "image.ppm"))
+        values = (tmp_path / "image.ppm").read_text().split()
+        assert values[:4] == ["P3", "9", "7", "255"]
+        assert bytes(int(v) for v in values[4:]) == b"".join(rows)